@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+ATO Aquarium Monitor - Alert Engine
+License: MIT
+
+Stateful alerting used by ato_monitor.py:
+- One state per alert type (inactive, warning or critical)
+- Separate raise and clear thresholds so a value sitting on a limit does
+  not flap between raised and cleared
+- A rule is only re-evaluated when one of its input signals changed
+- Only transitions are reported, so a two-day low reservoir is recorded
+  and published once instead of on every check
+"""
+
+import threading
+
+_UNSEEN = object()
+
+
+class AlertRule:
+    """One alert type.
+
+    `value(signals)` reduces the signals to a number, or None while the rule
+    does not apply. `levels` lists (severity, raise_at, clear_at) from most
+    to least severe: a level is entered once the value reaches raise_at and
+    left only when it falls back past clear_at. `below=True` is for low-side
+    limits; with `strict=True` a value exactly on a threshold does not count.
+    `message(severity, signals)` builds the text recorded when the alert is
+    raised or changes severity.
+    """
+
+    def __init__(self, key, inputs, value, levels, message, below=False, strict=False):
+        self.key = key
+        self.inputs = tuple(inputs)
+        self.value = value
+        self.levels = list(levels)
+        self.message = message
+        self.below = below
+        self.strict = strict
+        self._rank = {severity: rank for rank, (severity, _, _) in enumerate(self.levels)}
+
+    @classmethod
+    def flag(cls, key, severity, inputs, predicate, message):
+        """A rule that is simply on or off (no thresholds to hold)"""
+        return cls(key, inputs, lambda signals: 1 if predicate(signals) else 0,
+                   [(severity, 1, 1)], lambda _, signals: message(signals))
+
+    def _beyond(self, value, threshold):
+        if self.below:
+            return value < threshold if self.strict else value <= threshold
+        return value > threshold if self.strict else value >= threshold
+
+    def level(self, value, current):
+        """Severity for `value` given the currently active severity (None = inactive)"""
+        if value is None:
+            return None
+        current_rank = self._rank.get(current, len(self.levels))
+        for rank, (severity, raise_at, clear_at) in enumerate(self.levels):
+            # Levels already reached are held until the value passes clear_at
+            threshold = clear_at if current_rank <= rank else raise_at
+            if self._beyond(value, threshold):
+                return severity
+        return None
+
+
+class AlertEngine:
+    """Alert states keyed by rule, updated from a dict of input signals.
+
+    `evaluate()` returns the transitions since the previous call: a dict with
+    the key, the new severity (None when cleared), the previous severity and
+    the message. `active` holds the raised alerts; `active_alerts()` is the
+    cached list behind the alerts topic and only changes with `version`.
+    """
+
+    def __init__(self, rules=()):
+        self.rules = []
+        self.active = {}
+        self.version = 0
+        self._seen = {}
+        self._active_list = []
+        self._lock = threading.Lock()
+        for rule in rules:
+            self.add(rule)
+
+    def add(self, rule):
+        self.rules.append(rule)
+        self._seen.pop(rule.key, None)
+
+    def reset(self):
+        """Forget every active alert and input (the next evaluate() starts afresh)"""
+        with self._lock:
+            self.active.clear()
+            self._seen.clear()
+            self._active_list = []
+            self.version += 1
+
+    def evaluate(self, signals, now=None):
+        with self._lock:
+            transitions = []
+            for rule in self.rules:
+                inputs = tuple(signals.get(name) for name in rule.inputs)
+                if self._seen.get(rule.key, _UNSEEN) == inputs:
+                    continue
+                self._seen[rule.key] = inputs
+
+                current = self.active.get(rule.key)
+                previous = current['severity'] if current else None
+                severity = rule.level(rule.value(signals), previous)
+                if severity == previous:
+                    continue
+
+                if severity is None:
+                    del self.active[rule.key]
+                    message = current['message']
+                else:
+                    message = rule.message(severity, signals)
+                    self.active.pop(rule.key, None)     # move to the end: latest() goes by raise order
+                    self.active[rule.key] = {'key': rule.key, 'severity': severity,
+                                             'message': message, 'since': now}
+                transitions.append({'key': rule.key, 'severity': severity,
+                                    'previous': previous, 'message': message})
+
+            if transitions:
+                self.version += 1
+                order = {rule.key: i for i, rule in enumerate(self.rules)}
+                self._active_list = sorted(self.active.values(),
+                                           key=lambda a: (a['severity'] != 'critical', order[a['key']]))
+            return transitions
+
+    def active_alerts(self):
+        """Active alerts, critical first then in rule order"""
+        return self._active_list
+
+    def latest(self, severity):
+        """The most recently raised active alert of `severity`, or None"""
+        with self._lock:
+            for alert in reversed(list(self.active.values())):
+                if alert['severity'] == severity:
+                    return alert
+        return None
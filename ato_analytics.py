@@ -0,0 +1,750 @@
+#!/usr/bin/env python3
+"""
+ATO Aquarium Monitor - Incremental Analytics
+License: MIT
+
+Streaming statistics used by ato_monitor.py so that publishing stats never
+has to rescan the full history:
+- Multi-window activation counter (1h/6h/24h/7d/30d rates)
+- Sliding-window temperature avg/min/max with monotonic deques
+- Exponentially weighted temperature level, spread and °C/h trend
+- Hourly/daily rollups answering long-range (7d to yearly) queries
+- Per-month usage rollup serving seasonal stats
+- Recursive pump flow calibration updated on each refill
+"""
+
+import bisect
+import math
+import threading
+from array import array
+from collections import deque
+from datetime import date, datetime
+
+# ============================================================================
+# ACTIVATION RATE WINDOWS
+# ============================================================================
+
+
+class ActivationWindows:
+    """Sorted activation timestamps with one expiry cursor per window.
+
+    Each window keeps the index of its oldest activation. Cursors only ever
+    move forward as time advances, so counting every window is O(1)
+    amortised per activation instead of a pass over the history per window.
+    """
+
+    def __init__(self, windows, retention_seconds=None):
+        self.windows = dict(windows)
+        self.retention_seconds = retention_seconds or max(self.windows.values())
+        self._timestamps = array('d')
+        self._start = 0                      # first retained index
+        self._cursors = {name: 0 for name in self.windows}
+        self._last_now = None
+
+    def __len__(self):
+        return len(self._timestamps) - self._start
+
+    def __iter__(self):
+        for index in range(self._start, len(self._timestamps)):
+            yield self._timestamps[index]
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def clear(self):
+        """Forget every activation"""
+        del self._timestamps[:]
+        self._start = 0
+        self._cursors = {name: 0 for name in self.windows}
+        self._last_now = None
+
+    def add(self, timestamp):
+        """Record one activation (epoch seconds)"""
+        if not self._timestamps or timestamp >= self._timestamps[-1]:
+            self._timestamps.append(timestamp)
+        else:
+            # Out-of-order arrival (clock step) - insert and re-seat cursors
+            bisect.insort(self._timestamps, timestamp)
+            self._last_now = None
+
+    def extend(self, timestamps):
+        """Record many activations, e.g. when loading history"""
+        for timestamp in timestamps:
+            self.add(timestamp)
+
+    def oldest(self):
+        """Oldest retained activation, or None"""
+        return self._timestamps[self._start] if self else None
+
+    def latest(self):
+        """Newest activation, or None"""
+        return self._timestamps[-1] if self else None
+
+    def advance(self, now):
+        """Move every window cursor up to `now`, expiring old activations"""
+        timestamps = self._timestamps
+        if self._last_now is None or now < self._last_now:
+            # First use or the clock stepped backwards - seat cursors by binary search
+            for name, seconds in self.windows.items():
+                self._cursors[name] = bisect.bisect_left(timestamps, now - seconds, self._start)
+        else:
+            end = len(timestamps)
+            for name, seconds in self.windows.items():
+                cutoff = now - seconds
+                cursor = self._cursors[name]
+                while cursor < end and timestamps[cursor] < cutoff:
+                    cursor += 1
+                self._cursors[name] = cursor
+        self._last_now = now
+
+        cutoff = now - self.retention_seconds
+        while self._start < len(timestamps) and timestamps[self._start] < cutoff:
+            self._start += 1
+        self._compact()
+
+    def _compact(self):
+        """Drop expired entries once they make up half of the array"""
+        if self._start and self._start * 2 >= len(self._timestamps):
+            shift = self._start
+            del self._timestamps[:shift]
+            self._start = 0
+            for name in self._cursors:
+                self._cursors[name] = max(0, self._cursors[name] - shift)
+
+    def count(self, name, now):
+        """Number of activations within window `name` ending at `now`"""
+        self.advance(now)
+        return len(self._timestamps) - max(self._cursors[name], self._start)
+
+    def counts(self, now):
+        """Activation counts for every window ending at `now`"""
+        self.advance(now)
+        end = len(self._timestamps)
+        return {name: end - max(cursor, self._start) for name, cursor in self._cursors.items()}
+
+
+# ============================================================================
+# TEMPERATURE WINDOWS
+# ============================================================================
+
+
+class RollingWindow:
+    """Sliding time window with a running sum and monotonic min/max deques.
+
+    With ``bucket_seconds`` set, readings are merged into fixed buckets so
+    long windows (7d, 30d) hold a few thousand entries instead of every
+    sample; expiry then happens a whole bucket at a time. Sums are kept in
+    integer hundredths of a degree so they never drift.
+    """
+
+    def __init__(self, seconds, bucket_seconds=0):
+        self.seconds = seconds
+        self.bucket_seconds = bucket_seconds
+        self.count = 0
+        self._total = 0
+        self._buckets = deque()     # [start, count, total] oldest first
+        self._mins = deque()        # (start, value), values increasing
+        self._maxs = deque()        # (start, value), values decreasing
+
+    def add(self, timestamp, value):
+        """Add one reading (timestamps must not go backwards)"""
+        start = timestamp - timestamp % self.bucket_seconds if self.bucket_seconds else timestamp
+        scaled = int(round(value * 100))
+        if self._buckets and self._buckets[-1][0] == start:
+            bucket = self._buckets[-1]
+            bucket[1] += 1
+            bucket[2] += scaled
+        else:
+            self._buckets.append([start, 1, scaled])
+        self.count += 1
+        self._total += scaled
+
+        while self._mins and self._mins[-1][1] >= value:
+            self._mins.pop()
+        if not self._mins or self._mins[-1][0] != start:
+            self._mins.append((start, value))
+        while self._maxs and self._maxs[-1][1] <= value:
+            self._maxs.pop()
+        if not self._maxs or self._maxs[-1][0] != start:
+            self._maxs.append((start, value))
+
+    def expire(self, now):
+        """Drop readings older than the window"""
+        cutoff = now - self.seconds
+        while self._buckets and self._buckets[0][0] < cutoff:
+            _, count, total = self._buckets.popleft()
+            self.count -= count
+            self._total -= total
+        while self._mins and self._mins[0][0] < cutoff:
+            self._mins.popleft()
+        while self._maxs and self._maxs[0][0] < cutoff:
+            self._maxs.popleft()
+
+    def mean(self):
+        return self._total / self.count / 100 if self.count else None
+
+    def minimum(self):
+        return self._mins[0][1] if self._mins else None
+
+    def maximum(self):
+        return self._maxs[0][1] if self._maxs else None
+
+
+class TempWindowStats:
+    """Running avg/min/max for several temperature windows at once.
+
+    ``windows`` maps a suffix such as '24h' to (seconds, bucket_seconds).
+    Each reading is O(1) amortised per window; summaries never rescan.
+    """
+
+    def __init__(self, windows):
+        self.windows = {name: RollingWindow(seconds, bucket)
+                        for name, (seconds, bucket) in windows.items()}
+
+    def clear(self):
+        """Forget every reading"""
+        for name, window in list(self.windows.items()):
+            self.windows[name] = RollingWindow(window.seconds, window.bucket_seconds)
+
+    def add(self, timestamp, value):
+        """Feed one reading to every window"""
+        for window in self.windows.values():
+            window.add(timestamp, value)
+            window.expire(timestamp)
+
+    def rebuild(self, readings):
+        """Reset and replay (timestamp, value) pairs in time order"""
+        self.clear()
+        for timestamp, value in readings:
+            self.add(timestamp, value)
+
+    def summary(self, now):
+        """avg/min/max for every window ending at `now`"""
+        stats = {}
+        for name, window in self.windows.items():
+            window.expire(now)
+            mean, low, high = window.mean(), window.minimum(), window.maximum()
+            stats[f'avg_{name}'] = round(mean, 2) if mean is not None else None
+            stats[f'min_{name}'] = round(low, 2) if low is not None else None
+            stats[f'max_{name}'] = round(high, 2) if high is not None else None
+        return stats
+
+
+TREND_SIGMA = 2.0      # a rate must exceed this many standard errors to count
+
+
+class TrendWindow:
+    """Exponentially weighted level, spread and least squares slope.
+
+    Readings are weighted by exp(-age / time_constant), so nothing is
+    buffered: each reading ages the running sums by the time since the
+    previous one and is added at age 0. Uneven sampling and sensor gaps are
+    handled by the time-based decay. Values are kept relative to the first
+    reading so the sums of squares do not lose precision.
+    """
+
+    def __init__(self, time_constant):
+        self.time_constant = time_constant
+        self.clear()
+
+    def clear(self):
+        self.first = self.last = None
+        self._origin = 0.0
+        self._w = self._w2 = self._t = self._tt = self._y = self._ty = self._yy = 0.0
+
+    def add(self, timestamp, value):
+        """Add one reading (older than the newest one: ignored)"""
+        if self.last is None:
+            self.first = timestamp
+            self._origin = value
+        else:
+            dt = timestamp - self.last
+            if dt < 0:
+                return
+            decay = math.exp(-dt / self.time_constant)
+            # Times are ages relative to the newest reading: shift by dt, then decay
+            self._tt = decay * (self._tt - 2 * dt * self._t + dt * dt * self._w)
+            self._ty = decay * (self._ty - dt * self._y)
+            self._t = decay * (self._t - dt * self._w)
+            self._w *= decay
+            self._w2 *= decay * decay
+            self._y *= decay
+            self._yy *= decay
+        self.last = timestamp
+        y = value - self._origin
+        self._w += 1
+        self._w2 += 1
+        self._y += y
+        self._yy += y * y
+
+    def ready(self):
+        """True once the readings span a full time constant"""
+        return self.last is not None and self.last - self.first >= self.time_constant
+
+    def level(self):
+        return self._y / self._w + self._origin if self._w else None
+
+    def std(self):
+        if not self._w:
+            return None
+        mean = self._y / self._w
+        return math.sqrt(max(0.0, self._yy / self._w - mean * mean))
+
+    def slope(self):
+        """Weighted least squares slope per second, and its approximate standard error"""
+        spread = self._tt - self._t * self._t / self._w if self._w else 0.0
+        if spread <= 0:
+            return None, None
+        slope = (self._ty - self._t * self._y / self._w) / spread
+        intercept = (self._y - slope * self._t) / self._w
+        n = self._w * self._w / self._w2          # effective number of readings
+        if n <= 2:
+            return slope, None
+        residual = max(0.0, self._yy - intercept * self._y - slope * self._ty) / self._w * n / (n - 2)
+        return slope, math.sqrt(residual * self._w / (n * spread))
+
+
+class TempTrend:
+    """Temperature trend over several time constants at once.
+
+    ``windows`` maps a name such as '1h' to (time constant in seconds, rate
+    limit in °C/h). Each reading is O(1) per window. ``anomaly()`` reports the
+    window whose rate is furthest past its limit, counting only rates that
+    stand clear of the noise (TREND_SIGMA standard errors).
+    """
+
+    def __init__(self, windows):
+        self.limits = {name: limit for name, (_, limit) in windows.items()}
+        self.windows = {name: TrendWindow(seconds) for name, (seconds, _) in windows.items()}
+
+    def clear(self):
+        for window in self.windows.values():
+            window.clear()
+
+    def add(self, timestamp, value):
+        for window in self.windows.values():
+            window.add(timestamp, value)
+
+    def rebuild(self, readings):
+        """Reset and replay (timestamp, value) pairs in time order"""
+        self.clear()
+        for timestamp, value in readings:
+            self.add(timestamp, value)
+
+    def rate(self, name):
+        """(°C/h, standard error) of one window, or (None, None) until it is ready"""
+        window = self.windows[name]
+        if not window.ready():
+            return None, None
+        slope, error = window.slope()
+        if slope is None:
+            return None, None
+        return slope * 3600, error * 3600 if error is not None else None
+
+    def summary(self):
+        """level/std/rate per window, e.g. {'1h': {'level': 25.1, 'std': 0.04, 'rate': -0.12}}"""
+        stats = {}
+        for name, window in self.windows.items():
+            level, std = window.level(), window.std()
+            rate, _ = self.rate(name)
+            stats[name] = {'level': round(level, 2) if level is not None else None,
+                           'std': round(std, 3) if std is not None else None,
+                           'rate': round(rate, 2) + 0.0 if rate is not None else None}
+        return stats
+
+    def anomaly(self):
+        """The worst window as {'window', 'rate', 'limit', 'ratio'}; None while no window is ready"""
+        worst = None
+        for name in self.windows:
+            rate, error = self.rate(name)
+            if rate is None:
+                continue
+            significant = error is not None and abs(rate) > TREND_SIGMA * error
+            ratio = abs(rate) / self.limits[name] if significant else 0.0
+            if worst is None or ratio > worst['ratio']:
+                worst = {'window': name, 'rate': rate, 'limit': self.limits[name], 'ratio': ratio}
+        return worst
+
+
+# ============================================================================
+# TIERED ROLLUPS
+# ============================================================================
+
+
+def _merge(buckets):
+    """Combine [count, sum, min, max] buckets into a summary dict"""
+    count, total, low, high = 0, 0.0, None, None
+    for bucket in buckets:
+        if bucket is None or not bucket[0]:
+            continue
+        count += bucket[0]
+        total += bucket[1]
+        low = bucket[2] if low is None else min(low, bucket[2])
+        high = bucket[3] if high is None else max(high, bucket[3])
+    return {'count': count, 'sum': total, 'min': low, 'max': high,
+            'mean': total / count if count else None}
+
+
+class TieredRollup:
+    """Hourly and daily (count, sum, min, max) summaries of one series.
+
+    Raw data stays in the short-lived structures above; every value is also
+    folded into an hourly bucket (kept ``hourly_days``) and a local-calendar
+    daily bucket (kept ``daily_days``), so weeks to years of history cost a
+    few thousand small lists. Window queries merge the closed hours once per
+    hour and then only add the open one, so they are constant time between
+    hour boundaries. ``latest`` is the newest timestamp folded in, letting a
+    reloaded rollup be topped up from raw data without double counting.
+    """
+
+    def __init__(self, hourly_days=90, daily_days=1830):
+        self.hourly_days = hourly_days
+        self.daily_days = daily_days
+        self.hourly = {}            # epoch hour start -> [count, sum, min, max]
+        self.daily = {}             # local date ordinal -> [count, sum, min, max]
+        self.latest = None
+        self._hour = None           # hour of the newest bucket written to
+        self._version = 0           # bumped whenever a closed bucket changes
+        self.version = 0            # bumped on every change, for callers caching derived data
+        self._cache = {}
+        self._lock = threading.Lock()   # to_dict() runs on the persistence thread
+
+    @staticmethod
+    def _fold(buckets, key, value):
+        bucket = buckets.get(key)
+        if bucket is None:
+            buckets[key] = [1, value, value, value]
+        else:
+            bucket[0] += 1
+            bucket[1] += value
+            if value < bucket[2]:
+                bucket[2] = value
+            if value > bucket[3]:
+                bucket[3] = value
+
+    def add(self, timestamp, value):
+        """Fold one value in; True when this closed the previous hour"""
+        hour = int(timestamp // 3600) * 3600
+        with self._lock:
+            self._fold(self.hourly, hour, value)
+            self._fold(self.daily, date.fromtimestamp(timestamp).toordinal(), value)
+            self.version += 1
+            if self.latest is None or timestamp > self.latest:
+                self.latest = timestamp
+            closed = self._hour is not None and hour > self._hour
+            if self._hour is None or hour > self._hour:
+                self._hour = hour
+            if closed or hour < self._hour:
+                self._version += 1
+            if closed:
+                self._prune(hour)
+        return closed
+
+    def backfill(self, readings):
+        """Fold in (timestamp, value) pairs newer than ``latest``"""
+        latest = self.latest
+        for timestamp, value in readings:
+            if latest is None or timestamp > latest:
+                self.add(timestamp, value)
+
+    def _prune(self, now):
+        hour_cutoff = now - self.hourly_days * 86400
+        for key in [k for k in self.hourly if k < hour_cutoff]:
+            del self.hourly[key]
+        day_cutoff = date.fromtimestamp(now).toordinal() - self.daily_days
+        for key in [k for k in self.daily if k < day_cutoff]:
+            del self.daily[key]
+
+    def window(self, now, seconds):
+        """Summary of the hours overlapping the last `seconds` (hour resolution)"""
+        current = int(now // 3600) * 3600
+        start = int((now - seconds) // 3600) * 3600
+        cache_key = (current, self._version)
+        cached = self._cache.get(seconds)
+        if cached is None or cached[0] != cache_key:
+            closed = [bucket for hour, bucket in list(self.hourly.items()) if start <= hour < current]
+            merged = _merge(closed)
+            cached = self._cache[seconds] = (cache_key, [merged['count'], merged['sum'], merged['min'], merged['max']])
+        return _merge((cached[1], self.hourly.get(current)))
+
+    def day(self, day):
+        """Summary of one local calendar date"""
+        return _merge((self.daily.get(day.toordinal()),))
+
+    def days(self, first, last):
+        """Summary over the dates first..last inclusive"""
+        return _merge(bucket for ordinal, bucket in list(self.daily.items())
+                      if first.toordinal() <= ordinal <= last.toordinal())
+
+    def monthly(self, today, months=12):
+        """{'YYYY-MM': summary} for the last `months` calendar months, oldest first"""
+        cache_key = ('monthly', today, months, self._version, self.daily.get(today.toordinal(), [0])[0])
+        cached = self._cache.get('monthly')
+        if cached is not None and cached[0] == cache_key:
+            return cached[1]
+        year, month = _months_back(today, months - 1)
+        first = date(year, month, 1).toordinal()
+        totals = {}
+        for ordinal, bucket in sorted(self.daily.items()):
+            if ordinal >= first:
+                day = date.fromordinal(ordinal)
+                totals.setdefault(f"{day.year:04d}-{day.month:02d}", []).append(bucket)
+        result = {key: _merge(buckets) for key, buckets in totals.items()}
+        self._cache['monthly'] = (cache_key, result)
+        return result
+
+    def to_dict(self):
+        with self._lock:
+            return {'hourly': [[key] + bucket for key, bucket in self.hourly.items()],
+                    'daily': [[key] + bucket for key, bucket in self.daily.items()],
+                    'latest': self.latest}
+
+    def from_dict(self, data):
+        with self._lock:
+            self.hourly = {int(row[0]): list(row[1:]) for row in data.get('hourly', [])}
+            self.daily = {int(row[0]): list(row[1:]) for row in data.get('daily', [])}
+            self.latest = data.get('latest')
+            self._hour = max(self.hourly) if self.hourly else None
+            self._version += 1
+            self.version += 1
+            self._cache = {}
+
+
+# ============================================================================
+# SEASONAL ROLLUP
+# ============================================================================
+
+SEASONS = ("Spring", "Summer", "Autumn", "Winter")
+
+
+def season_for_month(month):
+    """Season for a calendar month (Northern Hemisphere)"""
+    if month in (12, 1, 2):
+        return "Winter"
+    elif month in (3, 4, 5):
+        return "Spring"
+    elif month in (6, 7, 8):
+        return "Summer"
+    return "Autumn"
+
+
+class SeasonalRollup:
+    """Activation totals and observed days per calendar month.
+
+    Seasonal stats cover the 12 most recent months and are summed from at
+    most 12 month records, cached until the next change. Day counts are the
+    days the monitor actually observed (a bitmask per month) rather than a
+    fixed 91 days per season.
+    """
+
+    MONTHS_KEPT = 12
+
+    def __init__(self):
+        self.months = {}        # (year, month) -> {'activations', 'liters', 'days'}
+        self._cache_key = None
+        self._cache = None
+        self.version = 0
+
+    def _month(self, when):
+        key = (when.year, when.month)
+        record = self.months.get(key)
+        if record is None:
+            record = self.months[key] = {'activations': 0, 'liters': 0.0, 'days': 0}
+        return record
+
+    def record_activation(self, when, liters):
+        """Add one activation of `liters` at datetime `when`"""
+        record = self._month(when)
+        record['activations'] += 1
+        record['liters'] += liters
+        record['days'] |= 1 << when.day
+        self.version += 1
+
+    def mark_day(self, when):
+        """Note that the monitor was running on when's date; True if this is news"""
+        record = self._month(when)
+        bit = 1 << when.day
+        if record['days'] & bit:
+            return False
+        record['days'] |= bit
+        self.version += 1
+        return True
+
+    def observed_days(self):
+        """Every date marked as observed, oldest first"""
+        for (year, month), record in sorted(self.months.items()):
+            for day in range(1, 32):
+                if record['days'] & (1 << day):
+                    yield date(year, month, day)
+
+    def window_start(self, today):
+        """Midnight on the first day of the oldest month kept"""
+        year, month = _months_back(today, self.MONTHS_KEPT - 1)
+        return datetime(year, month, 1)
+
+    def prune(self, today):
+        """Forget months that have rolled out of the 12-month window"""
+        oldest = _months_back(today, self.MONTHS_KEPT - 1)
+        for key in [k for k in self.months if k < oldest]:
+            del self.months[key]
+
+    def seasonal_stats(self, today):
+        """Per-season totals over the last 12 months"""
+        cache_key = (self.version, today.year, today.month)
+        if cache_key == self._cache_key:
+            return self._cache
+
+        self.prune(today)
+        totals = {season: {"activations": 0, "liters": 0.0, "days": 0} for season in SEASONS}
+        for (year, month), record in self.months.items():
+            season = totals[season_for_month(month)]
+            season["activations"] += record['activations']
+            season["liters"] += record['liters']
+            season["days"] += bin(record['days']).count('1')
+
+        seasonal_data = {}
+        for season, total in totals.items():
+            days = total["days"]
+            avg_per_day = round(total["liters"] / days, 2) if days > 0 and total["liters"] > 0 else 0
+            seasonal_data[season] = {
+                "activations": total["activations"],
+                "liters": round(total["liters"], 2),
+                "days": days,
+                "avg_per_day": avg_per_day,
+                "lph": round(avg_per_day / 24, 3) if avg_per_day else 0
+            }
+
+        self._cache_key = cache_key
+        self._cache = seasonal_data
+        return seasonal_data
+
+    def rebuild(self, activation_times, liters_per_activation, today):
+        """Reset from raw activation datetimes, marking every day since the first as observed"""
+        self.months = {}
+        first = None
+        for when in activation_times:
+            self.record_activation(when, liters_per_activation)
+            first = when if first is None else min(first, when)
+        if first is not None:
+            day = first.date()
+            while day <= today.date():
+                self.mark_day(day)
+                day = day.fromordinal(day.toordinal() + 1)
+        self.version += 1
+
+    def to_dict(self):
+        return {'months': self.months}
+
+    def from_dict(self, data):
+        self.months = dict(data.get('months', {}))
+        self.version += 1
+
+
+def _months_back(today, count):
+    """(year, month) of the month `count` months before today's"""
+    index = today.year * 12 + (today.month - 1) - count
+    return index // 12, index % 12 + 1
+
+
+# ============================================================================
+# REFILL CALIBRATION
+# ============================================================================
+
+MONTH_SECONDS = 30 * 86400
+MIN_REFILL_ERROR = 0.05      # liters (1σ): floor for the error of a small refill
+NO_CONFIDENCE_ERROR = 0.2    # relative standard deviation that counts as 0% confidence
+
+
+class FlowCalibration:
+    """Recursive estimate of the pump's delivery rate (liters per second of runtime).
+
+    A scalar Kalman filter: each refill measures the rate as the liters added
+    over the pump runtime accumulated since the previous refill, so every
+    cycle's volume follows from its own runtime instead of a fixed amount per
+    activation. Updates are O(1) and ``variance`` is the posterior variance
+    of the rate. Refills are taken as accurate to `refill_error` (fraction
+    of the amount, 1σ) and the rate may drift by `drift` (fraction, 1σ) per
+    month as the pump wears, so old refills do not pin the estimate.
+    """
+
+    def __init__(self, refill_error=0.05, drift=0.02, runtime_alpha=0.1):
+        self.refill_error = refill_error
+        self.drift = drift
+        self.runtime_alpha = runtime_alpha
+        self.rate = None                 # L/s
+        self.variance = None             # (L/s)²
+        self.mean_runtime = None         # exponential mean of cycle runtimes (s)
+        self.runtime_since_refill = 0.0  # None while cycles since the last refill went untimed
+        self.refills = 0
+        self.updated = None              # epoch seconds of the last refill used
+        self._lock = threading.Lock()    # refills arrive on the MQTT thread
+
+    def add_cycle(self, runtime_seconds):
+        """Account for one pump cycle"""
+        if runtime_seconds <= 0:
+            return
+        with self._lock:
+            if self.runtime_since_refill is not None:
+                self.runtime_since_refill += runtime_seconds
+            if self.mean_runtime is None:
+                self.mean_runtime = runtime_seconds
+            else:
+                self.mean_runtime += self.runtime_alpha * (runtime_seconds - self.mean_runtime)
+
+    def add_refill(self, liters, now):
+        """Update the rate from a refill of `liters`; False when there was no runtime to compare"""
+        with self._lock:
+            runtime, self.runtime_since_refill = self.runtime_since_refill, 0.0
+            if not runtime or liters <= 0:
+                return False
+            noise = max(self.refill_error * liters, MIN_REFILL_ERROR) ** 2
+            if self.rate is None:
+                self.rate = liters / runtime
+                self.variance = noise / runtime ** 2
+            else:
+                # Predict: the rate may have drifted since the last refill
+                if self.updated is not None and now > self.updated:
+                    self.variance += (self.drift * self.rate) ** 2 * (now - self.updated) / MONTH_SECONDS
+                gain = self.variance * runtime / (runtime ** 2 * self.variance + noise)
+                self.rate += gain * (liters - runtime * self.rate)
+                self.variance *= 1 - gain * runtime
+            self.refills += 1
+            self.updated = now
+            return True
+
+    def cycle_volume(self, runtime_seconds, default=None):
+        """Estimated liters delivered in `runtime_seconds`, or `default` before the first refill"""
+        return self.rate * runtime_seconds if self.rate is not None else default
+
+    def liters_per_activation(self):
+        """Volume of a typical cycle, or None until calibrated"""
+        if self.rate is None or self.mean_runtime is None:
+            return None
+        return self.rate * self.mean_runtime
+
+    def liters_per_activation_variance(self):
+        if self.variance is None or self.mean_runtime is None:
+            return None
+        return self.variance * self.mean_runtime ** 2
+
+    def confidence(self):
+        """0-100 from the relative standard deviation of the rate"""
+        if not self.rate:
+            return 0
+        relative = self.variance ** 0.5 / self.rate
+        return round(max(0.0, 1 - relative / NO_CONFIDENCE_ERROR) * 100)
+
+    def to_dict(self):
+        with self._lock:
+            return {'rate': self.rate, 'variance': self.variance, 'mean_runtime': self.mean_runtime,
+                    'runtime_since_refill': self.runtime_since_refill, 'refills': self.refills,
+                    'updated': self.updated}
+
+    def from_dict(self, data):
+        with self._lock:
+            self.rate = data.get('rate')
+            self.variance = data.get('variance')
+            self.mean_runtime = data.get('mean_runtime')
+            self.runtime_since_refill = data.get('runtime_since_refill', 0.0)
+            self.refills = data.get('refills', 0)
+            self.updated = data.get('updated')
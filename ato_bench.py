@@ -0,0 +1,379 @@
+#!/usr/bin/env python3
+"""
+ATO Aquarium Monitor - Benchmarks
+License: MIT
+
+Micro-benchmarks for the stats, alerting and persistence paths of
+ato_monitor.py, run against synthetic histories on the simulated backends
+(no Pi, sensors or broker needed). Results are written as JSON so runs from
+different commits can be compared:
+
+    python3 ato_bench.py --output before.json
+    git checkout my-branch
+    python3 ato_bench.py --output after.json --compare before.json
+
+Each benchmark reports latency percentiles (ms, garbage collector paused as
+timeit does) and, from one extra traced run, the peak and net memory
+allocated by a single call.
+"""
+
+import argparse
+import fnmatch
+import gc
+import json
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import ato_monitor as monitor
+from ato_analytics import ActivationWindows, TempWindowStats, SeasonalRollup, TieredRollup
+from ato_control import FillControl, FloatFilter
+from ato_hal import InMemoryBroker, SimulatedGPIO
+from ato_mqtt import ChangePublisher
+from ato_pump import PumpCycles
+from ato_sqlite import SQLiteStore, migrate_from_files
+from ato_storage import ActivationLog, TempRingBuffer
+
+DEFAULT_SIZES = (1000, 100000, 1000000)
+HISTORY_SPAN = 30 * 86400       # synthetic data covers the last 30 days
+
+# Same synthetic data in an SQLite database (the monitor itself stays on files)
+sqlite_store = None
+
+# ============================================================================
+# SYNTHETIC STATE
+# ============================================================================
+
+
+def populate(size, data_dir, seed=1):
+    """Fill ato_monitor's globals with `size` activations, readings and records"""
+    rng = random.Random(seed)
+    now = datetime.now().timestamp()
+    start = now - HISTORY_SPAN
+    step = HISTORY_SPAN / size
+
+    for name in [k for k in vars(monitor) if k.endswith('_FILE') and getattr(monitor, k)]:
+        setattr(monitor, name, os.path.join(data_dir, os.path.basename(getattr(monitor, name))))
+    monitor.ACTIVATION_LOG_PREFIX = os.path.join(data_dir, 'ato_history')
+    monitor.setup_state()
+
+    activation_times = [start + i * step for i in range(size)]
+    monitor.activation_history = ActivationWindows(monitor.RATE_WINDOWS, HISTORY_SPAN)
+    monitor.activation_history.extend(activation_times)
+    monitor.activation_log = ActivationLog(monitor.ACTIVATION_LOG_PREFIX,
+                                           segment_seconds=monitor.ACTIVATION_LOG_SEGMENT_DAYS * 86400,
+                                           retention_seconds=HISTORY_SPAN)
+    monitor.activation_log.rewrite(activation_times)
+
+    monitor.seasonal_rollup = SeasonalRollup()
+    monitor.seasonal_rollup.rebuild((datetime.fromtimestamp(t) for t in activation_times),
+                                    monitor.LITERS_PER_ACTIVATION, datetime.now())
+
+    monitor.temp_history = TempRingBuffer(size)
+    monitor.temp_windows = TempWindowStats(monitor.TEMP_STATS_WINDOWS)
+    temp = 25.0
+    for i in range(size):
+        temp = min(29.0, max(23.0, temp + rng.uniform(-0.05, 0.05)))
+        monitor.temp_history.append(start + i * step, round(temp, 2))
+    monitor.temp_windows.rebuild(monitor.temp_history)
+    monitor.activation_rollup = TieredRollup(monitor.ROLLUP_HOURLY_DAYS, monitor.ROLLUP_DAILY_DAYS)
+    monitor.activation_rollup.backfill((t, monitor.LITERS_PER_ACTIVATION) for t in activation_times)
+    monitor.temp_rollup = TieredRollup(monitor.ROLLUP_HOURLY_DAYS, monitor.ROLLUP_DAILY_DAYS)
+    monitor.temp_rollup.backfill(monitor.temp_history)
+    monitor.current_temperature = round(temp, 2)
+    monitor.temp_sensor_available = True
+
+    monitor.alerts_history = [{
+        'timestamp': datetime.fromtimestamp(start + i * step).isoformat(),
+        'severity': 'warning' if i % 5 else 'critical',
+        'message': f"Synthetic alert {i}",
+        'season': 'Autumn',
+        'reservoir_level': 12.5,
+        'activations_today': i % 10
+    } for i in range(size)]
+    monitor.pump_performance_history = [{
+        'timestamp': datetime.fromtimestamp(start + i * step).isoformat(),
+        'runtime_seconds': round(rng.uniform(5, 15), 1),
+        'volume_liters': 1.0,
+        'flow_rate_lph': 360.0,
+        'season': 'Autumn',
+        'reservoir_level_before': 13.5,
+        'reservoir_level_after': 12.5
+    } for i in range(size)]
+    # Pump health analyses years of cycles: spread them over five years
+    pump_span = 5 * 365 * 86400
+    monitor.pump_cycles = PumpCycles(pump_span)
+    monitor.pump_cycles.extend((now - pump_span + pump_span * i / size, rng.uniform(5, 15), 1.0)
+                               for i in range(size))
+    monitor.calibration_data['refill_history'] = [{
+        'activations': 20, 'liters': 20.0 + i * 0.1, 'lph_calculated': 1.0 + i * 0.005,
+        'date': datetime.now().isoformat()
+    } for i in range(20)]
+
+    monitor.activation_count = 5
+    monitor.daily_usage = 5.0
+    monitor.reservoir_level = 12.5
+    monitor.last_activation_time = datetime.fromtimestamp(activation_times[-1]) if size else datetime.now()
+
+    broker = InMemoryBroker()
+    broker.record = False
+    monitor.client = broker.client()
+    monitor.publisher = ChangePublisher(monitor.client, min_intervals={})
+    monitor.fill = FillControl(SimulatedGPIO(), monitor.client, monitor.publisher, "aquarium/ato",
+                               monitor.MAX_FILL_DURATION, clock=datetime.now)
+    monitor.fill.float_filter = FloatFilter(1)
+
+    monitor.setup_alerts()
+    monitor.setup_persistence(start=False)
+    for save in (monitor.save_seasonal_stats, monitor.save_rollups, monitor.save_calibration, monitor.save_alerts_history,
+                 monitor.save_pump_performance, monitor.save_pump_cycles, monitor.save_temp_history,
+                 monitor.save_temp_calibration):
+        save()
+    monitor.persistence.flush()
+
+    global sqlite_store
+    sqlite_store = SQLiteStore(os.path.join(data_dir, 'ato_data.db'))
+    migrate_from_files(sqlite_store, monitor.activation_log, monitor.LITERS_PER_ACTIVATION,
+                       calibration_file=monitor.CALIBRATION_FILE, seasonal_file=monitor.SEASONAL_STATS_FILE,
+                       alerts_file=monitor.ALERTS_HISTORY_FILE, pump_file=monitor.PUMP_PERFORMANCE_FILE,
+                       pump_cycles_file=monitor.PUMP_CYCLES_FILE,
+                       temp_rings={monitor.PRIMARY_TEMP_SENSOR: monitor.TEMP_HISTORY_RING_FILE},
+                       rollup_file=monitor.ROLLUP_FILE)
+
+
+def _quiet(func):
+    """Run func with stdout discarded (the save/load routines print)"""
+    def call():
+        saved, sys.stdout = sys.stdout, _DEVNULL
+        try:
+            return func()
+        finally:
+            sys.stdout = saved
+    return call
+
+
+_DEVNULL = open(os.devnull, 'w')
+
+
+def _append_reading():
+    last = monitor.temp_history[-1]
+    monitor.temp_history.append(last[0] + 1.0, last[1])
+
+
+def _remove_ring_file():
+    if os.path.exists(monitor.TEMP_HISTORY_RING_FILE):
+        os.remove(monitor.TEMP_HISTORY_RING_FILE)
+
+
+def _publish_payload():
+    now = datetime.now()
+    return monitor.encode_stats(monitor.build_stats(now), now)
+
+
+def _invalidate_pump_health():
+    monitor.pump_cycles.version += 1     # analyse again instead of returning the cached result
+
+
+def _queue_sqlite_reading():
+    sqlite_store.add_temperature(monitor.PRIMARY_TEMP_SENSOR, time.time(), 25.0)
+
+
+def _sqlite_since(seconds):
+    return datetime.now().timestamp() - seconds
+
+
+def _written(save, store):
+    """Mark a store dirty and write it, i.e. the full cost of a save"""
+    def call():
+        save()
+        monitor.persistence.flush([store])
+    return call
+
+
+# name -> (function, untimed hook run before every call or None). save_* time the
+# actual write, not just marking the store dirty.
+BENCHMARKS = {
+    'calculate_lph': (monitor.calculate_lph, None),
+    'calculate_temp_stats': (monitor.calculate_temp_stats, None),
+    'calculate_seasonal_stats': (monitor.calculate_seasonal_stats, None),
+    'check_alerts': (lambda: monitor.check_alerts(), lambda: monitor.publisher.forget()),
+    'pump_analytics': (monitor.calculate_pump_health, _invalidate_pump_health),
+    'publish_stats_payload': (_publish_payload, None),
+    'publish_stats': (lambda: monitor.publish_stats(), lambda: monitor.publisher.forget()),
+    'save_history': (_written(monitor.save_history, 'history'), None),
+    'load_history': (lambda: monitor.load_history(), None),
+    'save_seasonal_stats': (_written(monitor.save_seasonal_stats, 'seasonal'), None),
+    'load_seasonal_stats': (lambda: monitor.load_seasonal_stats(), None),
+    'save_calibration': (_written(monitor.save_calibration, 'calibration'), None),
+    'load_calibration': (lambda: monitor.load_calibration(), None),
+    'save_alerts_history': (_written(monitor.save_alerts_history, 'alerts_history'), None),
+    'load_alerts_history': (lambda: monitor.load_alerts_history(), None),
+    'save_pump_performance': (_written(monitor.save_pump_performance, 'pump_performance'), None),
+    'load_pump_performance': (lambda: monitor.load_pump_performance(), None),
+    'save_pump_cycles': (_written(monitor.save_pump_cycles, 'pump_cycles'), None),
+    'load_pump_cycles': (lambda: monitor.load_pump_cycles(), None),
+    'save_temp_history': (_written(monitor.save_temp_history, 'temp_history'), _append_reading),
+    'save_temp_history_full': (_written(monitor.save_temp_history, 'temp_history'), _remove_ring_file),
+    'load_temp_history': (lambda: monitor.load_temp_history(), None),
+    'save_rollups': (_written(monitor.save_rollups, 'rollups'), None),
+    'load_rollups': (lambda: monitor.load_rollups(), None),
+    'save_temp_calibration': (_written(monitor.save_temp_calibration, 'temp_calibration'), None),
+    'load_temp_calibration': (lambda: monitor.load_temp_calibration(), None),
+    'sqlite_seasonal_months': (lambda: sqlite_store.seasonal_months(_sqlite_since(365 * 86400)), None),
+    'sqlite_recent_alerts': (lambda: sqlite_store.recent_alerts(500), None),
+    'sqlite_flush_reading': (lambda: sqlite_store.flush(), _queue_sqlite_reading),
+}
+
+# ============================================================================
+# MEASUREMENT
+# ============================================================================
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = math.ceil(fraction * len(sorted_values))
+    return sorted_values[min(len(sorted_values), max(1, rank)) - 1]
+
+
+def measure(func, before=None, min_runs=5, max_runs=200, min_time=1.0):
+    """Time func until min_time has passed (within min_runs..max_runs calls)"""
+    func = _quiet(func)
+    before = _quiet(before) if before else None
+    if before:
+        before()
+    func()                          # warm up caches and lazily opened files
+
+    durations = []
+    gc.collect()
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        started = time.perf_counter()
+        while len(durations) < max_runs and (len(durations) < min_runs
+                                             or time.perf_counter() - started < min_time):
+            if before:
+                before()
+            t0 = time.perf_counter_ns()
+            func()
+            durations.append((time.perf_counter_ns() - t0) / 1e6)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    if before:
+        before()
+    tracemalloc.start()
+    baseline, _ = tracemalloc.get_traced_memory()
+    func()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    durations.sort()
+    return {
+        'runs': len(durations),
+        'min_ms': round(durations[0], 4),
+        'p50_ms': round(percentile(durations, 0.50), 4),
+        'p90_ms': round(percentile(durations, 0.90), 4),
+        'p99_ms': round(percentile(durations, 0.99), 4),
+        'max_ms': round(durations[-1], 4),
+        'mean_ms': round(sum(durations) / len(durations), 4),
+        'alloc_peak_bytes': peak - baseline,
+        'alloc_net_bytes': current - baseline
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run(sizes, pattern='*', **options):
+    """Run every benchmark matching pattern at each size; returns the JSON report"""
+    results = []
+    for size in sizes:
+        data_dir = tempfile.mkdtemp(prefix='ato-bench-')
+        try:
+            setup_started = time.perf_counter()
+            _quiet(lambda: populate(size, data_dir))()
+            print(f"size {size}: synthetic state built in {time.perf_counter() - setup_started:.1f}s",
+                  file=sys.stderr)
+            for name, (func, before) in BENCHMARKS.items():
+                if not fnmatch.fnmatch(name, pattern):
+                    continue
+                result = {'name': name, 'size': size, **measure(func, before, **options)}
+                results.append(result)
+                print(f"  {name:<26} p50 {result['p50_ms']:>10.3f} ms  p99 {result['p99_ms']:>10.3f} ms"
+                      f"  peak {result['alloc_peak_bytes'] / 1024:>10.1f} KiB", file=sys.stderr)
+        finally:
+            monitor.activation_log.close()
+            if sqlite_store is not None:
+                sqlite_store.close()
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'platform': platform.platform()
+        },
+        'results': results
+    }
+
+
+def compare(report, baseline):
+    """Print p50 ratios against a previous report (>1.0 means slower now)"""
+    previous = {(r['name'], r['size']): r for r in baseline['results']}
+    print(f"{'benchmark':<26} {'size':>8} {'p50 before':>12} {'p50 now':>12} {'ratio':>7}", file=sys.stderr)
+    for result in report['results']:
+        old = previous.get((result['name'], result['size']))
+        if old is None or not old['p50_ms']:
+            continue
+        ratio = result['p50_ms'] / old['p50_ms']
+        print(f"{result['name']:<26} {result['size']:>8} {old['p50_ms']:>12.3f} {result['p50_ms']:>12.3f}"
+              f" {ratio:>7.2f}", file=sys.stderr)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark ato_monitor's stats and persistence paths")
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help='comma-separated history sizes (default: %(default)s)')
+    parser.add_argument('--only', default='*', help='glob of benchmark names to run')
+    parser.add_argument('--min-time', type=float, default=1.0, help='seconds to spend per benchmark')
+    parser.add_argument('--max-runs', type=int, default=200, help='maximum timed calls per benchmark')
+    parser.add_argument('--output', help='write the JSON report here (default: stdout)')
+    parser.add_argument('--compare', help='previous JSON report to compare against')
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    report = run(sizes, args.only, min_time=args.min_time, max_runs=args.max_runs)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+ATO Aquarium Monitor - Fill Control
+License: MIT
+
+Float switch, pump and fill-timeout safety of one tank, shared by the
+single-tank monitor (ato_monitor.py, one FillControl) and multi-tank mode
+(ato_tanks.py, one per tank):
+- FloatFilter debounces the float switch with separate start/stop holds
+- FillControl switches the pump, enforces the tank's max_fill_duration with
+  an emergency stop, runs the enable and pump_manual commands and tells the
+  control loop when it next has to wake
+
+What a mode records about a fill (usage, history, calibration, alerts) stays
+with the owner, which gets every finished pump run through ``on_cycle``.
+"""
+
+
+class FloatFilter:
+    """Debounce filter for the float switch.
+
+    A new level is accepted only after it has been stable for its hold time.
+    Separate hold times for low (start pump) and high (stop pump) give
+    hysteresis: ripples must persist before a fill starts, while a rising
+    float stops the pump almost immediately.
+    """
+
+    def __init__(self, initial_state, start_hold=0.0, stop_hold=0.0):
+        self.state = initial_state
+        self.start_hold = start_hold
+        self.stop_hold = stop_hold
+        self._candidate = None
+        self._since = None
+        self.changed_at = None      # when the last accepted level was first seen
+
+    def update(self, level, now):
+        """Feed a raw reading; returns the new state when one is accepted"""
+        if level == self.state:
+            self._candidate = None
+            return None
+        if level != self._candidate:
+            self._candidate = level
+            self._since = now
+        if now - self._since >= self._hold(level):
+            self.state = level
+            self.changed_at = self._since
+            self._candidate = None
+            return level
+        return None
+
+    def _hold(self, level):
+        return self.start_hold if level == 0 else self.stop_hold
+
+    def pending_deadline(self):
+        """Monotonic time at which a pending level will be accepted, or None"""
+        if self._candidate is None:
+            return None
+        return self._since + self._hold(self._candidate)
+
+
+class FillControl:
+    """One float switch and pump with a fill time limit.
+
+    `prefix` is the tank's topic prefix (aquarium/ato, aquarium/<tank>) and
+    `label` starts its console lines. `clock` is the wall clock.
+    `on_cycle(runtime_seconds, deducted)` is called for every pump run that
+    ends, with the liters its activation counted up front (0 for a manual run).
+    """
+
+    __slots__ = ('gpio', 'client', 'publisher', 'prefix', 'label', 'max_fill_duration', 'clock', 'on_cycle',
+                 'float_filter', 'pump_running', 'fill_started', 'fill_duration', 'fill_deducted',
+                 'stuck_alert_sent', 'monitoring_enabled', 'disabled_reason')
+
+    def __init__(self, gpio, client, publisher, prefix, max_fill_duration, clock, on_cycle=None, label=''):
+        self.gpio = gpio
+        self.client = client
+        self.publisher = publisher
+        self.prefix = prefix
+        self.label = label
+        self.max_fill_duration = max_fill_duration
+        self.clock = clock
+        self.on_cycle = on_cycle
+        self.float_filter = None        # set once edge detection is known
+        self.pump_running = False
+        self.fill_started = None        # wall clock datetime
+        self.fill_duration = 0.0
+        self.fill_deducted = 0.0        # liters the running fill already counted
+        self.stuck_alert_sent = False   # latched from the emergency stop until the next fill
+        self.monitoring_enabled = True
+        self.disabled_reason = None
+
+    # Pump --------------------------------------------------------------------
+
+    def start_pump(self, deducted=0.0):
+        """Switch the pump on; `deducted` is what an activation counts up front"""
+        self.gpio.set_pump(True)
+        self.pump_running = True
+        self.fill_started = self.clock()
+        self.fill_deducted = deducted
+        self.stuck_alert_sent = False
+        self.client.publish(f"{self.prefix}/pump_state", "ON")
+        print(f"🔵 {self.label}Pump STARTED")
+
+    def stop_pump(self):
+        """Switch the pump off and hand the finished run to on_cycle"""
+        self.gpio.set_pump(False)
+        self.pump_running = False
+        if self.fill_started is not None:
+            self.fill_duration = (self.clock() - self.fill_started).total_seconds()
+            deducted, self.fill_deducted = self.fill_deducted, 0.0
+            self.fill_started = None
+            if self.on_cycle is not None:
+                self.on_cycle(self.fill_duration, deducted)
+            print(f"🔴 {self.label}Pump STOPPED - ran for {self.fill_duration:.1f}s")
+        self.client.publish(f"{self.prefix}/pump_state", "OFF")
+
+    # Control loop ------------------------------------------------------------
+
+    def update(self, level, now):
+        """Debounce a raw float reading; returns the newly accepted level or None.
+
+        While monitoring is disabled the pump is kept off and nothing is accepted.
+        """
+        if not self.monitoring_enabled:
+            if self.pump_running:
+                self.stop_pump()
+            self.fill_duration = 0.0
+            return None
+        return self.float_filter.update(level, now)
+
+    def float_changed(self, state, liters):
+        """Start a fill for a low float (0), counting `liters` up front, or end it for a high one.
+
+        Returns 'start' or 'stop', or None when the pump was already that way.
+        """
+        if state == 0:
+            if self.pump_running:
+                return None
+            self.start_pump(liters)
+            self.client.publish(f"{self.prefix}/state", "filling")
+            return 'start'
+        if not self.pump_running:
+            return None
+        self.stop_pump()
+        self.client.publish(f"{self.prefix}/state", "idle")
+        return 'stop'
+
+    def check_timeout(self):
+        """Track the running fill; past max_fill_duration stop the pump, disable and return True"""
+        if self.fill_started is None:
+            return False
+        self.fill_duration = (self.clock() - self.fill_started).total_seconds()
+        if self.fill_duration <= self.max_fill_duration or self.stuck_alert_sent:
+            return False
+        self.stuck_alert_sent = True
+        self.stop_pump()
+        self._disabled("Emergency stop - stuck float/pump timeout", "emergency_stopped")
+        print(f"🚨 {self.label}EMERGENCY STOP - monitoring disabled for safety")
+        return True
+
+    def timeout_message(self):
+        return pump_timeout_message(self.fill_duration, self.max_fill_duration)
+
+    def needs_attention(self):
+        """True while the control loop has to keep stepping this tank without a float edge"""
+        return self.pump_running or self.float_filter.pending_deadline() is not None
+
+    def next_deadline(self, now):
+        """Monotonic time of the pending debounce or the fill timeout (whichever is first), or None"""
+        deadline = self.float_filter.pending_deadline()
+        if self.fill_started is not None:
+            # Wake right as the fill timeout would trip
+            elapsed = (self.clock() - self.fill_started).total_seconds()
+            timeout = now + max(0.0, self.max_fill_duration - elapsed) + 0.05
+            deadline = timeout if deadline is None else min(deadline, timeout)
+        return deadline
+
+    # Commands ----------------------------------------------------------------
+
+    def enable(self):
+        """Resume automatic fills; False if they were not disabled"""
+        if self.monitoring_enabled:
+            return False
+        self.monitoring_enabled = True
+        self.disabled_reason = None
+        self.client.publish(f"{self.prefix}/state", "enabled")
+        self.publisher.publish(f"{self.prefix}/monitoring_enabled", "ON")
+        print(f"✅ {self.label}ATO monitoring ENABLED")
+        return True
+
+    def disable(self, reason, state="disabled"):
+        """Stop the pump and automatic fills; False if they were already disabled"""
+        if not self.monitoring_enabled:
+            return False
+        self.stop_pump()
+        self._disabled(reason, state)
+        return True
+
+    def _disabled(self, reason, state):
+        self.monitoring_enabled = False
+        self.disabled_reason = reason
+        self.client.publish(f"{self.prefix}/state", state)
+        self.publisher.publish(f"{self.prefix}/monitoring_enabled", "OFF")
+
+    def command(self, command, payload):
+        """Run an 'enable' or 'pump_manual' command (lower-cased payload); False for any other command"""
+        if command == 'enable':
+            if payload in ('on', 'true'):
+                self.enable()
+            elif payload in ('off', 'false') and self.disable("Manual disable"):
+                print(f"🛑 {self.label}ATO monitoring DISABLED - Manual")
+        elif command == 'pump_manual':
+            if payload == 'on' and not self.pump_running:
+                self.start_pump()
+                self.client.publish(f"{self.prefix}/state", "manual_fill")
+            elif payload == 'off' and self.pump_running:
+                self.stop_pump()
+                self.client.publish(f"{self.prefix}/state", "idle")
+        else:
+            return False
+        return True
+
+    # Stats and alerts --------------------------------------------------------
+
+    def stats(self):
+        return {
+            "monitoring_enabled": self.monitoring_enabled,
+            "disabled_reason": self.disabled_reason if self.disabled_reason else "N/A",
+            "filling_duration": round(self.fill_duration, 1),
+            "pump_running": self.pump_running,
+        }
+
+    def alert_signals(self):
+        """Fill inputs of the alert rules, with this tank's own time limit"""
+        return {
+            'monitoring_enabled': self.monitoring_enabled,
+            'disabled_reason': self.disabled_reason,
+            'pump_timeout': self.stuck_alert_sent,
+            'fill_elapsed': self.fill_duration,
+            'max_fill_duration': self.max_fill_duration,
+        }
+
+
+def pump_timeout_message(elapsed, limit):
+    return f"🚨 PUMP TIMEOUT! Running for {int(elapsed)}s (max: {limit}s). EMERGENCY STOP ACTIVATED!"
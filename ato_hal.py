@@ -0,0 +1,339 @@
+#!/usr/bin/env python3
+"""
+ATO Aquarium Monitor - Hardware Abstraction Layer
+License: MIT
+
+Pluggable backends for everything ato_monitor.py talks to:
+- GPIO: float switch input and pump relay output
+- 1-Wire: DS18B20 sensors under /sys/bus/w1/devices
+- MQTT: broker connection
+
+Each has a real implementation and an in-process simulator (scripted float,
+fake w1 sysfs tree, in-memory broker) so the control loop, alerting and
+persistence can run and be profiled on an ordinary Linux box:
+
+    ATO_BACKEND=sim python3 ato_monitor.py
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import time
+from collections import namedtuple
+
+from ato_sensors import W1_DEVICES, discover_sensors, w1_slave_reader, bulk_trigger_for
+
+Backends = namedtuple('Backends', ['gpio', 'w1', 'mqtt'])
+
+# ============================================================================
+# GPIO BACKENDS
+# ============================================================================
+
+
+class RPiGPIO:
+    """Float switch (pull-up input) and active-low pump relay via RPi.GPIO"""
+
+    def __init__(self, float_pin, pump_pin):
+        import RPi.GPIO as GPIO
+        self._gpio = GPIO
+        self.float_pin = float_pin
+        self.pump_pin = pump_pin
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setup(float_pin, GPIO.IN, pull_up_down=GPIO.PUD_UP)
+        GPIO.setup(pump_pin, GPIO.OUT)
+        GPIO.output(pump_pin, GPIO.HIGH)  # Start with pump OFF
+
+    def read_float(self):
+        """Float level: 0 = water low, 1 = water OK"""
+        return self._gpio.input(self.float_pin)
+
+    def set_pump(self, on):
+        self._gpio.output(self.pump_pin, self._gpio.LOW if on else self._gpio.HIGH)
+
+    def add_float_callback(self, callback):
+        """Call callback(channel) on every float edge; raises if unsupported"""
+        self._gpio.add_event_detect(self.float_pin, self._gpio.BOTH, callback=callback)
+
+    def start(self):
+        pass
+
+    def cleanup(self):
+        self._gpio.cleanup()
+
+
+class SimulatedGPIO:
+    """In-process float switch and pump relay.
+
+    ``script`` is a list of (seconds, level) steps played on a background
+    thread once ``start()`` is called. With ``fill_seconds`` set the float
+    behaves like a real tank: it rises ``fill_seconds`` after the pump starts.
+    """
+
+    def __init__(self, float_level=1, script=None, fill_seconds=None):
+        self.float_level = float_level
+        self.script = list(script or [])
+        self.fill_seconds = fill_seconds
+        self.pump_on = False
+        self.pump_events = []           # (monotonic time, on)
+        self._callbacks = []
+        self._stopped = threading.Event()
+
+    def read_float(self):
+        return self.float_level
+
+    def set_float(self, level):
+        """Move the simulated float and fire edge callbacks"""
+        if level == self.float_level:
+            return
+        self.float_level = level
+        for callback in list(self._callbacks):
+            callback(None)
+
+    def set_pump(self, on):
+        if on == self.pump_on:
+            return
+        self.pump_on = on
+        self.pump_events.append((time.monotonic(), on))
+        if on and self.fill_seconds is not None:
+            timer = threading.Timer(self.fill_seconds, self.set_float, args=(1,))
+            timer.daemon = True
+            timer.start()
+
+    def add_float_callback(self, callback):
+        self._callbacks.append(callback)
+
+    def start(self):
+        """Play the float script on a background thread"""
+        if not self.script:
+            return
+        thread = threading.Thread(target=self._play, name='sim-float', daemon=True)
+        thread.start()
+
+    def _play(self):
+        for delay, level in self.script:
+            if self._stopped.wait(delay):
+                return
+            self.set_float(level)
+
+    def cleanup(self):
+        self._stopped.set()
+
+
+# ============================================================================
+# 1-WIRE BACKENDS
+# ============================================================================
+
+
+class SysfsW1:
+    """DS18B20 sensors exposed by the w1_therm kernel driver"""
+
+    def __init__(self, base=W1_DEVICES):
+        self.base = base
+
+    def discover(self):
+        return discover_sensors(self.base)
+
+    def reader(self, device_path):
+        return w1_slave_reader(device_path)
+
+    def bulk_trigger(self):
+        return bulk_trigger_for(self.base)
+
+
+class FakeW1Tree(SysfsW1):
+    """Temporary directory laid out like /sys/bus/w1/devices.
+
+    Sensors are plain files, so the real sysfs code paths are exercised.
+    Use ``set_temperature()`` to change what a sensor reports.
+    """
+
+    def __init__(self, temperatures=None, bulk_read=True):
+        super().__init__(tempfile.mkdtemp(prefix='ato-w1-'))
+        if bulk_read:
+            master = os.path.join(self.base, 'w1_bus_master1')
+            os.makedirs(master)
+            open(os.path.join(master, 'therm_bulk_read'), 'w').close()
+        for sensor_id, temperature in (temperatures or {'28-000000000001': 25.0}).items():
+            self.set_temperature(sensor_id, temperature)
+
+    def set_temperature(self, sensor_id, temperature, crc_ok=True):
+        """Write a w1_slave file reporting `temperature` (°C)"""
+        device = os.path.join(self.base, sensor_id)
+        os.makedirs(device, exist_ok=True)
+        millidegrees = int(round(temperature * 1000))
+        crc = 'YES' if crc_ok else 'NO'
+        with open(os.path.join(device, 'w1_slave'), 'w') as f:
+            f.write(f"72 01 4b 46 7f ff 0e 10 57 : crc=57 {crc}\n")
+            f.write(f"72 01 4b 46 7f ff 0e 10 57 t={millidegrees}\n")
+
+    def remove(self):
+        shutil.rmtree(self.base, ignore_errors=True)
+
+
+# ============================================================================
+# MQTT BACKENDS
+# ============================================================================
+
+MQTTMessage = namedtuple('MQTTMessage', ['topic', 'payload', 'qos', 'retain'])
+
+
+def create_paho_client(username=None, password=None):
+    """paho-mqtt client with credentials set (not yet connected)"""
+    import paho.mqtt.client as mqtt
+    client = mqtt.Client()
+    if username:
+        client.username_pw_set(username, password)
+    return client
+
+
+def topic_matches(pattern, topic):
+    """MQTT topic filter match supporting '+' and '#' wildcards"""
+    pattern_parts = pattern.split('/')
+    topic_parts = topic.split('/')
+    for index, part in enumerate(pattern_parts):
+        if part == '#':
+            return True
+        if index >= len(topic_parts):
+            return False
+        if part != '+' and part != topic_parts[index]:
+            return False
+    return len(pattern_parts) == len(topic_parts)
+
+
+class InMemoryBroker:
+    """Minimal broker delivering messages between InMemoryClients in-process"""
+
+    def __init__(self):
+        self._clients = []
+        self.retained = {}
+        self.messages = []              # every (topic, payload) published
+        self.record = True
+        self._lock = threading.RLock()
+
+    def client(self):
+        """Create a client attached to this broker"""
+        client = InMemoryClient(self)
+        with self._lock:
+            self._clients.append(client)
+        return client
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        message = MQTTMessage(topic, payload, qos, retain)
+        with self._lock:
+            if self.record:
+                self.messages.append((topic, payload))
+            if retain:
+                self.retained[topic] = message
+            clients = list(self._clients)
+        for client in clients:
+            client._deliver(message)
+
+
+class InMemoryClient:
+    """paho-compatible subset of mqtt.Client backed by an InMemoryBroker"""
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.on_message = None
+        self.on_connect = None
+        self.on_disconnect = None
+        self.userdata = None
+        self.connected = False
+        self._subscriptions = set()
+
+    @staticmethod
+    def _encode(payload):
+        if payload is None:
+            return b''
+        if isinstance(payload, bytes):
+            return payload
+        if isinstance(payload, bytearray):
+            return bytes(payload)
+        return str(payload).encode('utf-8')
+
+    def username_pw_set(self, username, password=None):
+        pass
+
+    def connect(self, host=None, port=1883, keepalive=60):
+        self.connected = True
+        if self.on_connect:
+            self.on_connect(self, self.userdata, {}, 0)
+        return 0
+
+    def connect_async(self, host=None, port=1883, keepalive=60):
+        return self.connect(host, port, keepalive)
+
+    def reconnect(self):
+        return self.connect()
+
+    def disconnect(self):
+        self.connected = False
+        if self.on_disconnect:
+            self.on_disconnect(self, self.userdata, 0)
+        return 0
+
+    def reconnect_delay_set(self, min_delay=1, max_delay=120):
+        pass
+
+    def is_connected(self):
+        return self.connected
+
+    def loop_start(self):
+        return 0
+
+    def loop_stop(self, force=False):
+        return 0
+
+    def subscribe(self, topic, qos=0):
+        self._subscriptions.add(topic)
+        for retained_topic, message in list(self.broker.retained.items()):
+            if topic_matches(topic, retained_topic):
+                self._deliver(message)
+        return 0, len(self._subscriptions)
+
+    def unsubscribe(self, topic):
+        self._subscriptions.discard(topic)
+        return 0, len(self._subscriptions)
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        self.broker.publish(topic, self._encode(payload), qos, retain)
+        return 0, 0
+
+    def _deliver(self, message):
+        if self.on_message is None:
+            return
+        if any(topic_matches(pattern, message.topic) for pattern in self._subscriptions):
+            self.on_message(self, self.userdata, message)
+
+
+# ============================================================================
+# BACKEND SELECTION
+# ============================================================================
+
+
+def create_gpio(kind, float_pin, pump_pin):
+    """One float switch and pump relay: 'pi' for real hardware, 'sim' for the simulator"""
+    if kind == 'pi':
+        return RPiGPIO(float_pin, pump_pin)
+    if kind == 'sim':
+        # A tank that needs topping up every 10 minutes and fills in 8 seconds
+        return SimulatedGPIO(fill_seconds=8, script=[(600, 0)] * 10000)
+    raise ValueError(f"Unknown hardware backend: {kind!r} (expected 'pi' or 'sim')")
+
+
+def create_backends(kind, float_pin, pump_pin, mqtt_user=None, mqtt_pass=None):
+    """Build the backend set: 'pi' for real hardware, 'sim' for the simulators"""
+    gpio = create_gpio(kind, float_pin, pump_pin)
+    if kind == 'pi':
+        return Backends(gpio, SysfsW1(), create_paho_client(mqtt_user, mqtt_pass))
+    return Backends(gpio, FakeW1Tree(), InMemoryBroker().client())
+
+
+def create_tank_backends(kind, pins, mqtt_user=None, mqtt_pass=None, sensor_ids=()):
+    """Backends for several tanks: a GPIO per name in `pins` ({name: (float_pin, pump_pin)}), shared 1-Wire and MQTT"""
+    gpios = {name: create_gpio(kind, float_pin, pump_pin) for name, (float_pin, pump_pin) in pins.items()}
+    if kind == 'pi':
+        return Backends(gpios, SysfsW1(), create_paho_client(mqtt_user, mqtt_pass))
+    w1 = FakeW1Tree({sensor_id: 25.0 for sensor_id in sensor_ids}) if sensor_ids else FakeW1Tree()
+    return Backends(gpios, w1, InMemoryBroker().client())
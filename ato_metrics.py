@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+"""
+ATO Aquarium Monitor - Metrics Endpoint
+License: MIT
+
+Optional Prometheus / OpenMetrics exporter, enabled with METRICS_PORT:
+- Counters and gauges read from the monitor's own state at scrape time, so
+  they cost nothing between scrapes
+- Latency histograms for the hot-path functions, every control loop
+  iteration, DS18B20 reads and store writes
+- Pump reaction time: float change seen to relay switched, debounce included
+
+Only the standard library is used. Observing a histogram is a bisect and an
+add under a lock; the text format is built on the HTTP server thread.
+"""
+
+import bisect
+import functools
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Bucket upper bounds (seconds)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SENSOR_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 0.75, 1.0, 1.5, 2.5, 5.0)     # a conversion takes ~750ms
+REACTION_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.15, 0.2, 0.3, 0.5, 1.0, 2.5, 5.0)
+
+PROMETHEUS_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+OPENMETRICS_TYPE = 'application/openmetrics-text; version=1.0.0; charset=utf-8'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, bool):
+        return '1' if value else '0'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+               for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+# ============================================================================
+# METRIC TYPES
+# ============================================================================
+
+
+class Histogram:
+    """Cumulative-bucket histogram, optionally split by label values.
+
+    ``observe(value, *labelvalues)`` is safe from any thread. ``time()``
+    is a context manager timing its block with the monotonic perf counter.
+    """
+
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}       # labelvalues -> [per-bucket counts (+Inf last), sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, *labelvalues):
+        return _Timer(self, labelvalues)
+
+    def snapshot(self):
+        """{labelvalues: (cumulative bucket counts, sum, count)}"""
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        result = {}
+        for labels, (counts, total, count) in series.items():
+            running, cumulative = 0, []
+            for bucket_count in counts:
+                running += bucket_count
+                cumulative.append(running)
+            result[labels] = (cumulative, total, count)
+        return result
+
+    def samples(self):
+        bounds = self.buckets + (float('inf'),)
+        for labels, (cumulative, total, count) in sorted(self.snapshot().items()):
+            for bound, value in zip(bounds, cumulative):
+                yield (f'{self.name}_bucket{_format_labels(self.labelnames, labels, ("le", _format_value(bound)))}'
+                       f' {value}')
+            yield f'{self.name}_sum{_format_labels(self.labelnames, labels)} {_format_value(total)}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, labels)} {count}'
+
+
+class _Timer:
+    __slots__ = ('histogram', 'labelvalues', 'started')
+
+    def __init__(self, histogram, labelvalues):
+        self.histogram = histogram
+        self.labelvalues = labelvalues
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, *self.labelvalues)
+        return False
+
+
+class CallbackMetric:
+    """Counter or gauge whose value is read by ``collect()`` at scrape time.
+
+    ``collect`` returns a number (or None to leave the sample out), or for
+    labelled metrics a dict of {labelvalues tuple: number}. Counters are
+    named without ``_total``; the suffix is added to their samples.
+    """
+
+    def __init__(self, kind, name, help, collect, labelnames=()):
+        self.kind = kind
+        self.name = name
+        self.help = help
+        self.collect = collect
+        self.labelnames = tuple(labelnames)
+
+    def samples(self):
+        values = self.collect()
+        if not self.labelnames:
+            values = {(): values}
+        name = self.name + '_total' if self.kind == 'counter' else self.name
+        for labels, value in sorted(values.items()):
+            if value is not None:
+                yield f'{name}{_format_labels(self.labelnames, labels)} {_format_value(value)}'
+
+
+# ============================================================================
+# REGISTRY
+# ============================================================================
+
+
+class Registry:
+    """Metrics in exposition order, rendered as Prometheus text or OpenMetrics"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        metric = Histogram(name, help, labelnames, buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, collect, labelnames=()):
+        self.metrics.append(CallbackMetric('counter', name, help, collect, labelnames))
+
+    def gauge(self, name, help, collect, labelnames=()):
+        self.metrics.append(CallbackMetric('gauge', name, help, collect, labelnames))
+
+    def render(self, openmetrics=False):
+        lines = []
+        for metric in self.metrics:
+            try:
+                samples = list(metric.samples())
+            except Exception as e:
+                # One broken collector must not take the whole scrape down
+                print(f"⚠️  Error collecting metric {metric.name}: {e}")
+                continue
+            # Prometheus text names the counter family by its sample; OpenMetrics without _total
+            family = metric.name + '_total' if metric.kind == 'counter' and not openmetrics else metric.name
+            lines.append(f'# HELP {family} {metric.help}')
+            lines.append(f'# TYPE {family} {metric.kind}')
+            lines.extend(samples)
+        if openmetrics:
+            lines.append('# EOF')
+        return '\n'.join(lines) + '\n'
+
+
+def timed(histogram, func, *labelvalues):
+    """func wrapped to observe its run time into histogram (also when it raises)"""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - started, *labelvalues)
+    return wrapper
+
+
+def instrument(owner, histogram, names, *labelvalues):
+    """Replace each owner.<name> (module function or bound method) with a timed
+    wrapper labelled (*labelvalues, name). Callers that look the name up at
+    call time - module globals, self.method() - are timed from then on.
+    """
+    for name in names:
+        setattr(owner, name, timed(histogram, getattr(owner, name), *labelvalues, name))
+
+
+# ============================================================================
+# MONITOR METRICS AND HTTP ENDPOINT
+# ============================================================================
+
+
+class MonitorMetrics(Registry):
+    """Registry with the histograms shared by the single- and multi-tank modes.
+
+    Per-tank series carry a ``tank`` label: "ato" in single-tank mode (its
+    topic prefix), the tank name in multi-tank mode.
+    """
+
+    def __init__(self):
+        super().__init__()
+        started = time.time()
+        self.gauge('ato_process_start_time_seconds', 'Start time of the process (Unix time)', lambda: started)
+        self.loop_seconds = self.histogram(
+            'ato_loop_iteration_seconds', 'Control loop iteration run time, sleep excluded')
+        self.function_seconds = self.histogram(
+            'ato_function_duration_seconds', 'Hot-path function run time', ('function',))
+        self.store_write_seconds = self.histogram(
+            'ato_store_write_seconds', 'Write-behind store save time', ('store',))
+        self.sensor_read_seconds = self.histogram(
+            'ato_sensor_read_seconds', 'DS18B20 read time (sensor="bulk" is the shared conversion)',
+            ('sensor',), SENSOR_BUCKETS)
+        self.pump_reaction_seconds = self.histogram(
+            'ato_pump_reaction_seconds', 'Float level change first seen to pump relay switched, debounce included',
+            ('tank', 'action'), REACTION_BUCKETS)
+        self.server = None
+
+    def timed_readers(self, readers, bulk_trigger=None):
+        """TempSampler readers (and bulk trigger) wrapped to time every DS18B20 read"""
+        readers = {name: timed(self.sensor_read_seconds, reader, name) for name, reader in readers.items()}
+        if bulk_trigger is not None:
+            bulk_trigger = timed(self.sensor_read_seconds, bulk_trigger, 'bulk')
+        return readers, bulk_trigger
+
+    def serve(self, port, bind='127.0.0.1'):
+        """Serve /metrics from a daemon thread; returns False if the port cannot be bound"""
+        try:
+            self.server = ThreadingHTTPServer((bind, port), _handler(self))
+        except OSError as e:
+            print(f"⚠️  Metrics endpoint unavailable on {bind}:{port}: {e}")
+            return False
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name='metrics', daemon=True).start()
+        print(f"✅ Metrics endpoint at http://{bind}:{port}/metrics")
+        return True
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def _handler(registry):
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/metrics', '/'):
+                self.send_error(404)
+                return
+            openmetrics = 'application/openmetrics-text' in self.headers.get('Accept', '')
+            body = registry.render(openmetrics).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', OPENMETRICS_TYPE if openmetrics else PROMETHEUS_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass    # a scrape every 15s would flood journald
+    return MetricsHandler
@@ -14,54 +14,151 @@ Complete aquarium Auto Top-Off monitoring system with:
 - MQTT integration for Home Assistant
 """
 
-import paho.mqtt.client as mqtt
-import RPi.GPIO as GPIO
 import time
 from datetime import datetime, timedelta
 import json
 import pickle
 import os
 import glob
+import re
+import runpy
+import signal
+import sys
+import threading
+
+from ato_alerts import AlertEngine, AlertRule
+from ato_analytics import (ActivationWindows, FlowCalibration, TempTrend, TempWindowStats, SeasonalRollup,
+                           TieredRollup, season_for_month)
+from ato_control import FillControl, FloatFilter, pump_timeout_message
+from ato_hal import create_backends
+from ato_metrics import MonitorMetrics, instrument, timed
+from ato_mqtt import ChangePublisher, HistoryQuery, PayloadCache
+from ato_pump import PumpCycles
+from ato_scheduler import Scheduler
+from ato_sensors import TempSampler, map_sensors
+from ato_sqlite import SQLiteStore, migrate_from_files
+import ato_storage
+from ato_storage import ActivationLog, PersistenceManager, TempRingBuffer, atomic_pickle
+
+# Reference point for the startup metrics (time to safe control, history load)
+PROCESS_STARTED = time.monotonic()
 
 # Import configuration (will be in config.py after user copies config.example.py)
 try:
     from config import *
+    CONFIG_LOADED = True
 except ImportError:
-    print("ERROR: config.py not found!")
-    print("Please copy config.example.py to config.py and edit with your settings")
-    exit(1)
+    # Fall back to the example settings so the module stays importable for tools
+    # and simulation; main() refuses to drive real hardware without config.py
+    _example = runpy.run_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'config.example.py'))
+    globals().update({k: v for k, v in _example.items() if k.isupper()})
+    CONFIG_LOADED = False
+    if os.environ.get('ATO_BACKEND') == 'sim':
+        # Keep simulated runs from writing into the example's /home/pi paths
+        import tempfile
+        _data_dir = tempfile.mkdtemp(prefix='ato-sim-')
+        for _name in [k for k in globals() if k.endswith(('_FILE', '_PREFIX')) and globals()[k]]:
+            globals()[_name] = os.path.join(_data_dir, os.path.basename(globals()[_name]))
 
-# Setup GPIO
-GPIO.setmode(GPIO.BCM)
-GPIO.setup(FLOAT_PIN, GPIO.IN, pull_up_down=GPIO.PUD_UP)
-GPIO.setup(PUMP_PIN, GPIO.OUT)
-GPIO.output(PUMP_PIN, GPIO.HIGH)  # Start with pump OFF
+# Defaults for settings added after 1.0.0 so existing config.py files keep working
+_CONFIG_DEFAULTS = {
+    'ACTIVATION_LOG_PREFIX': os.path.splitext(HISTORY_FILE)[0],
+    'ACTIVATION_LOG_SEGMENT_DAYS': 7,
+    'ACTIVATION_RETENTION_DAYS': 30,
+    'TEMP_HISTORY_RING_FILE': os.path.splitext(TEMP_HISTORY_FILE)[0] + '.ring',
+    'TEMP_HISTORY_SIZE': 10000,
+    'SEASONAL_STATS_FILE': os.path.join(os.path.dirname(HISTORY_FILE), 'ato_seasonal.pkl'),
+    'FLOAT_EDGE_DETECT': True,
+    'FLOAT_START_DEBOUNCE_MS': 100,
+    'FLOAT_STOP_DEBOUNCE_MS': 20,
+    'FLOAT_POLL_INTERVAL': 0.5,
+    'MQTT_FULL_REFRESH_INTERVAL': 3600,
+    'MQTT_MIN_INTERVALS': {"aquarium/ato/stats": 60},
+    'TEMP_SAMPLE_INTERVAL': 30,
+    'ALERT_CHECK_INTERVAL': 300,
+    'STATS_PUBLISH_INTERVAL': 300,
+    'PERSIST_FLUSH_INTERVAL': 300,
+    'PERSIST_WRITE_DELAY': 5,
+    'TEMP_MAX_AGE': 120,
+    'AUTO_DETECT_SENSORS': True,
+    'HARDWARE_BACKEND': 'pi',
+    'EVENT_LOG_FILE': None,
+    'MQTT_RECONNECT_MAX_DELAY': 120,
+    'ROLLUP_FILE': os.path.join(os.path.dirname(HISTORY_FILE), 'ato_rollups.pkl'),
+    'ROLLUP_HOURLY_DAYS': 90,
+    'ROLLUP_DAILY_DAYS': 1830,
+    'DAILY_USAGE_ROLLOVER': True,
+    'ALERT_TEMP_HYSTERESIS': 0.3,
+    'ALERT_CLEAR_MARGIN': 0.1,
+    'STORAGE_BACKEND': 'files',
+    'SQLITE_FILE': os.path.join(os.path.dirname(HISTORY_FILE), 'ato_data.db'),
+    'JSON_ENCODER': 'auto',
+    'PUMP_CYCLES_FILE': os.path.join(os.path.dirname(HISTORY_FILE), 'ato_pump_cycles.pkl'),
+    'PUMP_ANALYTICS_DAYS': 1830,
+    'PUMP_HEALTH_WARNING': 60,
+    'PUMP_FLOW_DROP_WARNING': 15,
+    'CALIBRATION_REFILL_ERROR': 0.05,
+    'CALIBRATION_DRIFT': 0.02,
+    'TEMP_TREND_WINDOWS': {'10m': (600, 3.0), '1h': (3600, 0.6), '2h': (2 * 3600, 0.3)},
+    'TEMP_TREND_CRITICAL_FACTOR': 2.0,
+    'TANKS': {},
+    'TANKS_STATE_FILE': os.path.join(os.path.dirname(HISTORY_FILE), 'ato_tanks.pkl'),
+    'METRICS_PORT': None,
+    'METRICS_BIND': '127.0.0.1',
+}
+for _name, _value in _CONFIG_DEFAULTS.items():
+    globals().setdefault(_name, _value)
+HARDWARE_BACKEND = os.environ.get('ATO_BACKEND', HARDWARE_BACKEND)
 
-# Initialize MQTT client
-client = mqtt.Client()
-client.username_pw_set(MQTT_USER, MQTT_PASS)
+# Rate windows reported as lph_<name>
+RATE_WINDOWS = {
+    '1h': 3600,
+    '6h': 6 * 3600,
+    '24h': 24 * 3600,
+    '7d': 7 * 86400,
+    '30d': 30 * 86400
+}
 
-try:
-    client.connect(MQTT_BROKER, MQTT_PORT, 60)
-except Exception as e:
-    print(f"ERROR: Could not connect to MQTT broker at {MQTT_BROKER}:{MQTT_PORT}")
-    print(f"Error: {e}")
-    print("Please check your MQTT configuration in config.py")
-    exit(1)
+# Temperature stats windows over raw readings: suffix -> (window seconds, bucket seconds; 0 = every reading)
+TEMP_STATS_WINDOWS = {
+    '1h': (3600, 0),
+    '24h': (24 * 3600, 0)
+}
+
+# Longer temperature windows, answered from the hourly rollup (hour resolution)
+TEMP_ROLLUP_WINDOWS = {
+    '7d': 7 * 86400,
+    '30d': 30 * 86400
+}
+
+# Clocks used for every timestamp and deadline; ato_replay.py swaps in a virtual clock
+wall_clock = datetime.now
+monotonic_clock = time.monotonic
+
+# Hardware backends (GPIO, 1-Wire, MQTT) - created by setup_hardware()
+gpio = None
+w1 = None
+client = None
+publisher = None
+payload_cache = None       # PayloadCache, created by setup_state()
+publish_metrics = {}        # encode time and bytes of the last stats publish
+metrics = None              # MonitorMetrics when METRICS_PORT is set (setup_metrics)
 
 # State variables
 daily_usage = 0
 activation_count = 0
+activations_total = 0       # since the process started (ato_activations_total)
+daily_usage_date = wall_clock().date()
 reservoir_level = RESERVOIR_CAPACITY
-last_activation_time = datetime.now()
-activation_history = []
-last_state = GPIO.input(FLOAT_PIN)
-monitoring_enabled = True
-disabled_reason = None
-filling_start_time = None
-filling_duration = 0
-stuck_alert_sent = False
-pump_running = False
+last_activation_time = wall_clock()
+# History and rollup containers sized by the config - created by setup_state()
+activation_history = None   # ActivationWindows
+activation_log = None       # ActivationLog
+seasonal_rollup = SeasonalRollup()
+activation_rollup = None    # TieredRollup, liters per activation
+persistence = None          # PersistenceManager
+sqlite_store = None     # SQLiteStore when STORAGE_BACKEND = "sqlite", opened by open_storage()
+fill = None             # FillControl: float, pump and fill timeout, created by setup_hardware()
 
 # Calibration data
 calibration_data = {
@@ -72,15 +169,44 @@ calibration_data = {
     'confidence': 0,
     'last_calibration_date': None
 }
+flow_calibration = None     # FlowCalibration (setup_state), saved as calibration_data['estimator']
 
 # Tracking data
 alerts_history = []
+alert_engine = None             # AlertEngine, created by setup_alerts()
+published_alerts_version = None
 pump_performance_history = []
+pump_cycles = None          # PumpCycles (setup_state): every cycle, as columns, for pump health
 current_temperature = None
-temp_history = []
+temp_history = None         # TempRingBuffer
+temp_windows = None         # TempWindowStats
+temp_trend = None           # TempTrend
+temp_rollup = None          # TieredRollup
+saved_sensor_rollups = {}       # rollups of extra sensors not (yet) detected this run
 last_temp_alert = None
 temp_calibration_offset = 0.0
 TEMP_SENSOR_ID = None
+temp_sensor_available = False
+temp_sampler = None
+last_recorded_temp_seq = 0
+
+# Startup: the float/pump loop runs first while history loads on a background
+# thread. Until then only safety work happens; the rest is deferred.
+history_ready = True        # main() clears this until finish_startup()
+history_loader = None
+deferred_until_loaded = []  # (func, args) queued by after_history_loaded()
+startup_lock = threading.Lock()
+startup_metrics = {}
+
+# Replayable event stream (EVENT_LOG_FILE), opened by main()
+event_log = None
+last_float_level = None
+
+# Extra DS18B20 sensors (e.g. display tank and sump) keyed by name. The primary
+# 'ato' sensor keeps using the globals above and the aquarium/ato/* topics.
+PRIMARY_TEMP_SENSOR = 'ato'
+temp_sensors = {}
+sensor_calibration_offsets = {}
 
 # ============================================================================
 # SEASONAL TRACKING FUNCTIONS
@@ -88,17 +214,7 @@ TEMP_SENSOR_ID = None
 
 def get_current_season():
     """Determine current season based on date (Northern Hemisphere)"""
-    now = datetime.now()
-    month = now.month
-    
-    if month in [12, 1, 2]:
-        return "Winter"
-    elif month in [3, 4, 5]:
-        return "Spring"
-    elif month in [6, 7, 8]:
-        return "Summer"
-    elif month in [9, 10, 11]:
-        return "Autumn"
+    return season_for_month(wall_clock().month)
 
 def get_season_emoji():
     """Get emoji for current season"""
@@ -112,70 +228,171 @@ def get_season_emoji():
     return emojis.get(season, "🌍")
 
 def calculate_seasonal_stats():
-    """Calculate evaporation statistics by season"""
-    seasonal_data = {
-        "Spring": {"activations": 0, "liters": 0, "days": 91, "avg_per_day": 0, "lph": 0},
-        "Summer": {"activations": 0, "liters": 0, "days": 91, "avg_per_day": 0, "lph": 0},
-        "Autumn": {"activations": 0, "liters": 0, "days": 91, "avg_per_day": 0, "lph": 0},
-        "Winter": {"activations": 0, "liters": 0, "days": 91, "avg_per_day": 0, "lph": 0}
-    }
-    
-    year_ago = datetime.now() - timedelta(days=365)
-    
-    for activation_time in activation_history:
-        if activation_time >= year_ago:
-            month = activation_time.month
-            if month in [12, 1, 2]:
-                season = "Winter"
-            elif month in [3, 4, 5]:
-                season = "Spring"
-            elif month in [6, 7, 8]:
-                season = "Summer"
-            else:
-                season = "Autumn"
-            
-            seasonal_data[season]["activations"] += 1
-            seasonal_data[season]["liters"] += LITERS_PER_ACTIVATION
-    
-    for season in seasonal_data:
-        days = seasonal_data[season]["days"]
-        if days > 0 and seasonal_data[season]["liters"] > 0:
-            seasonal_data[season]["avg_per_day"] = round(seasonal_data[season]["liters"] / days, 2)
-            seasonal_data[season]["lph"] = round(seasonal_data[season]["avg_per_day"] / 24, 3)
-    
-    return seasonal_data
+    """Calculate evaporation statistics by season (last 12 months)"""
+    return seasonal_rollup.seasonal_stats(wall_clock())
 
 # ============================================================================
 # FILE I/O FUNCTIONS
 # ============================================================================
 
 def load_history():
-    """Load activation history from file"""
-    global activation_history
-    if os.path.exists(HISTORY_FILE):
+    """Load activation history from the activation log (migrating old .pkl files)"""
+    cutoff = (wall_clock() - timedelta(days=ACTIVATION_RETENTION_DAYS)).timestamp()
+    try:
+        if sqlite_store is None and not activation_log.exists() and os.path.exists(HISTORY_FILE):
+            migrate_history_pickle()
+        activation_history.clear()
+        if sqlite_store is not None:
+            activation_history.extend(sqlite_store.activation_times(since=cutoff))
+        else:
+            activation_history.extend(activation_log.load(since=cutoff))
+        print(f"✅ Loaded {len(activation_history)} historical activations")
+    except Exception as e:
+        print(f"⚠️  Error loading history: {e}")
+        activation_history.clear()
+
+def migrate_history_pickle():
+    """Convert a 1.0 pickled activation list into the append-only activation log"""
+    with open(HISTORY_FILE, 'rb') as f:
+        legacy_history = pickle.load(f)
+    activation_log.rewrite(a.timestamp() for a in legacy_history)
+    os.replace(HISTORY_FILE, HISTORY_FILE + '.migrated')
+    print(f"✅ Migrated {len(legacy_history)} activations from {HISTORY_FILE} to activation log")
+
+def save_history():
+    """Schedule queued activations to be written to the activation log"""
+    persistence.mark_dirty('history')
+
+def write_history():
+    """Write queued activations and drop expired activation log segments"""
+    activation_log.flush()
+    activation_log.compact(wall_clock().timestamp())
+
+def append_activation(activation_time):
+    """Record one activation in memory and queue it for the activation log.
+    
+    The usage rollups take it when its cycle ends (record_activation_volume),
+    with the volume estimated from the runtime.
+    """
+    timestamp = activation_time.timestamp()
+    activation_history.add(timestamp)
+    if sqlite_store is not None:
+        sqlite_store.add_activation(timestamp, LITERS_PER_ACTIVATION)
+    else:
+        activation_log.append(timestamp)
+    save_history()
+
+def record_activation_volume(activation_time, liters):
+    """Fold a finished activation into the seasonal and hourly/daily usage with the volume it delivered"""
+    timestamp = activation_time.timestamp()
+    seasonal_rollup.record_activation(activation_time, liters)
+    activation_rollup.add(timestamp, liters)
+    if sqlite_store is not None:
+        sqlite_store.add_activation(timestamp, liters)      # replaces the row written at the start
+        save_history()
+    # Saved with every activation so restore_daily_counters() finds the corrected usage after a restart
+    save_rollups()
+    save_seasonal_stats()
+
+def load_seasonal_stats():
+    """Load the seasonal rollup, rebuilding it from activation history if missing"""
+    if sqlite_store is not None:
         try:
-            with open(HISTORY_FILE, 'rb') as f:
-                activation_history = pickle.load(f)
-            print(f"✅ Loaded {len(activation_history)} historical activations")
+            since = seasonal_rollup.window_start(wall_clock()).timestamp()
+            seasonal_rollup.from_dict({'months': sqlite_store.seasonal_months(since)})
+            print(f"✅ Loaded seasonal stats for {len(seasonal_rollup.months)} months")
         except Exception as e:
-            print(f"⚠️  Error loading history: {e}")
-            activation_history = []
+            print(f"⚠️  Error loading seasonal stats: {e}")
+        return
+    if os.path.exists(SEASONAL_STATS_FILE):
+        try:
+            with open(SEASONAL_STATS_FILE, 'rb') as f:
+                seasonal_rollup.from_dict(pickle.load(f))
+            print(f"✅ Loaded seasonal stats for {len(seasonal_rollup.months)} months")
+            return
+        except Exception as e:
+            print(f"⚠️  Error loading seasonal stats: {e}")
+    seasonal_rollup.rebuild((datetime.fromtimestamp(t) for t in activation_history),
+                            LITERS_PER_ACTIVATION, wall_clock())
+    print(f"✅ Rebuilt seasonal stats from {len(activation_history)} activations")
+    save_seasonal_stats()
 
-def save_history():
-    """Save activation history to file"""
+def save_seasonal_stats():
+    """Schedule the seasonal rollup to be written"""
+    persistence.mark_dirty('seasonal')
+
+def load_rollups():
+    """Load the hourly/daily rollups and top them up from the raw history loaded before"""
     try:
-        with open(HISTORY_FILE, 'wb') as f:
-            pickle.dump(activation_history, f)
+        if sqlite_store is not None:
+            data = sqlite_store.get_value('rollups', {})
+        elif os.path.exists(ROLLUP_FILE):
+            with open(ROLLUP_FILE, 'rb') as f:
+                data = pickle.load(f)
+        else:
+            data = {}
+        activation_rollup.from_dict(data.get('activations', {}))
+        temperatures = dict(data.get('temperature', {}))
+        temp_rollup.from_dict(temperatures.pop(PRIMARY_TEMP_SENSOR, {}))
+        saved_sensor_rollups.update(temperatures)
     except Exception as e:
-        print(f"⚠️  Error saving history: {e}")
+        print(f"⚠️  Error loading rollups: {e}")
+    
+    # Anything newer than the last save (at most the open hour) comes from raw data
+    before = (activation_rollup.latest, temp_rollup.latest)
+    if sqlite_store is not None:
+        activations = sqlite_store.activation_volumes(since=activation_rollup.latest)
+    else:
+        # The activation log keeps only times: count each at the calibrated volume
+        liters = flow_calibration.liters_per_activation() or LITERS_PER_ACTIVATION
+        activations = ((t, liters) for t in activation_history)
+    activation_rollup.backfill(activations)
+    temp_rollup.backfill(raw_temperatures(PRIMARY_TEMP_SENSOR, temp_history, temp_rollup.latest))
+    if (activation_rollup.latest, temp_rollup.latest) != before:
+        save_rollups()
+    print(f"✅ Loaded rollups: {len(activation_rollup.daily)} days of usage, "
+          f"{len(temp_rollup.daily)} days of temperature")
+
+def raw_temperatures(sensor, history, since):
+    """Raw readings from `since` on: the whole database with SQLite, else the ring"""
+    if sqlite_store is not None:
+        return sqlite_store.iter_temperatures(sensor, since or 0)
+    return history.since(since or 0)
+
+def save_rollups():
+    """Schedule the rollups to be written (after each activation and as each hour closes)"""
+    persistence.mark_dirty('rollups')
+
+def rollups_dict():
+    """Every rollup in a pickle- and JSON-friendly form"""
+    temperatures = dict(saved_sensor_rollups)
+    temperatures[PRIMARY_TEMP_SENSOR] = temp_rollup.to_dict()
+    for name, sensor in list(temp_sensors.items()):
+        temperatures[name] = sensor['rollup'].to_dict()
+    return {'activations': activation_rollup.to_dict(), 'temperature': temperatures}
+
+def write_rollups():
+    """Write the rollups"""
+    if sqlite_store is not None:
+        sqlite_store.set_value('rollups', rollups_dict())
+    else:
+        atomic_pickle(ROLLUP_FILE, rollups_dict())
 
 def load_calibration():
     """Load calibration data from file"""
     global calibration_data, LITERS_PER_ACTIVATION
-    if os.path.exists(CALIBRATION_FILE):
+    if sqlite_store is not None or os.path.exists(CALIBRATION_FILE):
         try:
-            with open(CALIBRATION_FILE, 'rb') as f:
-                calibration_data = pickle.load(f)
+            if sqlite_store is not None:
+                calibration_data = sqlite_store.get_value('calibration', calibration_data)
+            else:
+                with open(CALIBRATION_FILE, 'rb') as f:
+                    calibration_data = pickle.load(f)
+            if 'estimator' in calibration_data:
+                flow_calibration.from_dict(calibration_data['estimator'])
+            elif calibration_data['activations_since_refill']:
+                # Saved before cycles were timed: the next refill cannot be compared to a runtime
+                flow_calibration.runtime_since_refill = None
             if calibration_data['confidence'] >= 50:
                 LITERS_PER_ACTIVATION = calibration_data['calibrated_lph']
             print(f"✅ Loaded calibration: {LITERS_PER_ACTIVATION}L/activation (confidence: {calibration_data['confidence']}%)")
@@ -183,81 +400,136 @@ def load_calibration():
             print(f"⚠️  Error loading calibration: {e}")
 
 def save_calibration():
-    """Save calibration data to file"""
-    try:
-        with open(CALIBRATION_FILE, 'wb') as f:
-            pickle.dump(calibration_data, f)
-    except Exception as e:
-        print(f"⚠️  Error saving calibration: {e}")
+    """Schedule calibration data to be written"""
+    calibration_data['estimator'] = flow_calibration.to_dict()
+    persistence.mark_dirty('calibration')
 
 def load_alerts_history():
     """Load alerts history from file"""
     global alerts_history
-    if os.path.exists(ALERTS_HISTORY_FILE):
+    if sqlite_store is not None or os.path.exists(ALERTS_HISTORY_FILE):
         try:
-            with open(ALERTS_HISTORY_FILE, 'rb') as f:
-                alerts_history = pickle.load(f)
+            if sqlite_store is not None:
+                alerts_history = sqlite_store.recent_alerts(500)
+            else:
+                with open(ALERTS_HISTORY_FILE, 'rb') as f:
+                    alerts_history = pickle.load(f)
             print(f"✅ Loaded {len(alerts_history)} historical alerts")
         except Exception as e:
             print(f"⚠️  Error loading alerts history: {e}")
             alerts_history = []
 
 def save_alerts_history():
-    """Save alerts history to file"""
-    try:
-        with open(ALERTS_HISTORY_FILE, 'wb') as f:
-            pickle.dump(alerts_history, f)
-    except Exception as e:
-        print(f"⚠️  Error saving alerts history: {e}")
+    """Schedule alerts history to be written"""
+    persistence.mark_dirty('alerts_history')
 
 def load_pump_performance():
     """Load pump performance history from file"""
     global pump_performance_history
-    if os.path.exists(PUMP_PERFORMANCE_FILE):
+    if sqlite_store is not None or os.path.exists(PUMP_PERFORMANCE_FILE):
         try:
-            with open(PUMP_PERFORMANCE_FILE, 'rb') as f:
-                pump_performance_history = pickle.load(f)
+            if sqlite_store is not None:
+                pump_performance_history = sqlite_store.recent_pump_cycles(1000)
+            else:
+                with open(PUMP_PERFORMANCE_FILE, 'rb') as f:
+                    pump_performance_history = pickle.load(f)
             print(f"✅ Loaded {len(pump_performance_history)} pump performance records")
         except Exception as e:
             print(f"⚠️  Error loading pump performance: {e}")
             pump_performance_history = []
 
 def save_pump_performance():
-    """Save pump performance history to file"""
+    """Schedule pump performance history to be written"""
+    persistence.mark_dirty('pump_performance')
+
+def load_pump_cycles():
+    """Load the long-term pump cycle columns (seeded from pump performance records on first start)"""
+    now = wall_clock().timestamp()
     try:
-        with open(PUMP_PERFORMANCE_FILE, 'wb') as f:
-            pickle.dump(pump_performance_history, f)
+        pump_cycles.clear()
+        if sqlite_store is not None:
+            pump_cycles.extend(sqlite_store.pump_cycle_columns(since=now - PUMP_ANALYTICS_DAYS * 86400))
+        elif os.path.exists(PUMP_CYCLES_FILE):
+            with open(PUMP_CYCLES_FILE, 'rb') as f:
+                pump_cycles.from_dict(pickle.load(f))
+        else:
+            pump_cycles.extend((datetime.fromisoformat(r['timestamp']).timestamp(), r['runtime_seconds'],
+                                r['volume_liters']) for r in pump_performance_history
+                               if r.get('flow_rate_lph') is not None)      # manual runs have no flow
+            if pump_cycles:
+                save_pump_cycles()
+        pump_cycles.prune(now)
+        print(f"✅ Loaded {len(pump_cycles)} pump cycles for pump health")
     except Exception as e:
-        print(f"⚠️  Error saving pump performance: {e}")
+        print(f"⚠️  Error loading pump cycles: {e}")
+        pump_cycles.clear()
 
-def load_temp_history():
-    """Load temperature history from file"""
-    global temp_history
-    if os.path.exists(TEMP_HISTORY_FILE):
-        try:
-            with open(TEMP_HISTORY_FILE, 'rb') as f:
-                temp_history = pickle.load(f)
-            print(f"✅ Loaded {len(temp_history)} temperature readings")
-        except Exception as e:
-            print(f"⚠️  Error loading temp history: {e}")
-            temp_history = []
+def save_pump_cycles():
+    """Schedule the pump cycle columns to be written"""
+    persistence.mark_dirty('pump_cycles')
 
-def save_temp_history():
-    """Save temperature history to file"""
+def load_temp_history():
+    """Load temperature history from the ring file (migrating old .pkl files)"""
     try:
-        with open(TEMP_HISTORY_FILE, 'wb') as f:
-            pickle.dump(temp_history, f)
+        if sqlite_store is not None:
+            load_sqlite_temperatures(PRIMARY_TEMP_SENSOR, temp_history, temp_windows)
+        else:
+            if os.path.exists(TEMP_HISTORY_RING_FILE):
+                temp_history.load(TEMP_HISTORY_RING_FILE)
+            elif os.path.exists(TEMP_HISTORY_FILE):
+                migrate_temp_history_pickle()
+            temp_windows.rebuild(temp_history)
+        # A few time constants of readings fully warm up the trend windows
+        longest = max(seconds for seconds, _ in TEMP_TREND_WINDOWS.values())
+        temp_trend.rebuild(temp_history.since(wall_clock().timestamp() - 5 * longest))
+        print(f"✅ Loaded {len(temp_history)} temperature readings")
     except Exception as e:
-        print(f"⚠️  Error saving temp history: {e}")
+        print(f"⚠️  Error loading temp history: {e}")
+        temp_history.clear()
+        temp_windows.clear()
+        temp_trend.clear()
+
+def load_sqlite_temperatures(sensor, history, windows):
+    """Fill a sensor's ring with its newest readings and its windows with the last 30 days"""
+    history.clear()
+    for timestamp, temp in sqlite_store.latest_temperatures(sensor, history.capacity):
+        history.append(timestamp, temp)
+    since = wall_clock().timestamp() - max(seconds for seconds, _ in TEMP_STATS_WINDOWS.values())
+    windows.rebuild(sqlite_store.iter_temperatures(sensor, since))
+
+def migrate_temp_history_pickle():
+    """Convert a 1.0 pickled list of reading dicts into the temperature ring file"""
+    with open(TEMP_HISTORY_FILE, 'rb') as f:
+        legacy_history = pickle.load(f)
+    for record in legacy_history:
+        timestamp = datetime.fromisoformat(record['timestamp']).timestamp()
+        temp_history.append(timestamp, record['temperature'])
+    temp_history.save(TEMP_HISTORY_RING_FILE)
+    os.replace(TEMP_HISTORY_FILE, TEMP_HISTORY_FILE + '.migrated')
+    print(f"✅ Migrated {len(legacy_history)} readings from {TEMP_HISTORY_FILE} to {TEMP_HISTORY_RING_FILE}")
+
+def save_temp_history():
+    """Schedule new temperature readings (every sensor) to be written"""
+    persistence.mark_dirty('temp_history')
+
+def write_temp_history():
+    """Write new temperature readings to the ring files"""
+    temp_history.save(TEMP_HISTORY_RING_FILE)
+    for sensor in list(temp_sensors.values()):
+        sensor['history'].save(sensor['ring_file'])
 
 def load_temp_calibration():
     """Load temperature calibration offset from file"""
     global temp_calibration_offset
-    if os.path.exists(TEMP_CALIBRATION_FILE):
+    if sqlite_store is not None or os.path.exists(TEMP_CALIBRATION_FILE):
         try:
-            with open(TEMP_CALIBRATION_FILE, 'rb') as f:
-                data = pickle.load(f)
-                temp_calibration_offset = data.get('offset', 0.0)
+            if sqlite_store is not None:
+                data = sqlite_store.get_value('temp_calibration', {})
+            else:
+                with open(TEMP_CALIBRATION_FILE, 'rb') as f:
+                    data = pickle.load(f)
+            temp_calibration_offset = data.get('offset', 0.0)
+            sensor_calibration_offsets.update(data.get('sensor_offsets', {}))
             print(f"✅ Loaded temperature calibration offset: {temp_calibration_offset}°C")
         except Exception as e:
             print(f"⚠️  Error loading temp calibration: {e}")
@@ -266,39 +538,186 @@ def load_temp_calibration():
         temp_calibration_offset = 0.0
 
 def save_temp_calibration():
-    """Save temperature calibration offset to file"""
+    """Schedule the temperature calibration offsets to be written"""
+    persistence.mark_dirty('temp_calibration')
+
+def write_temp_calibration():
+    """Write the temperature calibration offsets"""
+    data = {
+        'offset': temp_calibration_offset,
+        'sensor_offsets': dict(sensor_calibration_offsets),
+        'last_calibration': wall_clock().isoformat(),
+        'calibration_method': 'manual'
+    }
+    if sqlite_store is not None:
+        sqlite_store.set_value('temp_calibration', data)
+    else:
+        atomic_pickle(TEMP_CALIBRATION_FILE, data)
+
+def setup_state():
+    """Create the history, rollup, calibration and encoder objects sized by the config.
+    
+    Called once the config is final - by main(), and by ato_replay.py after
+    its --set overrides - so every setting takes effect.
+    """
+    global payload_cache, activation_history, activation_log, activation_rollup, persistence
+    global flow_calibration, pump_cycles, temp_history, temp_windows, temp_trend, temp_rollup
+    payload_cache = PayloadCache(JSON_ENCODER)
+    activation_history = ActivationWindows(RATE_WINDOWS, ACTIVATION_RETENTION_DAYS * 86400)
+    activation_log = ActivationLog(ACTIVATION_LOG_PREFIX,
+                                   segment_seconds=ACTIVATION_LOG_SEGMENT_DAYS * 86400,
+                                   retention_seconds=ACTIVATION_RETENTION_DAYS * 86400)
+    activation_rollup = TieredRollup(ROLLUP_HOURLY_DAYS, ROLLUP_DAILY_DAYS)
+    persistence = PersistenceManager(PERSIST_WRITE_DELAY, clock=lambda: monotonic_clock())
+    flow_calibration = FlowCalibration(CALIBRATION_REFILL_ERROR, CALIBRATION_DRIFT)
+    pump_cycles = PumpCycles(PUMP_ANALYTICS_DAYS * 86400)
+    temp_history = TempRingBuffer(TEMP_HISTORY_SIZE)
+    temp_windows = TempWindowStats(TEMP_STATS_WINDOWS)
+    temp_trend = TempTrend(TEMP_TREND_WINDOWS)
+    temp_rollup = TieredRollup(ROLLUP_HOURLY_DAYS, ROLLUP_DAILY_DAYS)
+
+def open_storage():
+    """Open the SQLite database if STORAGE_BACKEND is "sqlite", importing the data files on first use"""
+    global sqlite_store
+    if STORAGE_BACKEND != 'sqlite':
+        return
+    sqlite_store = SQLiteStore(SQLITE_FILE)
+    if sqlite_store.get_value('migrated_from_files') is None and sqlite_store.is_empty():
+        rings = {PRIMARY_TEMP_SENSOR: TEMP_HISTORY_RING_FILE}
+        prefix = os.path.splitext(TEMP_HISTORY_RING_FILE)[0] + '_'
+        for path in glob.glob(glob.escape(prefix) + '*.ring'):
+            rings[path[len(prefix):-len('.ring')]] = path
+        imported = migrate_from_files(sqlite_store, activation_log, LITERS_PER_ACTIVATION,
+                                      history_file=HISTORY_FILE, calibration_file=CALIBRATION_FILE,
+                                      seasonal_file=SEASONAL_STATS_FILE, alerts_file=ALERTS_HISTORY_FILE,
+                                      pump_file=PUMP_PERFORMANCE_FILE, pump_cycles_file=PUMP_CYCLES_FILE,
+                                      temp_rings=rings,
+                                      temp_history_file=TEMP_HISTORY_FILE,
+                                      temp_calibration_file=TEMP_CALIBRATION_FILE, rollup_file=ROLLUP_FILE)
+        if any(imported.values()):
+            print(f"✅ Migrated data files to {SQLITE_FILE}: "
+                  + ", ".join(f"{count} {table}" for table, count in imported.items() if count))
+    print(f"✅ Using SQLite storage: {SQLITE_FILE}")
+
+def write_sqlite_seasonal():
+    """Record the days the monitor has been running (seasonal stats are queried from the database)"""
+    sqlite_store.observe_days(seasonal_rollup.observed_days())
+    sqlite_store.flush()
+
+def write_sqlite_calibration():
+    """Insert queued refills and store the calibration data"""
+    sqlite_store.flush()
+    sqlite_store.set_value('calibration', calibration_data)
+
+def setup_persistence(start=True):
+    """Register every data file with the write-behind persistence thread"""
+    if sqlite_store is not None:
+        # Rows are queued as they are recorded; each store's write is one batched insert
+        for name in ('history', 'alerts_history', 'pump_performance', 'pump_cycles'):
+            persistence.register(name, sqlite_store.flush)
+        persistence.register('temp_history', sqlite_store.flush, delay=PERSIST_FLUSH_INTERVAL)
+        persistence.register('seasonal', write_sqlite_seasonal)
+        persistence.register('calibration', write_sqlite_calibration)
+        persistence.register('temp_calibration', write_temp_calibration)
+        persistence.register('rollups', write_rollups)
+        if start:
+            persistence.start()
+        return
+    persistence.register('history', write_history)
+    persistence.register('seasonal', lambda: atomic_pickle(SEASONAL_STATS_FILE, seasonal_rollup.to_dict()))
+    persistence.register('calibration', lambda: atomic_pickle(CALIBRATION_FILE, calibration_data))
+    persistence.register('alerts_history', lambda: atomic_pickle(ALERTS_HISTORY_FILE, alerts_history))
+    persistence.register('pump_performance', lambda: atomic_pickle(PUMP_PERFORMANCE_FILE, pump_performance_history))
+    persistence.register('pump_cycles', lambda: atomic_pickle(PUMP_CYCLES_FILE, pump_cycles.to_dict()))
+    persistence.register('temp_history', write_temp_history, delay=PERSIST_FLUSH_INTERVAL)
+    persistence.register('temp_calibration', write_temp_calibration)
+    persistence.register('rollups', write_rollups)
+    if start:
+        persistence.start()
+
+def open_event_log():
+    """Start appending replayable events to EVENT_LOG_FILE (if configured)"""
+    global event_log
+    if EVENT_LOG_FILE:
+        try:
+            event_log = open(EVENT_LOG_FILE, 'a')
+            print(f"✅ Recording events to {EVENT_LOG_FILE}")
+        except Exception as e:
+            print(f"⚠️  Error opening event log: {e}")
+
+def record_event(kind, **fields):
+    """Append one JSON line (float edge, temperature sample, MQTT command) for ato_replay.py"""
+    if event_log is None:
+        return
     try:
-        data = {
-            'offset': temp_calibration_offset,
-            'last_calibration': datetime.now().isoformat(),
-            'calibration_method': 'manual'
-        }
-        with open(TEMP_CALIBRATION_FILE, 'wb') as f:
-            pickle.dump(data, f)
-        print(f"✅ Saved temperature calibration offset: {temp_calibration_offset}°C")
+        event_log.write(json.dumps({'time': round(wall_clock().timestamp(), 3), 'type': kind, **fields}) + '\n')
+        event_log.flush()
     except Exception as e:
-        print(f"⚠️  Error saving temp calibration: {e}")
+        print(f"⚠️  Error writing event log: {e}")
 
 # ============================================================================
 # TEMPERATURE SENSOR FUNCTIONS
 # ============================================================================
 
+def configured_temp_sensors():
+    """Sensor names and IDs from TEMP_SENSOR_<NAME>_ID settings, in config order"""
+    sensors = {}
+    for key, value in list(globals().items()):
+        match = re.fullmatch(r'TEMP_SENSOR_([A-Z0-9]+)_ID', key)
+        if match:
+            sensors[match.group(1).lower()] = value
+    return sensors or {PRIMARY_TEMP_SENSOR: None}
+
 def find_temp_sensor():
-    """Auto-detect DS18B20 sensor"""
+    """Auto-detect DS18B20 sensors and map them to the configured names"""
     global TEMP_SENSOR_ID
     try:
-        device_folder = glob.glob('/sys/bus/w1/devices/28*')
-        if device_folder:
-            TEMP_SENSOR_ID = device_folder[0]
-            print(f"✅ Temperature sensor found: {TEMP_SENSOR_ID}")
-            return True
-        else:
+        mapping = map_sensors(w1.discover(), configured_temp_sensors(), AUTO_DETECT_SENSORS)
+        if not mapping:
             print("⚠️  No DS18B20 temperature sensor detected")
             return False
+        
+        TEMP_SENSOR_ID = mapping.pop(PRIMARY_TEMP_SENSOR, None)
+        if TEMP_SENSOR_ID:
+            print(f"✅ Temperature sensor found: {TEMP_SENSOR_ID}")
+        for name, device_path in mapping.items():
+            temp_sensors[name] = new_temp_sensor(name, device_path)
+            load_sensor_history(name)
+            print(f"✅ {temp_sensors[name]['name']} sensor found: {device_path}")
+        return True
     except Exception as e:
         print(f"⚠️  Error finding temperature sensor: {e}")
         return False
 
+def new_temp_sensor(name, device_path):
+    """State for one extra temperature sensor"""
+    return {
+        'id': device_path,
+        'name': globals().get(f"TEMP_SENSOR_{name.upper()}_NAME", name.title()),
+        'current_temp': None,
+        'history': TempRingBuffer(TEMP_HISTORY_SIZE),
+        'windows': TempWindowStats(TEMP_STATS_WINDOWS),
+        'rollup': TieredRollup(ROLLUP_HOURLY_DAYS, ROLLUP_DAILY_DAYS),
+        'ring_file': f"{os.path.splitext(TEMP_HISTORY_RING_FILE)[0]}_{name}.ring",
+        'last_seq': 0
+    }
+
+def load_sensor_history(name):
+    """Load an extra sensor's temperature history and rollup"""
+    sensor = temp_sensors[name]
+    if sqlite_store is not None or os.path.exists(sensor['ring_file']):
+        try:
+            if sqlite_store is not None:
+                load_sqlite_temperatures(name, sensor['history'], sensor['windows'])
+            else:
+                sensor['history'].load(sensor['ring_file'])
+                sensor['windows'].rebuild(sensor['history'])
+        except Exception as e:
+            print(f"⚠️  Error loading {sensor['name']} temp history: {e}")
+            sensor['history'].clear()
+    sensor['rollup'].from_dict(saved_sensor_rollups.pop(name, {}))
+    sensor['rollup'].backfill(raw_temperatures(name, sensor['history'], sensor['rollup'].latest))
+
 def read_temp_raw():
     """Read raw data from temperature sensor"""
     if not TEMP_SENSOR_ID:
@@ -309,214 +728,389 @@ def read_temp_raw():
     except Exception as e:
         return None
 
-def read_temperature():
-    """Read temperature from DS18B20 sensor with calibration"""
-    global current_temperature
-    
-    lines = read_temp_raw()
-    if not lines:
+def start_temp_sampler():
+    """Start the background thread that does the blocking DS18B20 reads"""
+    global temp_sampler
+    readers = {}
+    offsets = {}
+    if TEMP_SENSOR_ID:
+        readers[PRIMARY_TEMP_SENSOR] = read_temp_raw
+        offsets[PRIMARY_TEMP_SENSOR] = lambda: temp_calibration_offset
+    for name, sensor in temp_sensors.items():
+        readers[name] = w1.reader(sensor['id'])
+        offsets[name] = lambda name=name: sensor_calibration_offsets.get(name, 0.0)
+    
+    bulk_trigger = w1.bulk_trigger() if len(readers) > 1 else None
+    if metrics is not None:
+        readers, bulk_trigger = metrics.timed_readers(readers, bulk_trigger)
+    
+    temp_sampler = TempSampler(readers, interval=TEMP_SAMPLE_INTERVAL, offsets=offsets,
+                               primary=PRIMARY_TEMP_SENSOR, bulk_trigger=bulk_trigger)
+    temp_sampler.start()
+
+def latest_temp_reading(sensor=None):
+    """Latest sampler snapshot for a sensor (primary by default), or None if missing or stale"""
+    if temp_sampler is None:
         return None
-    
-    if lines[0].strip()[-3:] != 'YES':
+    reading = temp_sampler.snapshots.get(sensor or PRIMARY_TEMP_SENSOR)
+    if reading is None or reading.raw is None or time.monotonic() - reading.monotonic > TEMP_MAX_AGE:
         return None
-    
-    equals_pos = lines[1].find('t=')
-    if equals_pos != -1:
-        temp_string = lines[1][equals_pos + 2:]
-        temp_c = float(temp_string) / 1000.0
-        calibrated_temp = temp_c + temp_calibration_offset
-        current_temperature = round(calibrated_temp, 2)
-        return current_temperature
-    
-    return None
+    return reading
 
-def read_temperature_raw():
-    """Read raw (uncalibrated) temperature for calibration purposes"""
-    lines = read_temp_raw()
-    if not lines:
-        return None
+def read_temperature():
+    """Latest temperature with calibration applied (cached, never blocks)"""
+    global current_temperature
     
-    if lines[0].strip()[-3:] != 'YES':
+    reading = latest_temp_reading()
+    if reading is None:
         return None
     
-    equals_pos = lines[1].find('t=')
-    if equals_pos != -1:
-        temp_string = lines[1][equals_pos + 2:]
-        temp_c = float(temp_string) / 1000.0
-        return round(temp_c, 2)
-    
-    return None
+    current_temperature = round(reading.raw + temp_calibration_offset, 2)
+    return current_temperature
+
+def read_temperature_raw(sensor=None):
+    """Latest raw (uncalibrated) temperature for calibration purposes (cached)"""
+    reading = latest_temp_reading(sensor)
+    return reading.raw if reading is not None else None
 
 def set_temp_calibration_offset(offset):
     """Set temperature calibration offset"""
     global temp_calibration_offset
     temp_calibration_offset = round(float(offset), 2)
     save_temp_calibration()
-    client.publish("aquarium/ato/temp_calibration_offset", temp_calibration_offset)
+    publisher.publish("aquarium/ato/temp_calibration_offset", temp_calibration_offset)
     print(f"🌡️  Temperature calibration offset set to: {temp_calibration_offset}°C")
 
-def record_temperature(temp):
+def set_sensor_calibration_offset(name, offset):
+    """Set the calibration offset of an extra temperature sensor"""
+    sensor_calibration_offsets[name] = round(float(offset), 2)
+    save_temp_calibration()
+    publisher.publish(f"aquarium/temp/{name}_calibration", sensor_calibration_offsets[name])
+    print(f"🌡️  {temp_sensors[name]['name']} calibration offset set to: {sensor_calibration_offsets[name]}°C")
+
+def record_sensor_temperatures():
+    """Record new readings from the extra sensors"""
+    for name, sensor in temp_sensors.items():
+        reading = latest_temp_reading(name)
+        if reading is None or reading.seq == sensor['last_seq']:
+            continue
+        sensor['last_seq'] = reading.seq
+        temp = round(reading.raw + sensor_calibration_offsets.get(name, 0.0), 2)
+        sensor['current_temp'] = temp
+        sensor['history'].append(reading.timestamp, temp)
+        sensor['windows'].add(reading.timestamp, temp)
+        if sensor['rollup'].add(reading.timestamp, temp):
+            save_rollups()
+        if sqlite_store is not None:
+            sqlite_store.add_temperature(name, reading.timestamp, temp)
+        save_temp_history()
+        publisher.publish(f"aquarium/temp/{name}", temp)
+
+def publish_sensor_stats(now):
+    """Publish per-sensor values and stats under aquarium/temp/<name>"""
+    if temp_sensors and current_temperature is not None:
+        # The primary sensor keeps its aquarium/ato/* topics; mirror it for multi-sensor dashboards
+        publisher.publish(f"aquarium/temp/{PRIMARY_TEMP_SENSOR}", current_temperature)
+        publisher.publish(f"aquarium/temp/{PRIMARY_TEMP_SENSOR}_calibration", temp_calibration_offset)
+    
+    for name, sensor in temp_sensors.items():
+        if sensor['current_temp'] is None:
+            continue
+        publisher.publish(f"aquarium/temp/{name}", sensor['current_temp'])
+        raw_temp = read_temperature_raw(name)
+        if raw_temp is not None:
+            publisher.publish(f"aquarium/temp/{name}_raw", raw_temp)
+        history = sensor['history']
+        version = (history[-1][0] if history else None, sensor['rollup'].version, int(now.timestamp() // 60))
+        publisher.publish(f"aquarium/temp/{name}_stats",
+                          payload_cache.get(f"temp_stats:{name}", version,
+                                            lambda: temp_summary(sensor['windows'], sensor['rollup'], now.timestamp())))
+        publisher.publish(f"aquarium/temp/{name}_calibration", sensor_calibration_offsets.get(name, 0.0))
+    
+    display = temp_sensors.get('display', {}).get('current_temp')
+    sump = temp_sensors.get('sump', {}).get('current_temp')
+    if display is not None and sump is not None:
+        publisher.publish("aquarium/temp/display_sump_diff", round(abs(display - sump), 2))
+
+def record_temperature(temp, timestamp=None):
     """Record a temperature reading"""
-    global temp_history
-    
-    temp_record = {
-        'timestamp': datetime.now().isoformat(),
-        'temperature': temp,
-        'season': get_current_season()
-    }
-    
-    temp_history.append(temp_record)
-    
-    if len(temp_history) > 10000:
-        temp_history.pop(0)
-    
+    if timestamp is None:
+        timestamp = wall_clock().timestamp()
+    temp_history.append(timestamp, temp)
+    temp_windows.add(timestamp, temp)
+    temp_trend.add(timestamp, temp)
+    if temp_rollup.add(timestamp, temp):
+        save_rollups()
+    if sqlite_store is not None:
+        sqlite_store.add_temperature(PRIMARY_TEMP_SENSOR, timestamp, temp)
     save_temp_history()
 
+def temp_summary(windows, rollup, now):
+    """avg/min/max per window: short windows from raw readings, 7d/30d from the hourly rollup"""
+    stats = windows.summary(now)
+    for name, seconds in TEMP_ROLLUP_WINDOWS.items():
+        summary = rollup.window(now, seconds)
+        for prefix, field in (('avg', 'mean'), ('min', 'min'), ('max', 'max')):
+            value = summary[field]
+            stats[f'{prefix}_{name}'] = round(value, 2) if value is not None else None
+    return stats
+
 def calculate_temp_stats():
-    """Calculate temperature statistics"""
-    if not temp_history:
-        return {
-            'avg_24h': None,
-            'min_24h': None,
-            'max_24h': None,
-            'avg_7d': None,
-            'min_7d': None,
-            'max_7d': None
-        }
-    
-    now = datetime.now()
-    day_ago = now - timedelta(hours=24)
-    week_ago = now - timedelta(days=7)
-    
-    temps_24h = [r['temperature'] for r in temp_history 
-                 if datetime.fromisoformat(r['timestamp']) >= day_ago]
-    
-    temps_7d = [r['temperature'] for r in temp_history 
-                if datetime.fromisoformat(r['timestamp']) >= week_ago]
-    
-    return {
-        'avg_24h': round(sum(temps_24h) / len(temps_24h), 2) if temps_24h else None,
-        'min_24h': round(min(temps_24h), 2) if temps_24h else None,
-        'max_24h': round(max(temps_24h), 2) if temps_24h else None,
-        'avg_7d': round(sum(temps_7d) / len(temps_7d), 2) if temps_7d else None,
-        'min_7d': round(min(temps_7d), 2) if temps_7d else None,
-        'max_7d': round(max(temps_7d), 2) if temps_7d else None
-    }
+    """Calculate temperature statistics (avg/min/max per window, e.g. avg_24h)"""
+    return temp_summary(temp_windows, temp_rollup, wall_clock().timestamp())
+
+def calculate_monthly_usage():
+    """Liters used per calendar month over the last 12 months"""
+    return {month: round(summary['sum'], 1)
+            for month, summary in activation_rollup.monthly(wall_clock().date()).items()}
 
 # ============================================================================
-# PUMP CONTROL FUNCTIONS
+# HARDWARE SETUP
 # ============================================================================
 
-def start_pump():
-    """Start the ATO pump"""
-    global pump_running, filling_start_time, stuck_alert_sent
-    GPIO.output(PUMP_PIN, GPIO.LOW)
-    pump_running = True
-    filling_start_time = datetime.now()
-    stuck_alert_sent = False
-    client.publish("aquarium/ato/pump_state", "ON")
-    print("🔵 Pump STARTED")
-
-def stop_pump():
-    """Stop the ATO pump"""
-    global pump_running, filling_start_time, filling_duration
-    GPIO.output(PUMP_PIN, GPIO.HIGH)
-    pump_running = False
-    if filling_start_time is not None:
-        filling_duration = (datetime.now() - filling_start_time).total_seconds()
+def setup_hardware(backends=None):
+    """Bring up GPIO, 1-Wire and MQTT (HARDWARE_BACKEND unless backends are given).
+
+    The pump is forced off first. The broker connection is made in the
+    background and retried until it succeeds, so an unreachable broker never
+    holds up float/pump control.
+    """
+    global gpio, w1, client, publisher, fill
+    
+    if backends is None:
+        backends = create_backends(HARDWARE_BACKEND, FLOAT_PIN, PUMP_PIN, MQTT_USER, MQTT_PASS)
+    gpio, w1, client = backends
+    gpio.set_pump(False)  # Start with pump OFF
+    gpio.start()
+    
+    # Value topics go through the change-only publisher; state/pump_state events use client directly
+    publisher = ChangePublisher(client, MQTT_FULL_REFRESH_INTERVAL, MQTT_MIN_INTERVALS,
+                                clock=lambda: monotonic_clock())
+    fill = FillControl(gpio, client, publisher, "aquarium/ato", MAX_FILL_DURATION,
+                       clock=lambda: wall_clock(), on_cycle=record_fill_cycle)
+    connect_mqtt()
+
+# ============================================================================
+# FLOAT SWITCH FUNCTIONS
+# ============================================================================
+
+float_edge = threading.Event()
+float_edge_detection = False
+
+def on_float_edge(channel):
+    """GPIO callback: wake the main loop to debounce and act on the new level"""
+    float_edge.set()
+
+def setup_float_edge_detection():
+    """Register edge callbacks for the float switch, falling back to polling"""
+    global float_edge_detection
+    if not FLOAT_EDGE_DETECT:
+        return False
+    try:
+        gpio.add_float_callback(on_float_edge)
+        float_edge_detection = True
+    except Exception as e:
+        print(f"⚠️  Float edge detection unavailable, polling every {FLOAT_POLL_INTERVAL}s: {e}")
+        float_edge_detection = False
+    return float_edge_detection
+
+def handle_float_change(state):
+    """Start or stop the pump for a debounced float level (0 = water low)"""
+    global activation_count, activations_total, daily_usage, reservoir_level, last_activation_time
+    
+    # Counted up front; record_pump_cycle() corrects it to the cycle's runtime
+    action = fill.float_changed(state, LITERS_PER_ACTIVATION)
+    if action is None:
+        return
+    record_pump_reaction(action)
+    if action == 'start':
+        activation_count += 1
+        activations_total += 1
+        daily_usage += LITERS_PER_ACTIVATION
+        reservoir_level -= LITERS_PER_ACTIVATION
+        last_activation_time = fill.fill_started
+        after_history_loaded(record_activation, last_activation_time)
         
-        # Record pump performance
-        record_pump_cycle(filling_duration, LITERS_PER_ACTIVATION)
+        publish_stats()
+        check_alerts()
         
-        print(f"🔴 Pump STOPPED - ran for {filling_duration:.1f}s")
-        filling_start_time = None
-    client.publish("aquarium/ato/pump_state", "OFF")
-
-def emergency_stop_pump():
-    """Emergency stop with alert"""
-    global monitoring_enabled, disabled_reason
-    stop_pump()
-    monitoring_enabled = False
-    disabled_reason = "Emergency stop - stuck float/pump timeout"
-    client.publish("aquarium/ato/state", "emergency_stopped")
-    client.publish("aquarium/ato/monitoring_enabled", "OFF")
-    print("🚨 EMERGENCY STOP - monitoring disabled for safety")
-
-def record_pump_cycle(runtime_seconds, volume_liters):
-    """Record a pump cycle for performance tracking"""
-    global pump_performance_history
+        print(f"💧 ATO activation #{activation_count} (#{calibration_data['activations_since_refill']} since refill)")
+    else:
+        publish_stats()
+
+def record_pump_reaction(action):
+    """Time from the float change first being seen to the relay switching (ato_pump_reaction_seconds)"""
+    if metrics is not None and fill.float_filter.changed_at is not None:
+        metrics.pump_reaction_seconds.observe(monotonic_clock() - fill.float_filter.changed_at, METRICS_TANK, action)
+
+def record_activation(activation_time):
+    """Count an activation towards calibration and history"""
+    calibration_data['activations_since_refill'] += 1
+    save_calibration()
+    append_activation(activation_time)
+
+def check_fill_timeout():
+    """Emergency stop and alert for a fill running past MAX_FILL_DURATION"""
+    if not fill.check_timeout():
+        return
+    persistence.flush()
+    publisher.publish("aquarium/ato/filling_duration", round(fill.fill_duration, 1))
+    if history_ready:
+        check_alerts()
+    else:
+        # Alerting needs the history - publish the alert now and record it once loaded
+        publisher.publish("aquarium/ato/alert_critical", fill.timeout_message())
+        after_history_loaded(check_alerts)
+
+def wait_for_float(deadline):
+    """Sleep until a float edge or the monotonic deadline, whichever is first"""
+    timeout = max(0.0, deadline - monotonic_clock())
+    if not float_edge_detection:
+        time.sleep(min(FLOAT_POLL_INTERVAL, timeout))
+        return
     
+    float_edge.wait(timeout)
+    float_edge.clear()
+
+def next_wakeup():
+    """Monotonic time the control loop next has work: a job, held-back publish, debounce or fill timeout"""
+    deadline = scheduler.next_deadline()
+    if deadline is None:
+        deadline = monotonic_clock() + 60.0     # no jobs yet (startup)
+    pending_publish = publisher.next_pending_deadline()
+    if pending_publish is not None:
+        deadline = min(deadline, pending_publish)
+    
+    pending_fill = fill.next_deadline(monotonic_clock())
+    if pending_fill is not None:
+        deadline = min(deadline, pending_fill)
+    return deadline
+
+def control_step():
+    """One pass of the control loop: float switch, fill timeout, due jobs, held-back publishes"""
+    global last_float_level
+    
+    if DAILY_USAGE_ROLLOVER and wall_clock().date() != daily_usage_date:
+        rollover_day()
+    
+    level = gpio.read_float()
+    if level != last_float_level:
+        record_event('float', level=level)
+        last_float_level = level
+    
+    new_state = fill.update(level, monotonic_clock())
+    if new_state is not None:
+        handle_float_change(new_state)
+    check_fill_timeout()
+    if not fill.monitoring_enabled:
+        client.publish("aquarium/ato/state", "monitoring_disabled")
+    
+    scheduler.run_due()
+    publisher.flush_pending()
+
+# ============================================================================
+# PUMP CONTROL FUNCTIONS
+# ============================================================================
+
+def record_fill_cycle(runtime_seconds, deducted):
+    """FillControl.on_cycle: record the finished pump run once the history is loaded"""
+    activation_time = last_activation_time if deducted else None     # a manual run is no activation
+    after_history_loaded(record_pump_cycle, runtime_seconds, None, wall_clock(), deducted, activation_time)
+
+def record_pump_cycle(runtime_seconds, volume_liters=None, when=None, deducted=0.0, activation_time=None):
+    """Record a pump cycle for performance tracking.
+    
+    Without `volume_liters` the volume is estimated from the runtime and the
+    calibrated flow rate. Reservoir level and daily usage are corrected to
+    that volume; `deducted` is what the activation already counted. The
+    activation started at `activation_time` (None for a manual run) goes
+    into the usage rollups and the database with the same volume.
+    
+    The pump health columns and `flow_rate_lph` use a volume that does not
+    come from the runtime: once calibrated the estimate is rate x runtime and
+    every cycle would show the same flow. An activation refills the float
+    switch's band, so its volume is the per-activation volume it was counted
+    at (`deducted`, LITERS_PER_ACTIVATION as of the last refill) and a tiring
+    pump shows as a longer runtime, i.e. a lower flow. A manual run has no
+    such volume and gets no flow rate.
+    """
+    global pump_performance_history, reservoir_level, daily_usage
+    
+    flow_calibration.add_cycle(runtime_seconds)
+    flow_volume = volume_liters if volume_liters is not None else deducted
+    if volume_liters is None:
+        volume_liters = flow_calibration.cycle_volume(runtime_seconds, LITERS_PER_ACTIVATION)
+        reservoir_level -= volume_liters - deducted
+        daily_usage += volume_liters - deducted
+    if activation_time is not None:
+        record_activation_volume(activation_time, volume_liters)
+    
+    measured = flow_volume > 0 and runtime_seconds > 0
     performance_record = {
-        'timestamp': datetime.now().isoformat(),
+        'timestamp': (when or wall_clock()).isoformat(),
         'runtime_seconds': round(runtime_seconds, 1),
-        'volume_liters': round(volume_liters, 3),
-        'flow_rate_lph': round((volume_liters / runtime_seconds) * 3600, 1) if runtime_seconds > 0 else 0,
+        'volume_liters': round(flow_volume if measured else volume_liters, 3),
+        'flow_rate_lph': round(flow_volume / runtime_seconds * 3600, 1) if measured else None,
         'season': get_current_season(),
         'reservoir_level_before': round(reservoir_level + volume_liters, 1),
         'reservoir_level_after': round(reservoir_level, 1)
     }
     
     pump_performance_history.append(performance_record)
+    if sqlite_store is not None:
+        sqlite_store.add_pump_cycle(performance_record)
     
     if len(pump_performance_history) > 1000:
         pump_performance_history.pop(0)
     
+    timestamp = (when or wall_clock()).timestamp()
+    if measured:
+        pump_cycles.add(timestamp, runtime_seconds, flow_volume)
+    pump_cycles.prune(timestamp)
+    
     save_pump_performance()
+    save_pump_cycles()
+    save_calibration()
+
+def calculate_pump_health(now=None):
+    """Flow trend, runtime percentiles, degradation slope and health score (see ato_pump.py)"""
+    now = now or wall_clock()
+    return pump_cycles.analyse(now.timestamp(), MAX_FILL_DURATION, PUMP_FLOW_DROP_WARNING)
 
 # ============================================================================
 # CALIBRATION FUNCTIONS
 # ============================================================================
 
-def calculate_calibration():
-    """Calculate liters per activation based on refill history"""
+def apply_calibration():
+    """Take LITERS_PER_ACTIVATION and the confidence from the flow estimate (at load and refills only)"""
     global LITERS_PER_ACTIVATION
-    
-    if len(calibration_data['refill_history']) < 2:
-        calibration_data['confidence'] = 0
+    liters = flow_calibration.liters_per_activation()
+    if liters is None:
         return
-    
-    recent_refills = calibration_data['refill_history'][-5:]
-    
-    total_liters = sum(r['liters'] for r in recent_refills)
-    total_activations = sum(r['activations'] for r in recent_refills)
-    
-    if total_activations == 0:
+    LITERS_PER_ACTIVATION = liters
+    calibration_data['calibrated_lph'] = round(liters, 3)
+    calibration_data['confidence'] = flow_calibration.confidence()
+
+def calculate_calibration(liters_added):
+    """Update the pump flow estimate with a refill (see FlowCalibration)"""
+    if not flow_calibration.add_refill(liters_added, wall_clock().timestamp()):
+        print("   No timed pump cycles since the last refill - calibration unchanged")
         return
     
-    new_calibration = total_liters / total_activations
-    
-    if calibration_data['calibrated_lph'] > 0:
-        LITERS_PER_ACTIVATION = (new_calibration * 0.7) + (calibration_data['calibrated_lph'] * 0.3)
-    else:
-        LITERS_PER_ACTIVATION = new_calibration
-    
-    calibration_data['calibrated_lph'] = round(LITERS_PER_ACTIVATION, 3)
-    calibration_data['last_calibration_date'] = datetime.now().isoformat()
-    
-    num_refills = len(recent_refills)
-    calibration_data['confidence'] = min(100, num_refills * 20)
-    
-    if num_refills >= 3:
-        values = [r['liters'] / r['activations'] for r in recent_refills if r['activations'] > 0]
-        avg = sum(values) / len(values)
-        variance = sum((x - avg) ** 2 for x in values) / len(values)
-        std_dev = variance ** 0.5
-        
-        if std_dev > (avg * 0.2):
-            calibration_data['confidence'] = max(50, calibration_data['confidence'] - 20)
-    
+    apply_calibration()
+    calibration_data['last_calibration_date'] = wall_clock().isoformat()
     save_calibration()
     
-    print(f"🎯 Auto-calibration updated: {LITERS_PER_ACTIVATION:.3f}L/activation (confidence: {calibration_data['confidence']}%)")
-    print(f"   Based on {num_refills} refills: {total_liters}L / {total_activations} activations")
+    variance = flow_calibration.liters_per_activation_variance()
+    print(f"🎯 Auto-calibration updated: {flow_calibration.rate * 3600:.1f}L/h pump flow, "
+          f"{LITERS_PER_ACTIVATION:.3f}L/activation ± {(variance or 0) ** 0.5:.3f} "
+          f"(confidence: {calibration_data['confidence']}%, {flow_calibration.refills} refills)")
     
-    client.publish("aquarium/ato/calibrated_lph", round(LITERS_PER_ACTIVATION, 3))
-    client.publish("aquarium/ato/calibration_confidence", calibration_data['confidence'])
+    publisher.publish("aquarium/ato/calibrated_lph", round(LITERS_PER_ACTIVATION, 3))
+    publisher.publish("aquarium/ato/calibration_confidence", calibration_data['confidence'])
 
 def record_refill(liters_added):
     """Record a reservoir refill for calibration"""
-    global LITERS_PER_ACTIVATION
-    
     activations = calibration_data['activations_since_refill']
     
     if activations > 0 and liters_added > 0:
@@ -524,17 +1118,19 @@ def record_refill(liters_added):
             'activations': activations,
             'liters': liters_added,
             'lph_calculated': liters_added / activations,
-            'date': datetime.now().isoformat()
+            'date': wall_clock().isoformat()
         }
         
         calibration_data['refill_history'].append(refill_record)
+        if sqlite_store is not None:
+            sqlite_store.add_refill(refill_record)
         
         if len(calibration_data['refill_history']) > 20:
             calibration_data['refill_history'].pop(0)
         
         print(f"📊 Refill recorded: {liters_added}L over {activations} activations = {refill_record['lph_calculated']:.3f}L/activation")
-        
-        calculate_calibration()
+    
+    calculate_calibration(liters_added)
     
     calibration_data['activations_since_refill'] = 0
     calibration_data['last_refill_amount'] = liters_added
@@ -549,7 +1145,7 @@ def record_alert(alert):
     global alerts_history
     
     alert_record = {
-        'timestamp': datetime.now().isoformat(),
+        'timestamp': wall_clock().isoformat(),
         'severity': alert['severity'],
         'message': alert['message'],
         'season': get_current_season(),
@@ -558,131 +1154,161 @@ def record_alert(alert):
     }
     
     alerts_history.append(alert_record)
+    if sqlite_store is not None:
+        sqlite_store.add_alert(alert_record)
     
     if len(alerts_history) > 500:
         alerts_history.pop(0)
     
     save_alerts_history()
 
-def check_alerts():
-    """Check all alert conditions"""
-    global stuck_alert_sent, last_temp_alert
-    alerts = []
-    now = datetime.now()
-    
-    if not monitoring_enabled:
-        alerts.append({
-            "severity": "warning",
-            "message": f"⚠️ ATO monitoring is DISABLED{' - ' + disabled_reason if disabled_reason else ''}. Pump will not activate automatically."
-        })
-    
-    if filling_start_time is not None and monitoring_enabled:
-        elapsed = (now - filling_start_time).total_seconds()
-        if elapsed > MAX_FILL_DURATION:
-            alerts.append({
-                "severity": "critical",
-                "message": f"🚨 PUMP TIMEOUT! Running for {int(elapsed)}s (max: {MAX_FILL_DURATION}s). EMERGENCY STOP ACTIVATED!"
-            })
-            if not stuck_alert_sent:
-                stuck_alert_sent = True
-                emergency_stop_pump()
-    
-    # Temperature alerts
-    if current_temperature is not None:
-        if current_temperature <= TEMP_MIN_CRITICAL:
-            alerts.append({
-                "severity": "critical",
-                "message": f"🥶 CRITICAL LOW TEMPERATURE! Tank at {current_temperature}°C (min: {TEMP_MIN_CRITICAL}°C). Check heater immediately!"
-            })
-        elif current_temperature >= TEMP_MAX_CRITICAL:
-            alerts.append({
-                "severity": "critical",
-                "message": f"🔥 CRITICAL HIGH TEMPERATURE! Tank at {current_temperature}°C (max: {TEMP_MAX_CRITICAL}°C). Check chiller/cooling!"
-            })
-        elif current_temperature <= TEMP_MIN_WARNING:
-            alerts.append({
-                "severity": "warning",
-                "message": f"❄️ Low temperature warning: {current_temperature}°C (target: >{TEMP_MIN_WARNING}°C)"
-            })
-        elif current_temperature >= TEMP_MAX_WARNING:
-            alerts.append({
-                "severity": "warning",
-                "message": f"🌡️ High temperature warning: {current_temperature}°C (target: <{TEMP_MAX_WARNING}°C)"
-            })
-        
-        if len(temp_history) >= 2:
-            last_temp = temp_history[-2]['temperature']
-            temp_change = abs(current_temperature - last_temp)
-            
-            if temp_change > 2.0:
-                alerts.append({
-                    "severity": "warning",
-                    "message": f"⚠️ Rapid temperature change: {temp_change:.1f}°C change detected!"
-                })
-    
+def create_alert_rules():
+    """Alert rules for the current thresholds (hysteresis from ALERT_TEMP_HYSTERESIS / ALERT_CLEAR_MARGIN)"""
+    h = ALERT_TEMP_HYSTERESIS
+    m = ALERT_CLEAR_MARGIN
+    
+    def when_enabled(name):
+        return lambda s: s[name] if s['monitoring_enabled'] else None
+    
+    def ratio(window):
+        return lambda s: (s[window] / s['lph_30d']
+                          if s['monitoring_enabled'] and s['lph_30d'] > 0 else None)
+    
+    return [
+        AlertRule.flag('monitoring_disabled', 'warning', ('monitoring_enabled',),
+                       lambda s: not s['monitoring_enabled'],
+                       lambda s: f"⚠️ ATO monitoring is DISABLED{' - ' + s['disabled_reason'] if s['disabled_reason'] else ''}. Pump will not activate automatically."),
+        # Latched from the emergency stop until the next fill starts
+        AlertRule.flag('pump_timeout', 'critical', ('pump_timeout',),
+                       lambda s: s['pump_timeout'],
+                       lambda s: pump_timeout_message(s['fill_elapsed'], s['max_fill_duration'])),
+        AlertRule('temp_low', ('temperature',), lambda s: s['temperature'],
+                  [('critical', TEMP_MIN_CRITICAL, TEMP_MIN_CRITICAL + h),
+                   ('warning', TEMP_MIN_WARNING, TEMP_MIN_WARNING + h)],
+                  lambda severity, s: (f"🥶 CRITICAL LOW TEMPERATURE! Tank at {s['temperature']}°C (min: {TEMP_MIN_CRITICAL}°C). Check heater immediately!"
+                                       if severity == 'critical' else
+                                       f"❄️ Low temperature warning: {s['temperature']}°C (target: >{TEMP_MIN_WARNING}°C)"),
+                  below=True),
+        AlertRule('temp_high', ('temperature',), lambda s: s['temperature'],
+                  [('critical', TEMP_MAX_CRITICAL, TEMP_MAX_CRITICAL - h),
+                   ('warning', TEMP_MAX_WARNING, TEMP_MAX_WARNING - h)],
+                  lambda severity, s: (f"🔥 CRITICAL HIGH TEMPERATURE! Tank at {s['temperature']}°C (max: {TEMP_MAX_CRITICAL}°C). Check chiller/cooling!"
+                                       if severity == 'critical' else
+                                       f"🌡️ High temperature warning: {s['temperature']}°C (target: <{TEMP_MAX_WARNING}°C)")),
+        # Rate of change against the TEMP_TREND_WINDOWS limits (1 = at the limit)
+        AlertRule('temp_rapid_change', ('temp_trend',), lambda s: s['temp_trend'],
+                  [('critical', TEMP_TREND_CRITICAL_FACTOR, TEMP_TREND_CRITICAL_FACTOR * (1 - m)),
+                   ('warning', 1, 1 - m)],
+                  lambda severity, s: temp_trend_message(severity, s['temp_trend_detail'])),
+        AlertRule('evaporation_spike', ('monitoring_enabled', 'lph_1h', 'lph_30d'), ratio('lph_1h'),
+                  [('critical', 4, 4 * (1 - m))],
+                  lambda _, s: f"Major evaporation spike! {s['lph_1h']}L/h (baseline: {s['lph_30d']}L/h)",
+                  strict=True),
+        AlertRule('evaporation_high', ('monitoring_enabled', 'lph_24h', 'lph_30d'), ratio('lph_24h'),
+                  [('warning', 1.5, 1.5 * (1 - m))],
+                  lambda _, s: f"Higher than normal evaporation: {s['lph_24h']}L/h (baseline: {s['lph_30d']}L/h)",
+                  strict=True),
+        AlertRule('activations_per_hour', ('monitoring_enabled', 'activations_1h'), when_enabled('activations_1h'),
+                  [('critical', MAX_ACTIVATIONS_PER_HOUR, MAX_ACTIVATIONS_PER_HOUR * (1 - m))],
+                  lambda _, s: f"Too many ATO activations: {s['activations_1h']} in last hour. Possible leak!",
+                  strict=True),
+        AlertRule('activations_too_frequent', ('monitoring_enabled', 'hours_since', 'activation_count'),
+                  lambda s: s['hours_since'] if s['monitoring_enabled'] and s['activation_count'] > 1 else None,
+                  [('warning', MIN_HOURS_BETWEEN, MIN_HOURS_BETWEEN)],
+                  lambda _, s: f"ATO activating too frequently: {s['hours_since']:.1f} hours since last fill",
+                  below=True, strict=True),
+        AlertRule('no_activity', ('monitoring_enabled', 'hours_since'), when_enabled('hours_since'),
+                  [('warning', MAX_HOURS_BETWEEN, MAX_HOURS_BETWEEN)],
+                  lambda _, s: f"No ATO activity for {s['hours_since']:.1f} hours. Check pump/float switch",
+                  strict=True),
+        AlertRule('daily_usage', ('monitoring_enabled', 'daily_usage'), when_enabled('daily_usage'),
+                  [('warning', MAX_DAILY_USAGE, MAX_DAILY_USAGE * (1 - m))],
+                  lambda _, s: f"High water usage today: {s['daily_usage']:.1f}L",
+                  strict=True),
+        # Early warning from the pump cycle trends, well before MAX_FILL_DURATION trips
+        AlertRule('pump_health', ('pump_health',), lambda s: s['pump_health'],
+                  [('warning', PUMP_HEALTH_WARNING, PUMP_HEALTH_WARNING + 5)],
+                  lambda _, s: f"Pump health {s['pump_health']}/100 ({', '.join(s['pump_reasons']) or 'degrading'}). Check the pump and intake",
+                  below=True),
+        # Measured in low_reservoir_warning units, so each tank's own limit applies (0 = empty)
+        AlertRule('reservoir', ('reservoir_level', 'low_reservoir_warning'), reservoir_fraction,
+                  [('critical', 0, 0),
+                   ('warning', 1, 1 + m)],
+                  lambda severity, s: ("ATO reservoir empty! Refill immediately!" if severity == 'critical' else
+                                       f"ATO reservoir low: {s['reservoir_level']:.1f}L remaining. Refill soon!"),
+                  below=True),
+    ]
+
+def reservoir_fraction(signals):
+    """Reservoir level over its low warning level; 0 once empty, None with the warning turned off"""
+    level, warning = signals['reservoir_level'], signals['low_reservoir_warning']
+    if level <= 0:
+        return 0.0
+    return level / warning if warning > 0 else None
+
+def temp_trend_message(severity, trend):
+    direction = "rising" if trend['rate'] > 0 else "falling"
+    text = (f"Temperature {direction} {abs(trend['rate']):.2f}°C/h over the last {trend['window']} "
+            f"(limit: {trend['limit']}°C/h)")
+    if severity == 'critical':
+        return f"🚨 {text}. Check heater/chiller immediately!"
+    return f"⚠️ {text}"
+
+def setup_alerts():
+    """Create the alert engine from the configured thresholds"""
+    global alert_engine, published_alerts_version
+    alert_engine = AlertEngine(create_alert_rules())
+    published_alerts_version = None
+
+def alert_signals(now):
+    """Inputs of the alert rules; a rule is only re-evaluated when one of its inputs changed"""
     rates = calculate_lph()
+    pump_health = calculate_pump_health(now)
+    trend = temp_trend.anomaly()
+    return {
+        **fill.alert_signals(),
+        'temperature': current_temperature,
+        'temp_trend': round(trend['ratio'], 2) if trend else None,
+        'temp_trend_detail': trend,
+        'lph_1h': rates['lph_1h'],
+        'lph_24h': rates['lph_24h'],
+        'lph_30d': rates['lph_30d'],
+        'activations_1h': activation_history.count('1h', now.timestamp()),
+        'hours_since': (now - last_activation_time).total_seconds() / 3600,
+        'activation_count': activation_count,
+        'daily_usage': daily_usage,
+        'reservoir_level': reservoir_level,
+        'low_reservoir_warning': LOW_RESERVOIR_WARNING,
+        'pump_health': pump_health['health_score'],
+        'pump_reasons': pump_health['reasons'],
+    }
+
+def check_alerts():
+    """Update the alert states; only raised, escalated and cleared alerts are recorded and published"""
+    if not history_ready:
+        return
+    now = wall_clock()
     
-    if monitoring_enabled:
-        if rates["lph_30d"] > 0 and rates["lph_1h"] > rates["lph_30d"] * 4:
-            alerts.append({
-                "severity": "critical",
-                "message": f"Major evaporation spike! {rates['lph_1h']}L/h (baseline: {rates['lph_30d']}L/h)"
-            })
-        
-        if rates["lph_30d"] > 0 and rates["lph_24h"] > rates["lph_30d"] * 1.5:
-            alerts.append({
-                "severity": "warning",
-                "message": f"Higher than normal evaporation: {rates['lph_24h']}L/h (baseline: {rates['lph_30d']}L/h)"
-            })
-        
-        hour_ago = now - timedelta(hours=1)
-        recent = [a for a in activation_history if a >= hour_ago]
-        if len(recent) > MAX_ACTIVATIONS_PER_HOUR:
-            alerts.append({
-                "severity": "critical",
-                "message": f"Too many ATO activations: {len(recent)} in last hour. Possible leak!"
-            })
-        
-        hours_since = (now - last_activation_time).total_seconds() / 3600
-        if hours_since < MIN_HOURS_BETWEEN and activation_count > 1:
-            alerts.append({
-                "severity": "warning",
-                "message": f"ATO activating too frequently: {hours_since:.1f} hours since last fill"
-            })
-        
-        if hours_since > MAX_HOURS_BETWEEN:
-            alerts.append({
-                "severity": "warning",
-                "message": f"No ATO activity for {hours_since:.1f} hours. Check pump/float switch"
-            })
-        
-        if daily_usage > MAX_DAILY_USAGE:
-            alerts.append({
-                "severity": "warning",
-                "message": f"High water usage today: {daily_usage:.1f}L"
-            })
-    
-    if reservoir_level <= LOW_RESERVOIR_WARNING:
-        alerts.append({
-            "severity": "warning",
-            "message": f"ATO reservoir low: {reservoir_level:.1f}L remaining. Refill soon!"
-        })
-    
-    if reservoir_level <= 0:
-        alerts.append({
-            "severity": "critical",
-            "message": "ATO reservoir empty! Refill immediately!"
-        })
-    
-    if alerts:
-        client.publish("aquarium/ato/alerts", json.dumps(alerts))
-        for alert in alerts:
-            client.publish(f"aquarium/ato/alert_{alert['severity']}", alert['message'])
-            record_alert(alert)
-    else:
-        client.publish("aquarium/ato/alerts", json.dumps([]))
-        client.publish("aquarium/ato/alert_critical", "")
-        client.publish("aquarium/ato/alert_warning", "")
+    for transition in alert_engine.evaluate(alert_signals(now), now):
+        if transition['severity'] is None:
+            print(f"✅ Alert cleared: {transition['message']}")
+        else:
+            print(f"{'🚨' if transition['severity'] == 'critical' else '⚠️ '} Alert: {transition['message']}")
+            record_alert(transition)
+    publish_alerts()
+
+def publish_alerts():
+    """Publish the active alerts when they changed since the last publish"""
+    global published_alerts_version
+    if alert_engine.version == published_alerts_version:
+        return
+    published_alerts_version = alert_engine.version
+    active = alert_engine.active_alerts()
+    publisher.publish("aquarium/ato/alerts",
+                      payload_cache.encode([{"severity": a['severity'], "message": a['message']} for a in active]))
+    for severity in ('critical', 'warning'):
+        latest = alert_engine.latest(severity)
+        publisher.publish(f"aquarium/ato/alert_{severity}", latest['message'] if latest else "")
 
 # ============================================================================
 # RATE CALCULATION FUNCTIONS
@@ -690,71 +1316,46 @@ def check_alerts():
 
 def calculate_lph():
     """Calculate liters per hour based on activation history"""
-    now = datetime.now()
+    now = wall_clock().timestamp()
+    counts = activation_history.counts(now)
     
     if not activation_history:
-        return {
-            "lph_1h": 0,
-            "lph_6h": 0,
-            "lph_24h": 0,
-            "lph_7d": 0,
-            "lph_30d": 0
-        }
-    
-    hour_ago = now - timedelta(hours=1)
-    recent_activations = [a for a in activation_history if a >= hour_ago]
-    lph_1h = len(recent_activations) * LITERS_PER_ACTIVATION
+        return {f"lph_{name}": 0 for name in RATE_WINDOWS}
     
-    six_hours_ago = now - timedelta(hours=6)
-    six_hour_activations = [a for a in activation_history if a >= six_hours_ago]
-    hours_elapsed_6h = min(6, (now - activation_history[0]).total_seconds() / 3600)
-    lph_6h = (len(six_hour_activations) * LITERS_PER_ACTIVATION) / hours_elapsed_6h if hours_elapsed_6h > 0 else 0
+    hours_of_history = (now - activation_history.oldest()) / 3600
     
-    day_ago = now - timedelta(hours=24)
-    day_activations = [a for a in activation_history if a >= day_ago]
-    hours_elapsed_24h = min(24, (now - activation_history[0]).total_seconds() / 3600)
-    lph_24h = (len(day_activations) * LITERS_PER_ACTIVATION) / hours_elapsed_24h if hours_elapsed_24h > 0 else 0
+    rates = {"lph_1h": round(counts['1h'] * LITERS_PER_ACTIVATION, 3)}
+    for name, seconds in RATE_WINDOWS.items():
+        if name == '1h':
+            continue
+        hours_elapsed = min(seconds / 3600, hours_of_history)
+        lph = (counts[name] * LITERS_PER_ACTIVATION) / hours_elapsed if hours_elapsed > 0 else 0
+        rates[f"lph_{name}"] = round(lph, 3)
     
-    week_ago = now - timedelta(days=7)
-    week_activations = [a for a in activation_history if a >= week_ago]
-    hours_elapsed_7d = min(168, (now - activation_history[0]).total_seconds() / 3600)
-    lph_7d = (len(week_activations) * LITERS_PER_ACTIVATION) / hours_elapsed_7d if hours_elapsed_7d > 0 else 0
-    
-    month_ago = now - timedelta(days=30)
-    month_activations = [a for a in activation_history if a >= month_ago]
-    hours_elapsed_30d = min(720, (now - activation_history[0]).total_seconds() / 3600)
-    lph_30d = (len(month_activations) * LITERS_PER_ACTIVATION) / hours_elapsed_30d if hours_elapsed_30d > 0 else 0
-    
-    return {
-        "lph_1h": round(lph_1h, 3),
-        "lph_6h": round(lph_6h, 3),
-        "lph_24h": round(lph_24h, 3),
-        "lph_7d": round(lph_7d, 3),
-        "lph_30d": round(lph_30d, 3)
-    }
+    return rates
 
 # ============================================================================
 # MQTT PUBLISHING FUNCTIONS
 # ============================================================================
 
-def publish_stats():
-    """Publish all statistics to MQTT"""
-    now = datetime.now()
+def build_stats(now):
+    """Assemble the aquarium/ato/stats payload"""
     rates = calculate_lph()
     seasonal_stats = calculate_seasonal_stats()
     temp_stats = calculate_temp_stats()
+    temp_age = temp_sampler.age() if temp_sampler is not None else None
     
     hours_until_empty = reservoir_level / rates["lph_30d"] if rates["lph_30d"] > 0 else 999
     days_until_empty = hours_until_empty / 24
     
-    month_ago = now - timedelta(days=30)
-    month_activations = [a for a in activation_history if a >= month_ago]
-    total_30d = len(month_activations) * LITERS_PER_ACTIVATION
+    activations_30d = activation_history.count('30d', now.timestamp())
+    total_30d = activations_30d * LITERS_PER_ACTIVATION
+    lpa_variance = flow_calibration.liters_per_activation_variance()
     
     stats = {
         "daily_usage": round(daily_usage, 2),
         "activation_count": activation_count,
-        "total_activations_30d": len(month_activations),
+        "total_activations_30d": activations_30d,
         "total_liters_30d": round(total_30d, 1),
         "last_activation": last_activation_time.isoformat(),
         "hours_since_last": round((now - last_activation_time).total_seconds() / 3600, 1),
@@ -762,68 +1363,135 @@ def publish_stats():
         "reservoir_percent": round((reservoir_level / RESERVOIR_CAPACITY) * 100, 0),
         "days_until_empty": round(days_until_empty, 1),
         "history_count": len(activation_history),
-        "monitoring_enabled": monitoring_enabled,
-        "disabled_reason": disabled_reason if disabled_reason else "N/A",
-        "filling_duration": round(filling_duration, 1),
-        "pump_running": pump_running,
+        **fill.stats(),
         "calibrated_lph": round(calibration_data['calibrated_lph'], 3),
         "calibration_confidence": calibration_data['confidence'],
+        "calibration_std": round(lpa_variance ** 0.5, 3) if lpa_variance is not None else None,
+        "pump_flow_lph": round(flow_calibration.rate * 3600, 1) if flow_calibration.rate is not None else None,
         "activations_since_refill": calibration_data['activations_since_refill'],
-        "refill_history": calibration_data['refill_history'],
+        "refill_count": len(calibration_data['refill_history']),
+        "last_refill": calibration_data['refill_history'][-1] if calibration_data['refill_history'] else None,
         "current_season": get_current_season(),
         "season_emoji": get_season_emoji(),
         "seasonal_stats": seasonal_stats,
+        "monthly_usage": calculate_monthly_usage(),
         "alerts_count": len(alerts_history),
+        "active_alerts": len(alert_engine.active),
         "pump_cycles_count": len(pump_performance_history),
+        "pump_health": calculate_pump_health(now)['health_score'],
         "temperature": current_temperature,
         "temp_stats": temp_stats,
+        "temp_trend": temp_trend.summary(),
         "temp_sensor_available": temp_sensor_available,
         "temp_calibration_offset": temp_calibration_offset,
         "temp_raw": read_temperature_raw() if temp_sensor_available else None,
+        "temp_age_seconds": round(temp_age, 1) if temp_age is not None else None,
+        "temp_crc_ok": temp_sampler.snapshot.crc_ok if temp_sampler else None,
         **rates
     }
-    
-    client.publish("aquarium/ato/stats", json.dumps(stats))
-    client.publish("aquarium/ato/daily_usage", round(daily_usage, 2))
-    client.publish("aquarium/ato/activations", activation_count)
-    client.publish("aquarium/ato/hours_since", stats["hours_since_last"])
-    client.publish("aquarium/ato/reservoir_level", stats["reservoir_level"])
-    client.publish("aquarium/ato/reservoir_percent", stats["reservoir_percent"])
-    client.publish("aquarium/ato/days_until_empty", stats["days_until_empty"])
-    client.publish("aquarium/ato/total_30d", stats["total_liters_30d"])
-    client.publish("aquarium/ato/monitoring_enabled", "ON" if monitoring_enabled else "OFF")
-    client.publish("aquarium/ato/filling_duration", stats["filling_duration"])
-    client.publish("aquarium/ato/pump_running", "ON" if pump_running else "OFF")
-    client.publish("aquarium/ato/calibrated_lph", stats["calibrated_lph"])
-    client.publish("aquarium/ato/calibration_confidence", stats["calibration_confidence"])
-    client.publish("aquarium/ato/activations_since_refill", stats["activations_since_refill"])
-    client.publish("aquarium/ato/current_season", get_current_season())
-    client.publish("aquarium/ato/seasonal_stats", json.dumps(seasonal_stats))
-    client.publish("aquarium/ato/alerts_history", json.dumps(alerts_history[-50:]))
-    client.publish("aquarium/ato/pump_performance", json.dumps(pump_performance_history[-100:]))
+    return stats
+
+def stats_section_versions(now):
+    """Version of each separately encoded stats section; a section is only re-encoded when it changes"""
+    today = now.date()
+    latest_temp = temp_history[-1][0] if temp_history else None
+    return {
+        'seasonal_stats': (seasonal_rollup.version, today.year, today.month),
+        'monthly_usage': (activation_rollup.version, today),
+        # Windows also move with time: at most a minute of staleness
+        'temp_stats': (latest_temp, temp_rollup.version, int(now.timestamp() // 60)),
+    }
+
+def encode_stats(stats, now):
+    """The aquarium/ato/stats payload plus its cached sections ({name: payload})"""
+    sections = {name: payload_cache.get(name, version, lambda name=name: stats[name])
+                for name, version in stats_section_versions(now).items()}
+    fields = {key: value for key, value in stats.items() if key not in sections}
+    return payload_cache.object(fields, sections), sections
+
+def history_version(history, field='timestamp'):
+    return (len(history), history[-1][field] if history else None)
+
+def publish_stats():
+    """Publish all statistics to MQTT (unchanged values are skipped)"""
+    global publish_metrics
+    if not history_ready:
+        return
+    now = wall_clock()
+    bytes_before = publisher.bytes_sent
+    if seasonal_rollup.mark_day(now):
+        save_seasonal_stats()
+    stats = build_stats(now)
+    payload, sections = encode_stats(stats, now)
+    
+    publisher.publish("aquarium/ato/stats", payload)
+    publisher.publish("aquarium/ato/daily_usage", round(daily_usage, 2))
+    publisher.publish("aquarium/ato/activations", activation_count)
+    publisher.publish("aquarium/ato/hours_since", stats["hours_since_last"])
+    publisher.publish("aquarium/ato/reservoir_level", stats["reservoir_level"])
+    publisher.publish("aquarium/ato/reservoir_percent", stats["reservoir_percent"])
+    publisher.publish("aquarium/ato/days_until_empty", stats["days_until_empty"])
+    publisher.publish("aquarium/ato/total_30d", stats["total_liters_30d"])
+    publisher.publish("aquarium/ato/monitoring_enabled", "ON" if fill.monitoring_enabled else "OFF")
+    publisher.publish("aquarium/ato/filling_duration", stats["filling_duration"])
+    publisher.publish("aquarium/ato/pump_running", "ON" if fill.pump_running else "OFF")
+    publisher.publish("aquarium/ato/calibrated_lph", stats["calibrated_lph"])
+    publisher.publish("aquarium/ato/calibration_confidence", stats["calibration_confidence"])
+    publisher.publish("aquarium/ato/activations_since_refill", stats["activations_since_refill"])
+    publisher.publish("aquarium/ato/current_season", get_current_season())
+    publisher.publish("aquarium/ato/seasonal_stats", sections["seasonal_stats"])
+    # Full histories are served by the query API (QUERY_TOPIC); only the latest entries go out here
+    publisher.publish("aquarium/ato/last_alert",
+                      payload_cache.get('last_alert', history_version(alerts_history),
+                                        lambda: alerts_history[-1] if alerts_history else {}))
+    publisher.publish("aquarium/ato/last_pump_cycle",
+                      payload_cache.get('last_pump_cycle', history_version(pump_performance_history),
+                                        lambda: pump_performance_history[-1] if pump_performance_history else {}))
+    publisher.publish("aquarium/ato/pump_health",
+                      payload_cache.get('pump_health', (pump_cycles.version, int(now.timestamp() // 3600)),
+                                        lambda: calculate_pump_health(now)))
     
     if current_temperature is not None:
-        client.publish("aquarium/ato/temperature", current_temperature)
-        client.publish("aquarium/ato/temp_stats", json.dumps(temp_stats))
-        client.publish("aquarium/ato/temp_calibration_offset", temp_calibration_offset)
+        publisher.publish("aquarium/ato/temperature", current_temperature)
+        publisher.publish("aquarium/ato/temp_stats", sections["temp_stats"])
+        publisher.publish("aquarium/ato/temp_trend", payload_cache.encode(stats["temp_trend"]))
+        publisher.publish("aquarium/ato/temp_calibration_offset", temp_calibration_offset)
         
         raw_temp = read_temperature_raw()
         if raw_temp is not None:
-            client.publish("aquarium/ato/temperature_raw", raw_temp)
+            publisher.publish("aquarium/ato/temperature_raw", raw_temp)
+    
+    publish_sensor_stats(now)
+    
+    publisher.publish("aquarium/ato/lph_1h", stats["lph_1h"])
+    publisher.publish("aquarium/ato/lph_6h", stats["lph_6h"])
+    publisher.publish("aquarium/ato/lph_24h", stats["lph_24h"])
+    publisher.publish("aquarium/ato/lph_7d", stats["lph_7d"])
+    publisher.publish("aquarium/ato/lph_30d", stats["lph_30d"])
     
-    client.publish("aquarium/ato/lph_1h", rates["lph_1h"])
-    client.publish("aquarium/ato/lph_6h", rates["lph_6h"])
-    client.publish("aquarium/ato/lph_24h", rates["lph_24h"])
-    client.publish("aquarium/ato/lph_7d", rates["lph_7d"])
-    client.publish("aquarium/ato/lph_30d", rates["lph_30d"])
+    # Encode time since the previous publish (alerts, queries included) and bytes this cycle sent
+    publish_metrics = {**payload_cache.take_metrics(), 'bytes': publisher.bytes_sent - bytes_before,
+                       'encoder': payload_cache.encoder_name}
+    publisher.publish("aquarium/ato/publish_metrics", payload_cache.encode(publish_metrics))
 
 # ============================================================================
 # MQTT MESSAGE HANDLER
 # ============================================================================
 
+# Commands acted on straight away during startup; the rest wait for the history
+SAFETY_TOPICS = ("aquarium/ato/enable", "aquarium/ato/pump_manual")
+
 def on_message(client, userdata, msg):
     """Handle incoming MQTT messages"""
-    global daily_usage, activation_count, reservoir_level, monitoring_enabled, disabled_reason
+    record_event('mqtt', topic=msg.topic, payload=msg.payload.decode(errors='replace'))
+    if msg.topic in SAFETY_TOPICS:
+        handle_command(msg)
+    else:
+        after_history_loaded(handle_command, msg)
+
+def handle_command(msg):
+    """Act on one command message"""
+    global daily_usage, activation_count, reservoir_level
     
     if msg.topic == "aquarium/ato/reset":
         daily_usage = 0
@@ -841,41 +1509,31 @@ def on_message(client, userdata, msg):
         record_refill(liters_added)
         
         reservoir_level = RESERVOIR_CAPACITY
-        client.publish("aquarium/ato/alert_warning", "")
         publish_stats()
+        check_alerts()
         print(f"💧 Reservoir marked as refilled: {liters_added}L (used for calibration)")
     
     elif msg.topic == "aquarium/ato/enable":
-        payload = msg.payload.decode().strip().lower()
-        
-        if payload == "on" or payload == "true":
-            if not monitoring_enabled:
-                monitoring_enabled = True
-                disabled_reason = None
-                client.publish("aquarium/ato/state", "enabled")
-                client.publish("aquarium/ato/monitoring_enabled", "ON")
-                print("✅ ATO monitoring ENABLED")
-        
-        elif payload == "off" or payload == "false":
-            if monitoring_enabled:
-                stop_pump()
-                monitoring_enabled = False
-                disabled_reason = "Manual disable"
-                client.publish("aquarium/ato/state", "disabled")
-                client.publish("aquarium/ato/monitoring_enabled", "OFF")
-                print("🛑 ATO monitoring DISABLED - Manual")
-        
+        fill.command('enable', msg.payload.decode().strip().lower())
         publish_stats()
         check_alerts()
     
     elif msg.topic == "aquarium/ato/pump_manual":
-        payload = msg.payload.decode().strip().lower()
-        if payload == "on" and not pump_running:
-            start_pump()
-            client.publish("aquarium/ato/state", "manual_fill")
-        elif payload == "off" and pump_running:
-            stop_pump()
-            client.publish("aquarium/ato/state", "idle")
+        fill.command('pump_manual', msg.payload.decode().strip().lower())
+    
+    elif msg.topic.startswith("aquarium/temp/") and msg.topic.endswith("_calibration_set"):
+        name = msg.topic[len("aquarium/temp/"):-len("_calibration_set")]
+        try:
+            offset = float(msg.payload.decode().strip())
+            if not -5.0 <= offset <= 5.0:
+                print(f"⚠️  Temperature calibration offset out of range: {offset}°C (limit: ±5°C)")
+            elif name == PRIMARY_TEMP_SENSOR:
+                set_temp_calibration_offset(offset)
+            elif name in temp_sensors:
+                set_sensor_calibration_offset(name, offset)
+            publish_stats()
+        except ValueError:
+            print("⚠️  Invalid temperature calibration offset")
     
     elif msg.topic == "aquarium/ato/temp_calibration_set":
         try:
@@ -887,135 +1545,468 @@ def on_message(client, userdata, msg):
                 print(f"⚠️  Temperature calibration offset out of range: {offset}°C (limit: ±5°C)")
         except ValueError:
             print("⚠️  Invalid temperature calibration offset")
+    
+    elif msg.topic == QUERY_TOPIC:
+        handle_query(msg)
 
-# ============================================================================
-# MAIN PROGRAM
-# ============================================================================
+def connect_mqtt():
+    """Start connecting to the broker; paho keeps retrying in the background until it answers"""
+    client.on_connect = on_connect
+    client.on_disconnect = on_disconnect
+    client.reconnect_delay_set(min_delay=1, max_delay=MQTT_RECONNECT_MAX_DELAY)
+    try:
+        client.connect_async(MQTT_BROKER, MQTT_PORT, 60)
+    except Exception as e:
+        print(f"⚠️  Invalid MQTT broker setting {MQTT_BROKER}:{MQTT_PORT}: {e}")
+        return
+    client.loop_start()
 
-def main():
-    """Main program loop"""
-    global loop_counter
-    
-    # Load all historical data
-    print("\n🚀 Starting ATO Aquarium Monitor...")
-    print("=" * 60)
-    load_history()
-    load_calibration()
-    load_alerts_history()
-    load_pump_performance()
-    load_temp_history()
-    load_temp_calibration()
-    
-    # Find temperature sensor
-    global temp_sensor_available
-    temp_sensor_available = find_temp_sensor()
-    
-    # Setup MQTT
+def on_connect(client, userdata, flags, rc):
+    """(Re)subscribe and bring Home Assistant up to date after every connect"""
+    if rc != 0:
+        print(f"⚠️  MQTT broker refused the connection (rc={rc}), retrying")
+        return
+    if 'mqtt_connect_seconds' not in startup_metrics:
+        startup_metrics['mqtt_connect_seconds'] = round(time.monotonic() - PROCESS_STARTED, 3)
+        print(f"✅ Connected to MQTT broker at {MQTT_BROKER}:{MQTT_PORT} "
+              f"after {startup_metrics['mqtt_connect_seconds']:.2f}s")
+    else:
+        print("✅ Reconnected to MQTT broker")
+    subscribe_commands()
+    client.publish("aquarium/ato/pump_state", "ON" if fill.pump_running else "OFF")
+    if not history_ready:
+        client.publish("aquarium/ato/state", "startup")
+    publisher.refresh(force=True)
+
+def on_disconnect(client, userdata, rc):
+    if rc != 0:
+        print(f"⚠️  Lost MQTT connection (rc={rc}), reconnecting")
+
+def subscribe_commands():
+    """Route the command topics to on_message"""
     client.on_message = on_message
     client.subscribe("aquarium/ato/reset")
     client.subscribe("aquarium/ato/refill")
     client.subscribe("aquarium/ato/enable")
     client.subscribe("aquarium/ato/pump_manual")
     client.subscribe("aquarium/ato/temp_calibration_set")
-    client.loop_start()
-    
-    # Publish initial state
-    client.publish("aquarium/ato/monitoring_enabled", "ON" if monitoring_enabled else "OFF")
-    client.publish("aquarium/ato/pump_state", "OFF")
-    client.publish("aquarium/ato/state", "startup")
-    time.sleep(1)
+    for name in [PRIMARY_TEMP_SENSOR] + list(temp_sensors):
+        client.subscribe(f"aquarium/temp/{name}_calibration_set")
+    client.subscribe(QUERY_TOPIC)
+
+# ============================================================================
+# HISTORY QUERY API
+# ============================================================================
+
+# History is fetched on demand instead of riding along with every stats publish.
+# A client publishes {"id": "...", "series": "...", "since": ..., "until": ...,
+# "cursor": ..., "limit": ..., "downsample": ...} to QUERY_TOPIC and gets the page
+# on aquarium/ato/query/reply/<id>. A "reply_to" topic is honoured only under that
+# prefix and without wildcards, so a query can never publish to a command topic.
+QUERY_TOPIC = "aquarium/ato/query"
+QUERY_REPLY_PREFIX = "aquarium/ato/query/reply/"
+QUERY_DEFAULT_LIMIT = 100
+QUERY_MAX_LIMIT = 1000
+QUERY_SERIES = ('activations', 'alerts', 'pump_cycles', 'refills', 'temperature')
+
+def record_rows(records, field='timestamp'):
+    """(timestamp, record) pairs for records carrying an ISO timestamp"""
+    for record in records:
+        yield datetime.fromisoformat(record[field]).timestamp(), record
+
+def mean_reading(group):
+    """Downsample a group of (timestamp, [timestamp, temp]) rows to one point"""
+    return [group[0][0], round(sum(item[1] for _, item in group) / len(group), 2)]
+
+def query_rows(query):
+    """Rows of the requested series from `query.start()` on, in time order"""
+    start, until = query.start() or 0.0, query.until
+    # Enough rows for the page, the rows skipped at the cursor and a look-ahead row
+    needed = query.skip + query.limit * query.downsample + 1
+    series = query.series
+    if sqlite_store is not None:
+        sqlite_store.flush()    # include rows still queued for the next batch
+    
+    if series == 'activations':
+        if sqlite_store is not None:
+            times = sqlite_store.activation_times(since=start, until=until)
+        else:
+            times = [t for t in activation_history if t >= start]
+        return ((t, t) for t in times)
+    
+    if series == 'temperature':
+        name = query.request.get('sensor', PRIMARY_TEMP_SENSOR)
+        if name != PRIMARY_TEMP_SENSOR and name not in temp_sensors:
+            raise ValueError(f"unknown sensor {name!r}")
+        if sqlite_store is not None:
+            readings = sqlite_store.iter_temperatures(name, start, until)
+        else:
+            history = temp_history if name == PRIMARY_TEMP_SENSOR else temp_sensors[name]['history']
+            readings = list(history.since(start))
+        return ((ts, [ts, temp]) for ts, temp in readings)
+    
+    if series == 'alerts':
+        if sqlite_store is not None:
+            return record_rows(sqlite_store.alerts_between(start, until, needed))
+        return record_rows(list(alerts_history))
+    
+    if series == 'pump_cycles':
+        if sqlite_store is not None:
+            return record_rows(sqlite_store.pump_cycles_between(start, until, needed))
+        return record_rows(list(pump_performance_history))
+    
+    if series == 'refills':
+        if sqlite_store is not None:
+            return record_rows(sqlite_store.refills_between(start, until, needed), 'date')
+        return record_rows(list(calibration_data['refill_history']), 'date')
+    
+    raise ValueError(f"unknown series {series!r} (expected one of {', '.join(QUERY_SERIES)})")
+
+def valid_reply_topic(topic):
+    return (isinstance(topic, str) and topic.startswith(QUERY_REPLY_PREFIX) and len(topic) > len(QUERY_REPLY_PREFIX)
+            and not any(c in topic for c in '+#\0'))
+
+def query_reply_topic(request, request_id):
+    """The request's reply_to if it is a plain topic under QUERY_REPLY_PREFIX, else the prefix plus its id"""
+    reply_to = request.get('reply_to')
+    if valid_reply_topic(reply_to):
+        return reply_to
+    topic = QUERY_REPLY_PREFIX + str(request_id)
+    return topic if valid_reply_topic(topic) else None
+
+def handle_query(msg):
+    """Answer one history query with a page of results on its reply topic"""
+    request = None
+    try:
+        request = json.loads(msg.payload.decode())
+        query = HistoryQuery(request, QUERY_DEFAULT_LIMIT, QUERY_MAX_LIMIT)
+        request_id = query.id
+        merge = mean_reading if query.series == 'temperature' else None
+        reply = query.page(query_rows(query), merge)
+    except (ValueError, TypeError, KeyError) as e:
+        request_id = request.get('id') if isinstance(request, dict) else None
+        if request_id in (None, ''):
+            print(f"⚠️  Ignoring history query without an id: {e}")
+            return
+        reply = {'id': str(request_id), 'error': str(e)}
+    reply_to = query_reply_topic(request, request_id)
+    if reply_to is None:
+        print(f"⚠️  Ignoring history query: no valid reply topic for id {str(request_id)!r}")
+        return
+    try:
+        client.publish(reply_to, payload_cache.encode(reply))
+    except Exception as e:
+        # Runs on the MQTT network thread: a failed reply must not stop command handling
+        print(f"⚠️  Error publishing history query reply to {reply_to}: {e}")
+
+# ============================================================================
+# METRICS ENDPOINT
+# ============================================================================
+
+METRICS_TANK = 'ato'    # tank label of the single-tank series (its topic prefix)
+
+# Timed into ato_function_duration_seconds; the save_* calls only queue a write,
+# the write itself is timed per store in ato_store_write_seconds
+METRICS_HOT_PATHS = (
+    'handle_float_change', 'check_alerts', 'publish_stats', 'build_stats', 'publish_alerts',
+    'sample_temperature', 'record_temperature', 'record_pump_cycle', 'record_refill',
+    'handle_command', 'handle_query', 'rollover_day',
+    'save_history', 'save_seasonal_stats', 'save_rollups', 'save_calibration', 'save_alerts_history',
+    'save_pump_performance', 'save_pump_cycles', 'save_temp_history', 'save_temp_calibration',
+)
+
+def sensor_snapshots():
+    return temp_sampler.snapshots if temp_sampler is not None else {}
+
+def setup_metrics():
+    """Serve Prometheus metrics on METRICS_PORT and time the hot paths (off when METRICS_PORT is None)"""
+    global metrics, control_step
+    if not METRICS_PORT:
+        return
+    metrics = MonitorMetrics()
+    tank = (METRICS_TANK,)
+    
+    metrics.counter('ato_activations', 'Pump activations since the process started',
+                    lambda: {tank: activations_total}, ('tank',))
+    metrics.counter('ato_mqtt_publishes', 'MQTT messages sent', lambda: publisher.sent if publisher else None)
+    metrics.counter('ato_mqtt_publishes_suppressed', 'MQTT publishes skipped as unchanged',
+                    lambda: publisher.suppressed if publisher else None)
+    metrics.counter('ato_mqtt_publish_bytes', 'MQTT payload bytes sent',
+                    lambda: publisher.bytes_sent if publisher else None)
+    metrics.counter('ato_store_writes', 'Write-behind store saves', lambda: persistence.writes)
+    metrics.counter('ato_store_write_failures', 'Failed write-behind store saves', lambda: persistence.failures)
+    metrics.counter('ato_store_write_bytes', 'Bytes written to the data files (SQLite writes not included)',
+                    lambda: ato_storage.bytes_written)
+    metrics.counter('ato_sensor_read_errors', 'Failed DS18B20 reads',
+                    lambda: {(name,): reading.errors for name, reading in sensor_snapshots().items()}, ('sensor',))
+    
+    metrics.gauge('ato_reservoir_liters', 'Estimated reservoir level', lambda: {tank: reservoir_level}, ('tank',))
+    metrics.gauge('ato_reservoir_capacity_liters', 'Reservoir capacity',
+                  lambda: {tank: RESERVOIR_CAPACITY}, ('tank',))
+    metrics.gauge('ato_daily_usage_liters', "Today's top-off volume", lambda: {tank: daily_usage}, ('tank',))
+    metrics.gauge('ato_pump_running', '1 while the pump runs', lambda: {tank: fill.pump_running}, ('tank',))
+    metrics.gauge('ato_monitoring_enabled', '0 after a manual disable or emergency stop',
+                  lambda: {tank: fill.monitoring_enabled}, ('tank',))
+    metrics.gauge('ato_liters_per_activation', 'Calibrated volume per activation',
+                  lambda: {tank: LITERS_PER_ACTIVATION}, ('tank',))
+    metrics.gauge('ato_calibration_confidence_percent', 'Flow calibration confidence',
+                  lambda: {tank: calibration_data.get('confidence')}, ('tank',))
+    metrics.gauge('ato_pump_health_score', 'Pump health score (0-100)',
+                  lambda: {tank: calculate_pump_health()['health_score'] if history_ready else None}, ('tank',))
+    metrics.gauge('ato_temperature_celsius', 'Latest calibrated temperature',
+                  lambda: {(name,): reading.calibrated for name in sensor_snapshots()
+                           for reading in [latest_temp_reading(name)] if reading is not None}, ('sensor',))
+    metrics.gauge('ato_sensor_reading_age_seconds', 'Seconds since the last good DS18B20 reading',
+                  lambda: {(name,): temp_sampler.age(name) for name in sensor_snapshots()}, ('sensor',))
+    metrics.gauge('ato_alerts_active', 'Active alerts',
+                  lambda: {tank + (severity,): sum(1 for alert in alert_engine.active_alerts()
+                                                   if alert['severity'] == severity)
+                           for severity in ('warning', 'critical')} if alert_engine else {}, ('tank', 'severity'))
+    metrics.gauge('ato_history_ready', '0 while the history still loads at startup', lambda: history_ready)
+    metrics.gauge('ato_startup_seconds', 'Startup phase timings (safe_control, history_load, ready)',
+                  lambda: {(phase.replace('_seconds', ''),): value for phase, value in startup_metrics.items()},
+                  ('phase',))
+    metrics.gauge('ato_stats_publish_bytes', 'MQTT bytes sent by the last stats publish',
+                  lambda: publish_metrics.get('bytes'))
+    metrics.gauge('ato_stats_encode_seconds', 'JSON encode time between the last two stats publishes',
+                  lambda: publish_metrics['encode_ms'] / 1000 if 'encode_ms' in publish_metrics else None)
+    
+    module = sys.modules[__name__]
+    instrument(module, metrics.function_seconds, METRICS_HOT_PATHS)
+    control_step = timed(metrics.loop_seconds, control_step)
+    persistence.on_write = metrics.store_write_seconds.observe
+    metrics.serve(METRICS_PORT, METRICS_BIND)
+
+# ============================================================================
+# SCHEDULED JOBS
+# ============================================================================
+
+scheduler = Scheduler(clock=lambda: monotonic_clock())
+
+def sample_temperature():
+    """Scheduled job: record the sampler's latest reading if it is new"""
+    global last_recorded_temp_seq
+    
+    reading = latest_temp_reading()
+    if reading is not None and reading.seq != last_recorded_temp_seq:
+        last_recorded_temp_seq = reading.seq
+        temp = read_temperature()
+        record_temperature(temp, reading.timestamp)
+        record_event('temp', value=temp)
+        publisher.publish("aquarium/ato/temperature", temp)
+    
+    record_sensor_temperatures()
+
+def seconds_until_midnight():
+    """Seconds until the next local midnight"""
+    now = wall_clock()
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return (midnight - now).total_seconds()
+
+def restore_daily_counters():
+    """Pick up today's usage from the daily rollup after a restart"""
+    global daily_usage, activation_count, daily_usage_date
+    daily_usage_date = wall_clock().date()
+    today = activation_rollup.day(daily_usage_date)
+    activation_count = today['count']
+    daily_usage = today['sum']
+    if activation_count:
+        print(f"✅ Restored today's usage: {daily_usage:.2f}L over {activation_count} activations")
+
+def rollover_day():
+    """Reset the daily counters once the local date has changed.
+
+    Checked at the top of every control step so nothing runs with the old
+    day's totals; the scheduled job only makes sure the loop wakes at midnight.
+    """
+    global daily_usage, activation_count, daily_usage_date
+    today = wall_clock().date()
+    if today != daily_usage_date:
+        print(f"📊 Daily counters reset ({daily_usage:.2f}L over {activation_count} activations on {daily_usage_date})")
+        daily_usage_date = today
+        daily_usage = 0
+        activation_count = 0
+        publish_stats()
+
+def schedule_day_rollover():
+    """Scheduled job: wake at the next local midnight (re-armed each time to follow DST and clock changes)"""
+    scheduler.every('day_rollover', 86400, schedule_day_rollover, delay=seconds_until_midnight())
+
+def schedule_jobs():
+    """Register the periodic jobs driven by the main loop"""
+    if temp_sensor_available:
+        scheduler.every('temperature', TEMP_SAMPLE_INTERVAL, sample_temperature)
+    scheduler.every('alerts', ALERT_CHECK_INTERVAL, check_alerts, delay=ALERT_CHECK_INTERVAL)
+    scheduler.every('stats', STATS_PUBLISH_INTERVAL, publish_stats, delay=STATS_PUBLISH_INTERVAL)
+    scheduler.every('mqtt_refresh', MQTT_FULL_REFRESH_INTERVAL,
+                    lambda: publisher.refresh(force=True), delay=MQTT_FULL_REFRESH_INTERVAL)
+    if DAILY_USAGE_ROLLOVER:
+        schedule_day_rollover()
+
+# ============================================================================
+# STARTUP
+# ============================================================================
+
+def after_history_loaded(func, *args):
+    """Run func now, or queue it until the background history load has finished"""
+    with startup_lock:
+        if not history_ready:
+            deferred_until_loaded.append((func, args))
+            return
+    func(*args)
+
+def load_history_data():
+    """Open storage and load every data file (runs on the history-loader thread)"""
+    global temp_sensor_available
+    started = time.monotonic()
+    try:
+        open_storage()
+        setup_persistence(start=False)
+        load_history()
+        load_calibration()
+        load_seasonal_stats()
+        load_alerts_history()
+        load_pump_performance()
+        load_pump_cycles()
+        load_temp_history()
+        load_temp_calibration()
+        load_rollups()
+        temp_sensor_available = find_temp_sensor()
+    finally:
+        startup_metrics['history_load_seconds'] = round(time.monotonic() - started, 3)
+        float_edge.set()    # wake the control loop to finish startup
+
+def start_history_loader():
+    """Load history in the background while the control loop already runs"""
+    global history_ready, history_loader
+    history_ready = False
+    history_loader = threading.Thread(target=load_history_data, name='history-loader', daemon=True)
+    history_loader.start()
+
+def finish_startup():
+    """Switch from safety-only control to full monitoring once the history is loaded"""
+    global history_ready
+    persistence.start()
+    with startup_lock:
+        history_ready = True
+        deferred = list(deferred_until_loaded)
+        deferred_until_loaded.clear()
+    for func, args in deferred:
+        func(*args)
+    if DAILY_USAGE_ROLLOVER:
+        restore_daily_counters()
+    if temp_sensor_available:
+        start_temp_sampler()
+    subscribe_commands()    # extra sensors' calibration topics are known now
+    schedule_jobs()
+    startup_metrics['ready_seconds'] = round(time.monotonic() - PROCESS_STARTED, 3)
     
     print("\n✅ ATO Monitor Started")
-    print(f"   Monitoring: {'ENABLED' if monitoring_enabled else 'DISABLED'}")
-    print(f"   Float switch: GPIO {FLOAT_PIN}")
+    print(f"   Monitoring: {'ENABLED' if fill.monitoring_enabled else 'DISABLED'}")
+    print(f"   Float switch: GPIO {FLOAT_PIN} ({'edge-triggered' if float_edge_detection else 'polled'})")
     print(f"   Pump relay: GPIO {PUMP_PIN}")
     print(f"   Temperature sensor: {'Found' if temp_sensor_available else 'Not detected'}")
+    for sensor in temp_sensors.values():
+        print(f"   {sensor['name']} sensor: {os.path.basename(sensor['id'])}")
     print(f"   Calibration: {LITERS_PER_ACTIVATION}L/activation (confidence: {calibration_data['confidence']}%)")
     print(f"   Max fill duration: {MAX_FILL_DURATION}s")
-    print(f"   MQTT broker: {MQTT_BROKER}:{MQTT_PORT}")
+    print(f"   MQTT broker: {MQTT_BROKER}:{MQTT_PORT} ({'connected' if client.is_connected() else 'connecting'})")
     print(f"   Current season: {get_current_season()} {get_season_emoji()}")
+    print(f"   Startup: safe control {startup_metrics['safe_control_seconds']:.2f}s, "
+          f"history {startup_metrics['history_load_seconds']:.2f}s, ready {startup_metrics['ready_seconds']:.2f}s")
     print("=" * 60)
     print("\n💚 System running... Press Ctrl+C to stop\n")
     
-    loop_counter = 0
+    publisher.publish("aquarium/ato/startup", payload_cache.encode(startup_metrics))
+    publish_stats()
+
+# ============================================================================
+# MAIN PROGRAM
+# ============================================================================
+
+def main():
+    """Main program loop"""
+    global last_float_level
+    
+    if not CONFIG_LOADED and HARDWARE_BACKEND != 'sim':
+        print("ERROR: config.py not found!")
+        print("Please copy config.example.py to config.py and edit with your settings")
+        exit(1)
+    
+    # systemd stops the service with SIGTERM; unwind through the same shutdown as Ctrl+C
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    
+    if TANKS:
+        # Several float/pump/sensor sets in this process (ato_tanks.py)
+        from ato_tanks import run_tanks
+        run_tanks(sys.modules[__name__])
+        return
+    
+    # Safety first: pump off and the float switch watched before anything slow
+    print("\n🚀 Starting ATO Aquarium Monitor...")
+    print("=" * 60)
+    setup_state()
+    setup_alerts()
+    setup_hardware()
+    open_event_log()
+    
+    if setup_float_edge_detection():
+        fill.float_filter = FloatFilter(gpio.read_float(),
+                                        start_hold=FLOAT_START_DEBOUNCE_MS / 1000.0,
+                                        stop_hold=FLOAT_STOP_DEBOUNCE_MS / 1000.0)
+    else:
+        fill.float_filter = FloatFilter(gpio.read_float())
+    last_float_level = fill.float_filter.state
+    record_event('float', level=last_float_level)
+    publisher.publish("aquarium/ato/monitoring_enabled", "ON" if fill.monitoring_enabled else "OFF")
+    
+    startup_metrics['safe_control_seconds'] = round(time.monotonic() - PROCESS_STARTED, 3)
+    print(f"✅ Float/pump control active after {startup_metrics['safe_control_seconds']:.2f}s")
+    setup_metrics()
+    
+    # History, calibration and sensors load in the background
+    start_history_loader()
     
     try:
         while True:
-            if monitoring_enabled:
-                current_state = GPIO.input(FLOAT_PIN)
-                
-                if current_state != last_state:
-                    if current_state == 0:
-                        if not pump_running:
-                            activation_count += 1
-                            daily_usage += LITERS_PER_ACTIVATION
-                            reservoir_level -= LITERS_PER_ACTIVATION
-                            last_activation_time = datetime.now()
-                            
-                            calibration_data['activations_since_refill'] += 1
-                            save_calibration()
-                            
-                            activation_history.append(last_activation_time)
-                            
-                            month_ago = datetime.now() - timedelta(days=30)
-                            activation_history = [a for a in activation_history if a >= month_ago]
-                            
-                            save_history()
-                            
-                            start_pump()
-                            client.publish("aquarium/ato/state", "filling")
-                            publish_stats()
-                            check_alerts()
-                            
-                            print(f"💧 ATO activation #{activation_count} (#{calibration_data['activations_since_refill']} since refill)")
-                    
-                    else:
-                        if pump_running:
-                            stop_pump()
-                            client.publish("aquarium/ato/state", "idle")
-                            publish_stats()
-                
-                if filling_start_time is not None:
-                    elapsed = (datetime.now() - filling_start_time).total_seconds()
-                    filling_duration = elapsed
-                    
-                    if elapsed > MAX_FILL_DURATION:
-                        check_alerts()
-                        client.publish("aquarium/ato/filling_duration", round(elapsed, 1))
-                
-                last_state = current_state
-            else:
-                if pump_running:
-                    stop_pump()
-                client.publish("aquarium/ato/state", "monitoring_disabled")
-                filling_start_time = None
-                filling_duration = 0
-            
-            # Read temperature every 30 seconds
-            if temp_sensor_available and loop_counter % 60 == 0:
-                temp = read_temperature()
-                if temp is not None:
-                    record_temperature(temp)
-                    client.publish("aquarium/ato/temperature", temp)
-            
-            # Periodic update every 5 minutes
-            if int(time.time()) % 300 == 0:
-                check_alerts()
-                publish_stats()
+            control_step()
+            if not history_ready and not history_loader.is_alive():
+                finish_startup()
             
-            loop_counter += 1
-            time.sleep(0.5)
+            # Sleep until the next job, held-back publish or float edge
+            wait_for_float(next_wakeup())
     
-    except KeyboardInterrupt:
+    except (KeyboardInterrupt, SystemExit):
         print("\n\n🛑 Shutting down...")
-        stop_pump()
-        save_history()
-        save_calibration()
-        save_alerts_history()
-        save_pump_performance()
-        save_temp_history()
-        GPIO.cleanup()
-        print("✅ Goodbye!")
+    finally:
+        # Also after an unexpected error: pump off and every dirty store written
+        shutdown()
+
+def handle_sigterm(signum, frame):
+    raise SystemExit(0)
+
+def ignore_sigterm():
+    """Ignore further SIGTERMs so a second stop cannot cut the final writes short"""
+    if threading.current_thread() is threading.main_thread():
+        signal.signal(signal.SIGTERM, signal.SIG_IGN)
+
+def shutdown():
+    """Stop the pump and threads, write everything still dirty and release the hardware"""
+    ignore_sigterm()
+    fill.stop_pump()
+    if temp_sampler is not None:
+        temp_sampler.stop()
+    persistence.stop()
+    activation_log.close()
+    if sqlite_store is not None:
+        sqlite_store.close()
+    if event_log is not None:
+        event_log.close()
+    if metrics is not None:
+        metrics.stop()
+    client.loop_stop()
+    gpio.cleanup()
+    print("✅ Goodbye!")
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+"""
+ATO Aquarium Monitor - MQTT Publishing Helpers
+License: MIT
+
+- Change-only publisher with per-topic minimum intervals and periodic refresh
+- Paged, downsampled history queries answered on a reply topic
+- JSON payload cache that re-encodes a section only when its data changed,
+  using orjson when it is installed
+"""
+
+import json
+import threading
+import time
+from datetime import datetime
+
+try:
+    import orjson   # optional faster encoder: pip3 install orjson
+except ImportError:
+    orjson = None
+
+# ============================================================================
+# CHANGE-ONLY PUBLISHER
+# ============================================================================
+
+
+class ChangePublisher:
+    """Publish a topic only when its payload differs from the last one sent.
+
+    Topics listed in ``min_intervals`` (exact topic, or a prefix ending in
+    '#') are rate limited: a change arriving too soon is held back and sent
+    by ``flush_pending()`` once the interval has passed, so the latest value
+    always goes out. ``refresh()`` re-sends every known topic so subscribers
+    that missed a message (e.g. a restarted Home Assistant) catch up.
+    """
+
+    def __init__(self, client, refresh_interval=3600, min_intervals=None, clock=time.monotonic):
+        self.client = client
+        self.refresh_interval = refresh_interval
+        self.min_intervals = dict(min_intervals or {})
+        self.clock = clock
+        self._last = {}         # topic -> (payload, sent_at)
+        self._pending = {}      # topic -> payload held back by a min interval
+        self._lock = threading.RLock()  # in-process brokers deliver synchronously
+        self._next_refresh = clock() + refresh_interval
+        self.sent = 0
+        self.suppressed = 0
+        self.bytes_sent = 0
+
+    @staticmethod
+    def _normalise(payload):
+        if payload is None:
+            return ''
+        if isinstance(payload, (str, bytes, bytearray)):
+            return payload
+        return str(payload)
+
+    def _min_interval(self, topic):
+        interval = self.min_intervals.get(topic)
+        if interval is not None:
+            return interval
+        for pattern, seconds in self.min_intervals.items():
+            if pattern.endswith('#') and topic.startswith(pattern[:-1]):
+                return seconds
+        return 0
+
+    def _send(self, topic, payload, now):
+        self.client.publish(topic, payload)
+        self._last[topic] = (payload, now)
+        self._pending.pop(topic, None)
+        self.sent += 1
+        self.bytes_sent += len(payload) if isinstance(payload, (bytes, bytearray)) else len(payload.encode('utf-8'))
+
+    def publish(self, topic, payload):
+        """Publish payload if it changed; returns True when a message was sent"""
+        payload = self._normalise(payload)
+        with self._lock:
+            now = self.clock()
+            last = self._last.get(topic)
+            if last is not None and last[0] == payload:
+                self._pending.pop(topic, None)
+                self.suppressed += 1
+                return False
+            interval = self._min_interval(topic)
+            if last is not None and interval and now - last[1] < interval:
+                self._pending[topic] = payload
+                self.suppressed += 1
+                return False
+            self._send(topic, payload, now)
+            return True
+
+    def forget(self, topic=None):
+        """Drop the remembered value so the next publish always goes out"""
+        with self._lock:
+            if topic is None:
+                self._last.clear()
+            else:
+                self._last.pop(topic, None)
+
+    def flush_pending(self):
+        """Send held-back changes whose minimum interval has passed"""
+        with self._lock:
+            now = self.clock()
+            for topic, payload in list(self._pending.items()):
+                if now - self._last[topic][1] >= self._min_interval(topic):
+                    self._send(topic, payload, now)
+
+    def next_pending_deadline(self):
+        """Monotonic time the next held-back change becomes due, or None"""
+        with self._lock:
+            deadlines = [self._last[topic][1] + self._min_interval(topic) for topic in self._pending]
+        return min(deadlines) if deadlines else None
+
+    def refresh(self, force=False):
+        """Re-send every known topic when the refresh interval is due"""
+        with self._lock:
+            now = self.clock()
+            if not force and now < self._next_refresh:
+                return False
+            self._next_refresh = now + self.refresh_interval
+            for topic, (payload, _) in list(self._last.items()):
+                self._send(topic, self._pending.get(topic, payload), now)
+            for topic, payload in list(self._pending.items()):
+                self._send(topic, payload, now)
+            return True
+
+
+# ============================================================================
+# PAYLOAD ENCODING
+# ============================================================================
+
+
+def _stdlib_dumps(obj):
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _orjson_dumps(obj):
+    return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+
+
+def json_encoder(name='auto'):
+    """(name, encode) for a JSON encoder returning compact UTF-8 bytes.
+
+    'auto' picks orjson when it is installed and the standard library
+    otherwise; both produce the same bytes for the payloads published here.
+    """
+    if name == 'orjson' and orjson is None:
+        raise ValueError("JSON_ENCODER is 'orjson' but orjson is not installed")
+    if name in ('auto', 'orjson') and orjson is not None:
+        return 'orjson', _orjson_dumps
+    if name not in ('auto', 'json'):
+        raise ValueError(f"Unknown JSON encoder: {name!r}")
+    return 'json', _stdlib_dumps
+
+
+class PayloadCache:
+    """Encoded JSON payloads keyed by section.
+
+    ``get()`` re-encodes a section only when the version passed in differs
+    from the one it was encoded at, so unchanged data costs a dict lookup.
+    ``object()`` splices cached sections into a freshly encoded object.
+    Encode time and counts accumulate until ``take_metrics()``.
+    """
+
+    def __init__(self, encoder='auto', clock=time.perf_counter):
+        self.encoder_name, self._dumps = json_encoder(encoder)
+        self.clock = clock
+        self._entries = {}      # section -> (version, payload)
+        self._lock = threading.Lock()
+        self.encode_seconds = 0.0
+        self.encoded = 0
+        self.hits = 0
+
+    def encode(self, obj):
+        """Encode `obj` now (timed)"""
+        started = self.clock()
+        payload = self._dumps(obj)
+        with self._lock:
+            self.encode_seconds += self.clock() - started
+            self.encoded += 1
+        return payload
+
+    def get(self, section, version, build):
+        """Payload of `section` at `version`; `build()` supplies the data when it must be re-encoded"""
+        with self._lock:
+            entry = self._entries.get(section)
+            if entry is not None and entry[0] == version:
+                self.hits += 1
+                return entry[1]
+        payload = self.encode(build())
+        with self._lock:
+            self._entries[section] = (version, payload)
+        return payload
+
+    def object(self, fields, sections):
+        """A JSON object of `fields` plus already encoded `sections` ({key: payload})"""
+        head = self.encode(fields)
+        parts = [head[:-1]]
+        separator = b',' if len(head) > 2 else b''
+        for key, payload in sections.items():
+            parts.append(separator + self._dumps(key) + b':' + payload)
+            separator = b','
+        parts.append(b'}')
+        return b''.join(parts)
+
+    def forget(self, section=None):
+        """Drop cached payloads so they are re-encoded on next use"""
+        with self._lock:
+            if section is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(section, None)
+
+    def take_metrics(self):
+        """Encode time and counts since the previous call"""
+        with self._lock:
+            metrics = {'encode_ms': round(self.encode_seconds * 1000, 3),
+                       'encoded': self.encoded, 'cached': self.hits}
+            self.encode_seconds, self.encoded, self.hits = 0.0, 0, 0
+        return metrics
+
+
+# ============================================================================
+# HISTORY QUERIES
+# ============================================================================
+
+
+def parse_time(value):
+    """Epoch seconds or an ISO 8601 string as epoch seconds (None stays None)"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(str(value)).timestamp()
+
+
+class HistoryQuery:
+    """One page of a history query sent over MQTT.
+
+    A request is a JSON object: ``id`` (echoed in the reply and used for the
+    default reply topic), ``series``, optional ``since``/``until`` (epoch
+    seconds or ISO 8601), ``cursor`` (``next_cursor`` of the previous page),
+    ``limit`` and ``downsample`` (combine every N rows into one item).
+
+    Rows are (timestamp, item) pairs in time order. The cursor is
+    "<timestamp>:<rows already returned at that timestamp>", so pages stay
+    consistent while new rows are appended and old ones expire.
+    """
+
+    def __init__(self, request, default_limit=100, max_limit=500):
+        if not isinstance(request, dict) or request.get('id') in (None, ''):
+            raise ValueError("request must be a JSON object with an 'id'")
+        self.id = str(request['id'])
+        self.series = request.get('series')
+        self.request = request
+        self.since = parse_time(request.get('since'))
+        self.until = parse_time(request.get('until'))
+        self.limit = min(max(1, int(request.get('limit', default_limit))), max_limit)
+        self.downsample = max(1, int(request.get('downsample', 1)))
+        self.after, self.skip = None, 0
+        if request.get('cursor'):
+            timestamp, _, skip = str(request['cursor']).rpartition(':')
+            self.after, self.skip = float(timestamp), int(skip)
+
+    def start(self):
+        """Earliest timestamp a source has to return for this page"""
+        bounds = [t for t in (self.since, self.after) if t is not None]
+        return max(bounds) if bounds else None
+
+    def page(self, rows, merge=None):
+        """Reply for the next page of `rows`; `merge(group)` turns a downsample group into one item"""
+        merge = merge or (lambda group: group[0][1])
+        items, group = [], []
+        last, run, skip = self.after, self.skip, self.skip
+        more = False
+        for timestamp, item in rows:
+            if self.since is not None and timestamp < self.since:
+                continue
+            if self.until is not None and timestamp >= self.until:
+                break
+            if self.after is not None:
+                if timestamp < self.after:
+                    continue
+                if timestamp == self.after and skip:
+                    skip -= 1
+                    continue
+            if len(items) == self.limit:
+                more = True
+                break
+            group.append((timestamp, item))
+            run = run + 1 if timestamp == last else 1
+            last = timestamp
+            if len(group) == self.downsample:
+                items.append(merge(group))
+                group = []
+        if group:
+            items.append(merge(group))
+        return {
+            'id': self.id,
+            'series': self.series,
+            'items': items,
+            'count': len(items),
+            'next_cursor': f"{last!r}:{run}" if more else None,
+        }
@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+ATO Aquarium Monitor - Pump Performance Analytics
+License: MIT
+
+Years of pump cycles kept as columns (timestamp, runtime, volume) and
+analysed in whole-array passes, to catch a clogging intake or a tiring pump
+long before MAX_FILL_DURATION trips:
+- Flow rate now vs. the pump's own baseline, and a weekly trend
+- Runtime percentiles
+- Degradation slope and the projected days until fills hit the time limit
+- A 0-100 health score
+
+NumPy is used when installed; the pure-Python fallback gives the same results.
+"""
+
+import bisect
+import math
+import threading
+from array import array
+
+try:
+    import numpy as np     # optional: pip3 install numpy
+except ImportError:
+    np = None
+
+DAY = 86400.0
+
+# Analysis windows (days)
+RECENT_DAYS = 7            # "current" flow rate
+MONTH_DAYS = 30            # runtime percentiles, flow_30d
+BASELINE_DAYS = 90         # baseline: the 90 days before the last month
+TREND_DAYS = 90            # degradation slope fit
+TREND_WEEKS = 12           # weekly flow trend points
+MIN_CYCLES = 5             # fewer cycles than this in a window gives None
+
+
+# ============================================================================
+# COLUMNAR CYCLE STORE
+# ============================================================================
+
+
+class PumpCycles:
+    """Pump cycles as parallel arrays, oldest first.
+
+    Appends are O(1) (an insert only for the odd out-of-order record) and
+    each column reaches NumPy as one block copy. ``analyse()`` results are
+    cached until a cycle is added or the hour changes.
+    """
+
+    def __init__(self, retention_seconds=1830 * DAY):
+        self.retention_seconds = retention_seconds
+        self.timestamps = array('d')
+        self.runtimes = array('d')
+        self.volumes = array('d')
+        self.version = 0
+        self._cache = None
+        self._lock = threading.Lock()   # cycles are recorded from the MQTT thread too
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    def clear(self):
+        with self._lock:
+            for column in (self.timestamps, self.runtimes, self.volumes):
+                del column[:]
+            self.version += 1
+
+    def add(self, timestamp, runtime_seconds, volume_liters):
+        """Record one cycle"""
+        with self._lock:
+            self._insert(timestamp, runtime_seconds, volume_liters)
+            self.version += 1
+
+    def extend(self, cycles):
+        """Record (timestamp, runtime, volume) tuples"""
+        with self._lock:
+            for cycle in cycles:
+                self._insert(*cycle)
+            self.version += 1
+
+    def _insert(self, timestamp, runtime_seconds, volume_liters):
+        if not self.timestamps or timestamp >= self.timestamps[-1]:
+            self.timestamps.append(timestamp)
+            self.runtimes.append(runtime_seconds)
+            self.volumes.append(volume_liters)
+        else:
+            index = bisect.bisect_right(self.timestamps, timestamp)
+            self.timestamps.insert(index, timestamp)
+            self.runtimes.insert(index, runtime_seconds)
+            self.volumes.insert(index, volume_liters)
+
+    def prune(self, now):
+        """Drop cycles older than the retention period"""
+        with self._lock:
+            cut = bisect.bisect_left(self.timestamps, now - self.retention_seconds)
+            if cut:
+                for column in (self.timestamps, self.runtimes, self.volumes):
+                    del column[:cut]
+                self.version += 1
+
+    def to_dict(self):
+        with self._lock:
+            return {'timestamps': self.timestamps.tobytes(), 'runtimes': self.runtimes.tobytes(),
+                    'volumes': self.volumes.tobytes()}
+
+    def from_dict(self, data):
+        with self._lock:
+            for name in ('timestamps', 'runtimes', 'volumes'):
+                column = array('d')
+                column.frombytes(data.get(name, b''))
+                setattr(self, name, column)
+            self.version += 1
+
+    def analyse(self, now, max_runtime, flow_drop_warning=15.0):
+        """Pump health summary at `now` (see analyse_cycles), cached per version and hour"""
+        with self._lock:
+            key = (self.version, int(now // 3600), max_runtime, flow_drop_warning)
+            if self._cache is None or self._cache[0] != key:
+                result = analyse_cycles(self.timestamps, self.runtimes, self.volumes,
+                                        now, max_runtime, flow_drop_warning)
+                self._cache = (key, result)
+            return self._cache[1]
+
+
+# ============================================================================
+# ANALYSIS
+# ============================================================================
+
+
+def _round(value, digits=1):
+    return round(value, digits) if value is not None else None
+
+
+def analyse_cycles(timestamps, runtimes, volumes, now, max_runtime, flow_drop_warning=15.0):
+    """Health summary of the cycles given as time-ordered columns.
+
+    Flow is volume / runtime in L/h. The baseline is the median flow over
+    the BASELINE_DAYS before the last month (or over everything before the
+    last week while the history is short). The degradation slope is a least
+    squares fit of flow over the last TREND_DAYS, in percent of the fitted
+    flow per month. A flow drop of `flow_drop_warning` percent costs 40
+    health points; p90 runtimes approaching `max_runtime` and a projected
+    runtime limit within 90 days cost up to 40 and 20 more.
+    """
+    if np is not None:
+        columns = _columns_numpy(timestamps, runtimes, volumes)
+    else:
+        columns = _columns_python(timestamps, runtimes, volumes)
+    ops = _NUMPY_OPS if np is not None else _PYTHON_OPS
+    t, runtime, flow = columns
+
+    def since(days, until_days=0):
+        return ops['slice'](t, now - days * DAY, now - until_days * DAY)
+
+    recent, month = since(RECENT_DAYS), since(MONTH_DAYS)
+    baseline = since(MONTH_DAYS + BASELINE_DAYS, MONTH_DAYS)
+    if baseline[1] - baseline[0] < MIN_CYCLES:
+        baseline = since(float('inf'), RECENT_DAYS)
+
+    def median_flow(window):
+        lo, hi = window
+        return ops['percentile'](flow, lo, hi, 50) if hi - lo >= MIN_CYCLES else None
+
+    flow_recent = median_flow(recent)
+    flow_month = median_flow(month)
+    flow_baseline = median_flow(baseline)
+    lo, hi = month
+    percentiles = ({p: ops['percentile'](runtime, lo, hi, p) for p in (50, 90, 99)}
+                   if hi - lo >= MIN_CYCLES else {p: None for p in (50, 90, 99)})
+
+    lo, hi = since(TREND_DAYS)
+    flow_slope = runtime_slope = None
+    if hi - lo >= MIN_CYCLES and t[hi - 1] - t[lo] >= 7 * DAY:
+        flow_slope = ops['slope'](t, flow, lo, hi)          # L/h per second
+        runtime_slope = ops['slope'](t, runtime, lo, hi)    # s per second
+    weekly = ops['weekly'](t, flow, now)
+
+    flow_change = None
+    current = flow_recent if flow_recent is not None else flow_month
+    if current is not None and flow_baseline:
+        flow_change = (current / flow_baseline - 1) * 100
+    slope_pct_month = None
+    if flow_slope is not None and current:
+        slope_pct_month = flow_slope * MONTH_DAYS * DAY / current * 100
+    days_to_limit = None
+    p90 = percentiles[90]
+    if runtime_slope is not None and runtime_slope > 0 and p90 is not None:
+        days_to_limit = max(0.0, (max_runtime - p90) / (runtime_slope * DAY))
+
+    # Health: 100 minus penalties for lost flow, long runtimes and a looming limit
+    score, reasons = 100.0, []
+    if flow_change is not None and flow_change < 0:
+        score -= min(60.0, -flow_change / flow_drop_warning * 40)
+        if -flow_change >= flow_drop_warning / 2:
+            reasons.append(f"flow {-flow_change:.0f}% below baseline")
+    if p90 is not None and max_runtime:
+        usage = p90 / max_runtime
+        score -= min(40.0, max(0.0, (usage - 0.5) / 0.5 * 40))
+        if usage >= 0.7:
+            reasons.append(f"p90 runtime {p90:.1f}s of {max_runtime}s max")
+    if days_to_limit is not None and days_to_limit < 90:
+        score -= (90 - days_to_limit) / 90 * 20
+        reasons.append(f"runtime limit reached in ~{days_to_limit:.0f} days")
+    have_data = len(t) >= MIN_CYCLES
+
+    return {
+        'cycles': len(t),
+        'cycles_30d': month[1] - month[0],
+        'flow_lph_7d': _round(flow_recent),
+        'flow_lph_30d': _round(flow_month),
+        'flow_lph_baseline': _round(flow_baseline),
+        'flow_change_pct': _round(flow_change),
+        'flow_slope_pct_month': _round(slope_pct_month),
+        'flow_weekly': [_round(value) for value in weekly],
+        'runtime_p50': _round(percentiles[50]),
+        'runtime_p90': _round(percentiles[90]),
+        'runtime_p99': _round(percentiles[99]),
+        'days_to_runtime_limit': _round(days_to_limit, 0),
+        'health_score': round(max(0.0, score)) if have_data else None,
+        'reasons': reasons,
+    }
+
+
+# NumPy passes --------------------------------------------------------------
+
+
+def _columns_numpy(timestamps, runtimes, volumes):
+    # Copies (a memcpy), so no buffer export keeps the arrays from growing
+    t = np.frombuffer(timestamps, dtype=np.float64).copy()
+    runtime = np.frombuffer(runtimes, dtype=np.float64).copy()
+    volume = np.frombuffer(volumes, dtype=np.float64).copy()
+    valid = runtime > 0
+    t, runtime, volume = t[valid], runtime[valid], volume[valid]
+    return t, runtime, volume / runtime * 3600
+
+
+def _slice_numpy(t, start, end):
+    return int(np.searchsorted(t, start, 'left')), int(np.searchsorted(t, end, 'left'))
+
+
+def _percentile_numpy(values, lo, hi, p):
+    return float(np.percentile(values[lo:hi], p))
+
+
+def _slope_numpy(t, values, lo, hi):
+    x = t[lo:hi] - t[lo]
+    y = values[lo:hi]
+    dx = x - x.mean()
+    denom = float(np.dot(dx, dx))
+    return float(np.dot(dx, y - y.mean())) / denom if denom else None
+
+
+def _weekly_numpy(t, flow, now):
+    start = now - TREND_WEEKS * 7 * DAY
+    lo, hi = _slice_numpy(t, start, now + 1)
+    weeks = ((t[lo:hi] - start) // (7 * DAY)).astype(np.int64).clip(0, TREND_WEEKS - 1)
+    counts = np.bincount(weeks, minlength=TREND_WEEKS)
+    sums = np.bincount(weeks, weights=flow[lo:hi], minlength=TREND_WEEKS)
+    return [float(s / c) if c else None for s, c in zip(sums, counts)]
+
+
+_NUMPY_OPS = {'slice': _slice_numpy, 'percentile': _percentile_numpy,
+              'slope': _slope_numpy, 'weekly': _weekly_numpy}
+
+
+# Pure-Python fallback --------------------------------------------------------
+
+
+def _columns_python(timestamps, runtimes, volumes):
+    t, runtime, flow = [], [], []
+    for timestamp, seconds, liters in zip(timestamps, runtimes, volumes):
+        if seconds > 0:
+            t.append(timestamp)
+            runtime.append(seconds)
+            flow.append(liters / seconds * 3600)
+    return t, runtime, flow
+
+
+def _slice_python(t, start, end):
+    return bisect.bisect_left(t, start), bisect.bisect_left(t, end)
+
+
+def _percentile_python(values, lo, hi, p):
+    """Linear interpolation between closest ranks (NumPy's default method)"""
+    ordered = sorted(values[lo:hi])
+    rank = (len(ordered) - 1) * p / 100
+    below = math.floor(rank)
+    above = min(below + 1, len(ordered) - 1)
+    return ordered[below] + (ordered[above] - ordered[below]) * (rank - below)
+
+
+def _slope_python(t, values, lo, hi):
+    n = hi - lo
+    x = [t[i] - t[lo] for i in range(lo, hi)]
+    y = values[lo:hi]
+    mean_x, mean_y = sum(x) / n, sum(y) / n
+    denom = sum((xi - mean_x) ** 2 for xi in x)
+    return sum((xi - mean_x) * (yi - mean_y) for xi, yi in zip(x, y)) / denom if denom else None
+
+
+def _weekly_python(t, flow, now):
+    start = now - TREND_WEEKS * 7 * DAY
+    lo, hi = _slice_python(t, start, now + 1)
+    counts, sums = [0] * TREND_WEEKS, [0.0] * TREND_WEEKS
+    for i in range(lo, hi):
+        week = min(TREND_WEEKS - 1, max(0, int((t[i] - start) // (7 * DAY))))
+        counts[week] += 1
+        sums[week] += flow[i]
+    return [s / c if c else None for s, c in zip(sums, counts)]
+
+
+_PYTHON_OPS = {'slice': _slice_python, 'percentile': _percentile_python,
+               'slope': _slope_python, 'weekly': _weekly_python}
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+ATO Aquarium Monitor - History Replay
+License: MIT
+
+Drives ato_monitor.py from a recorded event stream under a virtual clock, so
+threshold changes can be tried against past data in seconds:
+
+    python3 ato_replay.py events.jsonl --set MAX_DAILY_USAGE=8 --set TEMP_MAX_WARNING=27.5
+
+The stream is JSON lines as written by the monitor when EVENT_LOG_FILE is
+set. Every event has a ``time`` (epoch seconds or ISO 8601) and a ``type``:
+
+    {"time": 1751700000.0, "type": "float", "level": 0}
+    {"time": 1751700030.0, "type": "temp", "value": 25.4}
+    {"time": 1751703600.0, "type": "refill", "liters": 20.0}
+    {"time": 1751707200.0, "type": "mqtt", "topic": "aquarium/ato/enable", "payload": "off"}
+
+Between events the clock jumps straight to the next scheduled job, debounce
+deadline or fill timeout, so the real control loop, alerting and stats code
+runs without sleeping. GPIO and MQTT go to in-process simulators and data
+files to a temporary directory. With DAILY_USAGE_ROLLOVER off, the Home
+Assistant midnight reset of the daily counter is emulated unless the stream
+contains its own resets.
+
+Output is JSON: the alert timeline, a stats series (one entry per stats
+publish) and a summary.
+"""
+
+import argparse
+import ast
+import contextlib
+import json
+import os
+import runpy
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import ato_monitor as monitor
+from ato_hal import Backends, InMemoryBroker, SimulatedGPIO
+
+# Stats fields kept in the series unless --full-stats is given
+STATS_FIELDS = ('daily_usage', 'activation_count', 'reservoir_level', 'days_until_empty',
+                'total_liters_30d', 'temperature', 'lph_1h', 'lph_24h', 'lph_7d', 'lph_30d')
+
+
+class VirtualClock:
+    """Settable clock standing in for datetime.now() and time.monotonic()"""
+
+    def __init__(self, start):
+        self.time = start
+
+    def now(self):
+        return datetime.fromtimestamp(self.time)
+
+    def monotonic(self):
+        return self.time
+
+    def set(self, timestamp):
+        self.time = max(self.time, timestamp)
+
+
+def parse_time(value):
+    """Epoch seconds from a number or ISO 8601 string"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(value).timestamp()
+
+
+def load_events(path):
+    """Events from a JSON-lines file ('-' for stdin), sorted by time"""
+    events = []
+    with (sys.stdin if path == '-' else open(path)) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            try:
+                event = json.loads(line)
+                event['time'] = parse_time(event['time'])
+            except (ValueError, KeyError) as e:
+                raise ValueError(f"{path}:{line_number}: bad event: {e}")
+            events.append(event)
+    events.sort(key=lambda event: event['time'])
+    return events
+
+
+def parse_overrides(pairs):
+    """NAME=value settings; values are Python literals, anything else a string"""
+    overrides = {}
+    for pair in pairs:
+        name, _, value = pair.partition('=')
+        if not name.isupper() or not _:
+            raise ValueError(f"Expected NAME=value, got {pair!r}")
+        try:
+            overrides[name] = ast.literal_eval(value)
+        except (ValueError, SyntaxError):
+            overrides[name] = value
+    return overrides
+
+
+class Replay:
+    """One replay run of ato_monitor over an event stream"""
+
+    def __init__(self, events, overrides=None, midnight_reset=True, full_stats=False):
+        self.events = events
+        self.overrides = dict(overrides or {})
+        self.midnight_reset = midnight_reset and not any(
+            event['type'] == 'mqtt' and event.get('topic') == 'aquarium/ato/reset' for event in events)
+        self.full_stats = full_stats
+        self.alerts = []
+        self.stats = []
+        self.activations = 0
+        self.clock = VirtualClock(events[0]['time'] if events else time.time())
+        self._data_dir = None
+        self._remote = None
+
+    # ------------------------------------------------------------------
+    # Setup
+    # ------------------------------------------------------------------
+
+    def _configure(self):
+        for name, value in self.overrides.items():
+            setattr(monitor, name, value)
+        if monitor.DAILY_USAGE_ROLLOVER:
+            self.midnight_reset = False     # the monitor resets its own counters
+        monitor.reservoir_level = monitor.RESERVOIR_CAPACITY
+
+        self._data_dir = tempfile.mkdtemp(prefix='ato-replay-')
+        for name in [k for k in vars(monitor) if k.endswith('_FILE') and getattr(monitor, k)]:
+            setattr(monitor, name, os.path.join(self._data_dir, os.path.basename(getattr(monitor, name))))
+        monitor.ACTIVATION_LOG_PREFIX = os.path.join(self._data_dir, 'ato_history')
+
+        monitor.setup_state()       # sized and tuned by the overrides above
+        monitor.open_storage()
+        monitor.setup_persistence(start=False)     # stores are marked dirty but never written
+        monitor.setup_alerts()      # thresholds as overridden above
+        monitor.wall_clock = self.clock.now
+        monitor.monotonic_clock = self.clock.monotonic
+        monitor.last_activation_time = self.clock.now()
+        monitor.daily_usage_date = self.clock.now().date()
+
+        broker = InMemoryBroker()
+        broker.record = False
+        initial_level = next((e['level'] for e in self.events if e['type'] == 'float'), 1)
+        monitor.setup_hardware(Backends(SimulatedGPIO(float_level=initial_level), None, broker.client()))
+        monitor.subscribe_commands()
+        self._remote = broker.client()     # plays the part of Home Assistant
+
+        monitor.float_edge_detection = True
+        monitor.fill.float_filter = monitor.FloatFilter(initial_level,
+                                                        start_hold=monitor.FLOAT_START_DEBOUNCE_MS / 1000.0,
+                                                        stop_hold=monitor.FLOAT_STOP_DEBOUNCE_MS / 1000.0)
+        monitor.temp_sensor_available = any(event['type'] == 'temp' for event in self.events)
+        monitor.schedule_jobs()
+        monitor.scheduler.cancel('temperature')     # samples come from the stream
+
+        record_alert, build_stats = monitor.record_alert, monitor.build_stats
+        append_activation = monitor.append_activation
+
+        def recording_alert(alert):
+            self.alerts.append({'time': self.clock.now().isoformat(), 'severity': alert['severity'],
+                                'message': alert['message']})
+            record_alert(alert)
+
+        def recording_stats(now):
+            stats = build_stats(now)
+            if self.full_stats:
+                self.stats.append({'time': now.isoformat(), **stats})
+            else:
+                self.stats.append({'time': now.isoformat(), **{k: stats.get(k) for k in STATS_FIELDS}})
+            return stats
+
+        def counting_activation(activation_time):
+            self.activations += 1
+            append_activation(activation_time)
+
+        monitor.record_alert = recording_alert
+        monitor.append_activation = counting_activation
+        monitor.build_stats = recording_stats
+
+    # ------------------------------------------------------------------
+    # Event loop
+    # ------------------------------------------------------------------
+
+    def _next_midnight(self):
+        tomorrow = self.clock.now().date() + timedelta(days=1)
+        return datetime.combine(tomorrow, datetime.min.time()).timestamp()
+
+    def _run_until(self, timestamp):
+        """Run every wake-up of the control loop up to `timestamp`"""
+        midnight = self._next_midnight() if self.midnight_reset else None
+        while True:
+            wake = monitor.next_wakeup()
+            if midnight is not None and midnight <= min(wake, timestamp):
+                self.clock.set(midnight)
+                self._remote.publish("aquarium/ato/reset", "1")
+                midnight = self._next_midnight()
+                continue
+            if wake > timestamp:
+                break
+            # A deadline still due after its step (float rounding at epoch scale) runs 1ms later
+            self.clock.set(wake if wake > self.clock.time else self.clock.time + 0.001)
+            monitor.control_step()
+        self.clock.set(timestamp)
+
+    def _apply(self, event):
+        kind = event['type']
+        if kind == 'float':
+            monitor.gpio.set_float(event['level'])
+        elif kind == 'temp':
+            temp = round(float(event['value']), 2)
+            monitor.current_temperature = temp
+            monitor.record_temperature(temp, self.clock.time)
+            monitor.publisher.publish("aquarium/ato/temperature", temp)
+        elif kind == 'refill':
+            liters = event.get('liters')
+            self._remote.publish("aquarium/ato/refill", '' if liters is None else str(liters))
+        elif kind == 'mqtt':
+            self._remote.publish(event['topic'], event.get('payload', ''))
+        else:
+            raise ValueError(f"Unknown event type: {kind!r}")
+        monitor.control_step()
+
+    def run(self, verbose=False):
+        """Replay every event; returns the report dict"""
+        started = time.perf_counter()
+        output = sys.stdout if verbose else open(os.devnull, 'w')
+        try:
+            with contextlib.redirect_stdout(output):
+                self._configure()
+                for event in self.events:
+                    self._run_until(event['time'])
+                    self._apply(event)
+                if self.events:
+                    # Let the last fill finish and the trailing jobs run
+                    self._run_until(self.events[-1]['time'] + monitor.STATS_PUBLISH_INTERVAL)
+                monitor.activation_log.close()
+                if monitor.sqlite_store is not None:
+                    monitor.sqlite_store.close()
+        finally:
+            if output is not sys.stdout:
+                output.close()
+            if self._data_dir:
+                shutil.rmtree(self._data_dir, ignore_errors=True)
+        elapsed = time.perf_counter() - started
+        return self.report(elapsed)
+
+    def report(self, elapsed):
+        simulated = (self.events[-1]['time'] - self.events[0]['time']) if self.events else 0.0
+        severities = {}
+        for alert in self.alerts:
+            severities[alert['severity']] = severities.get(alert['severity'], 0) + 1
+        return {
+            'meta': {
+                'events': len(self.events),
+                'start': datetime.fromtimestamp(self.events[0]['time']).isoformat() if self.events else None,
+                'end': datetime.fromtimestamp(self.events[-1]['time']).isoformat() if self.events else None,
+                'simulated_seconds': round(simulated, 1),
+                'wall_seconds': round(elapsed, 3),
+                'speedup': round(simulated / elapsed) if elapsed > 0 else None,
+                'overrides': self.overrides,
+                'midnight_reset': self.midnight_reset
+            },
+            'summary': {
+                'activations': self.activations,
+                'alerts': severities,
+                'monitoring_enabled': monitor.fill.monitoring_enabled,
+                'disabled_reason': monitor.fill.disabled_reason,
+                'reservoir_level': round(monitor.reservoir_level, 2),
+                'calibrated_lph': monitor.calibration_data['calibrated_lph']
+            },
+            'alerts': self.alerts,
+            'stats': self.stats
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Replay a recorded ATO event stream under a virtual clock')
+    parser.add_argument('events', help="JSON-lines event file ('-' for stdin)")
+    parser.add_argument('--config', help='settings file to replay with (default: config.py / config.example.py)')
+    parser.add_argument('--set', action='append', default=[], metavar='NAME=VALUE',
+                        help='override a setting, e.g. --set MAX_ACTIVATIONS_PER_HOUR=4')
+    parser.add_argument('--no-midnight-reset', action='store_true',
+                        help='do not emulate the Home Assistant midnight reset of the daily counter '
+                             '(only used with DAILY_USAGE_ROLLOVER=False)')
+    parser.add_argument('--full-stats', action='store_true', help='keep every stats field in the series')
+    parser.add_argument('--output', help='write the JSON report here (default: stdout)')
+    parser.add_argument('--verbose', action='store_true', help="show the monitor's console output")
+    args = parser.parse_args(argv)
+
+    overrides = {}
+    if args.config:
+        overrides.update({k: v for k, v in runpy.run_path(args.config).items() if k.isupper()})
+    overrides.update(parse_overrides(args.set))
+
+    replay = Replay(load_events(args.events), overrides,
+                    midnight_reset=not args.no_midnight_reset, full_stats=args.full_stats)
+    report = replay.run(verbose=args.verbose)
+
+    meta, summary = report['meta'], report['summary']
+    print(f"Replayed {meta['events']} events ({meta['simulated_seconds'] / 86400:.1f} days) "
+          f"in {meta['wall_seconds']:.2f}s ({meta['speedup']}x real time): "
+          f"{summary['activations']} activations, alerts {summary['alerts'] or 'none'}", file=sys.stderr)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+
+if __name__ == '__main__':
+    main()
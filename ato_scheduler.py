@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+ATO Aquarium Monitor - Periodic Job Scheduler
+License: MIT
+
+Timer heap on the monotonic clock used by the main loop to run periodic
+jobs (temperature sampling, alert checks, stats publishing, persistence)
+without drifting and without waking up when nothing is due.
+"""
+
+import heapq
+import itertools
+import time
+
+
+class Scheduler:
+    """Run named jobs at fixed intervals on a monotonic clock.
+
+    Deadlines advance by exactly one interval each run, so slow jobs do not
+    make the schedule drift. If the loop falls more than one interval behind
+    (e.g. after a long blocking call) the missed runs are skipped rather than
+    fired back to back.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self._heap = []                 # (deadline, seq, name)
+        self._jobs = {}                 # name -> (interval, func, seq)
+        self._seq = itertools.count()
+
+    def every(self, name, interval, func, delay=0.0):
+        """Run func every `interval` seconds, first after `delay` seconds"""
+        seq = next(self._seq)
+        self._jobs[name] = (interval, func, seq)
+        heapq.heappush(self._heap, (self.clock() + delay, seq, name))
+
+    def cancel(self, name):
+        """Stop a job (its heap entry is discarded lazily)"""
+        self._jobs.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self._jobs
+
+    def _discard_cancelled(self):
+        while self._heap:
+            _, seq, name = self._heap[0]
+            job = self._jobs.get(name)
+            if job is not None and job[2] == seq:
+                return
+            heapq.heappop(self._heap)
+
+    def next_deadline(self):
+        """Monotonic time of the next due job, or None when idle"""
+        self._discard_cancelled()
+        return self._heap[0][0] if self._heap else None
+
+    def run_due(self, now=None):
+        """Run every job whose deadline has passed; returns how many ran"""
+        if now is None:
+            now = self.clock()
+        ran = 0
+        while True:
+            self._discard_cancelled()
+            if not self._heap or self._heap[0][0] > now:
+                return ran
+            deadline, seq, name = heapq.heappop(self._heap)
+            interval, func, _ = self._jobs[name]
+
+            next_deadline = deadline + interval
+            if next_deadline <= now:
+                # Fell behind - skip the missed runs but stay on the original phase
+                next_deadline += ((now - next_deadline) // interval + 1) * interval
+            heapq.heappush(self._heap, (next_deadline, seq, name))
+
+            try:
+                func()
+            except Exception as e:
+                print(f"⚠️  Error in scheduled job '{name}': {e}")
+            ran += 1
@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+ATO Aquarium Monitor - Temperature Sensor Sampling
+License: MIT
+
+DS18B20 conversions block for ~750ms, so sensors are read on a background
+thread and the control loop only ever looks at the latest cached reading.
+With several sensors on the bus, one conversion is triggered for all of
+them at once (or, on older kernels, the sensors are read in parallel), so
+N sensors take about one conversion time instead of N x 750ms.
+"""
+
+import glob
+import os
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+W1_DEVICES = '/sys/bus/w1/devices'
+
+# Latest reading from a sensor. Snapshots are immutable and replaced as a
+# whole, so readers never need a lock.
+TempReading = namedtuple('TempReading', [
+    'raw',          # last good uncalibrated reading (°C) or None
+    'calibrated',   # raw + calibration offset at the time of the read
+    'timestamp',    # epoch seconds of the last good reading
+    'monotonic',    # monotonic time of the last good reading
+    'crc_ok',       # CRC status of the most recent read attempt
+    'seq',          # increments on every good reading
+    'errors'        # failed read attempts since start
+])
+
+EMPTY_READING = TempReading(None, None, None, None, False, 0, 0)
+
+
+def parse_w1_slave(lines):
+    """Parse w1_slave contents; returns (temp_c or None, crc_ok)"""
+    if not lines or len(lines) < 2:
+        return None, False
+    if lines[0].strip()[-3:] != 'YES':
+        return None, False
+    equals_pos = lines[1].find('t=')
+    if equals_pos == -1:
+        return None, False
+    return round(float(lines[1][equals_pos + 2:]) / 1000.0, 2), True
+
+
+# ============================================================================
+# SENSOR DISCOVERY
+# ============================================================================
+
+
+def discover_sensors(base=W1_DEVICES):
+    """Paths of every DS18B20 (28-*) device on the bus, sorted by ID"""
+    return sorted(glob.glob(os.path.join(base, '28-*')))
+
+
+def map_sensors(found, configured, auto_detect=True):
+    """Map configured names to device paths.
+
+    ``configured`` maps names to sensor IDs in config order. Names whose ID
+    is present on the bus get that device; with ``auto_detect`` the names
+    left over take the remaining devices in ID order.
+    """
+    by_id = {os.path.basename(path): path for path in found}
+    mapping = {}
+    for name, sensor_id in configured.items():
+        if sensor_id in by_id:
+            mapping[name] = by_id.pop(sensor_id)
+    if auto_detect:
+        spare = sorted(by_id.values())
+        for name in configured:
+            if name not in mapping and spare:
+                mapping[name] = spare.pop(0)
+    return mapping
+
+
+def w1_slave_reader(device_path):
+    """Function returning the w1_slave lines for a device, or None on error"""
+    def read_lines():
+        try:
+            with open(os.path.join(device_path, 'w1_slave'), 'r') as f:
+                return f.readlines()
+        except Exception:
+            return None
+    return read_lines
+
+
+def bulk_trigger_for(base=W1_DEVICES):
+    """Function starting a conversion on every sensor at once, or None if unsupported"""
+    paths = glob.glob(os.path.join(base, 'w1_bus_master*', 'therm_bulk_read'))
+    if not paths:
+        return None
+
+    def trigger():
+        for path in paths:
+            with open(path, 'w') as f:
+                f.write('trigger\n')
+    return trigger
+
+
+# ============================================================================
+# BACKGROUND SAMPLER
+# ============================================================================
+
+
+class TempSampler(threading.Thread):
+    """Background thread that reads one or more sensors every `interval` seconds.
+
+    ``readers`` maps sensor names to functions returning w1_slave lines (or
+    None on failure); ``offsets`` maps names to functions returning the
+    current calibration offset. ``snapshots`` is replaced as a whole dict
+    after each pass. ``bulk_trigger``, when given, starts one conversion on
+    every sensor before the reads; otherwise multiple sensors are read in
+    parallel.
+    """
+
+    def __init__(self, readers, interval=30, offsets=None, primary=None,
+                 bulk_trigger=None, name='temp-sampler'):
+        super().__init__(name=name, daemon=True)
+        self.readers = dict(readers)
+        self.interval = interval
+        self.offsets = dict(offsets or {})
+        self.primary = primary if primary is not None else next(iter(self.readers), None)
+        self.bulk_trigger = bulk_trigger
+        self.snapshots = {sensor: EMPTY_READING for sensor in self.readers}
+        self._stopped = threading.Event()
+        self._pool = None
+
+    @property
+    def snapshot(self):
+        """Snapshot of the primary sensor"""
+        return self.snapshots.get(self.primary, EMPTY_READING)
+
+    def _read(self, sensor, previous):
+        try:
+            raw, crc_ok = parse_w1_slave(self.readers[sensor]())
+        except Exception:
+            raw, crc_ok = None, False
+        if raw is None:
+            return previous._replace(crc_ok=crc_ok, errors=previous.errors + 1)
+        offset = self.offsets.get(sensor)
+        return TempReading(
+            raw=raw,
+            calibrated=round(raw + (offset() if offset else 0.0), 2),
+            timestamp=datetime.now().timestamp(),
+            monotonic=time.monotonic(),
+            crc_ok=True,
+            seq=previous.seq + 1,
+            errors=previous.errors
+        )
+
+    def sample_once(self):
+        """Read every sensor once and publish a new snapshot dict"""
+        previous = self.snapshots
+        sensors = list(self.readers)
+        if self.bulk_trigger is not None:
+            try:
+                self.bulk_trigger()
+            except Exception as e:
+                print(f"⚠️  Bulk temperature conversion failed, reading sensors individually: {e}")
+                self.bulk_trigger = None
+        if self.bulk_trigger is None and len(sensors) > 1:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=len(sensors), thread_name_prefix='w1')
+            results = self._pool.map(lambda sensor: self._read(sensor, previous[sensor]), sensors)
+        else:
+            results = [self._read(sensor, previous[sensor]) for sensor in sensors]
+        self.snapshots = dict(zip(sensors, results))
+        return self.snapshots
+
+    def run(self):
+        while not self._stopped.is_set():
+            started = time.monotonic()
+            self.sample_once()
+            self._stopped.wait(max(0.0, self.interval - (time.monotonic() - started)))
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+
+    def stop(self):
+        """Ask the thread to exit after the current pass"""
+        self._stopped.set()
+
+    def age(self, sensor=None):
+        """Seconds since a sensor's last good reading (primary by default), or None"""
+        snapshot = self.snapshots.get(self.primary if sensor is None else sensor, EMPTY_READING)
+        if snapshot.monotonic is None:
+            return None
+        return time.monotonic() - snapshot.monotonic
@@ -0,0 +1,421 @@
+#!/usr/bin/env python3
+"""
+ATO Aquarium Monitor - SQLite Storage Backend
+License: MIT
+
+Optional single-file database (STORAGE_BACKEND = "sqlite") holding every
+activation, temperature reading, alert, pump cycle and refill, indexed by
+timestamp. The monitor only keeps its bounded working sets in RAM (30 days
+of activations, the temperature ring, the last few hundred alerts); older
+data stays on disk and is reached with indexed range queries, so memory
+does not grow with years of history.
+
+Writes are queued in memory and inserted in batches by ``flush()``, which
+the persistence thread calls. The database runs in WAL mode so readers
+never block the writer.
+"""
+
+import json
+import os
+import pickle
+import sqlite3
+import threading
+from datetime import date, datetime
+
+from ato_analytics import SeasonalRollup
+from ato_pump import PumpCycles
+from ato_storage import TempRingBuffer
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS activations (
+    ts REAL PRIMARY KEY,
+    liters REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS temperatures (
+    sensor TEXT NOT NULL,
+    ts REAL NOT NULL,
+    temp REAL NOT NULL,
+    PRIMARY KEY (sensor, ts)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS alerts (
+    ts REAL NOT NULL,
+    severity TEXT NOT NULL,
+    message TEXT NOT NULL,
+    season TEXT,
+    reservoir_level REAL,
+    activations_today INTEGER
+);
+CREATE INDEX IF NOT EXISTS alerts_ts ON alerts (ts);
+
+CREATE TABLE IF NOT EXISTS pump_cycles (
+    ts REAL NOT NULL,
+    runtime_seconds REAL,
+    volume_liters REAL,
+    flow_rate_lph REAL,
+    season TEXT,
+    reservoir_level_before REAL,
+    reservoir_level_after REAL
+);
+CREATE INDEX IF NOT EXISTS pump_cycles_ts ON pump_cycles (ts);
+
+CREATE TABLE IF NOT EXISTS refills (
+    ts REAL NOT NULL,
+    activations INTEGER,
+    liters REAL,
+    lph_calculated REAL
+);
+CREATE INDEX IF NOT EXISTS refills_ts ON refills (ts);
+
+CREATE TABLE IF NOT EXISTS observed_days (
+    day TEXT PRIMARY KEY
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS month_totals (
+    month TEXT PRIMARY KEY,
+    activations INTEGER NOT NULL,
+    liters REAL NOT NULL
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS settings (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+) WITHOUT ROWID;
+"""
+
+ALERT_FIELDS = ('severity', 'message', 'season', 'reservoir_level', 'activations_today')
+PUMP_CYCLE_FIELDS = ('runtime_seconds', 'volume_liters', 'flow_rate_lph', 'season',
+                     'reservoir_level_before', 'reservoir_level_after')
+REFILL_FIELDS = ('activations', 'liters', 'lph_calculated')
+
+INSERTS = {
+    'activations': "INSERT OR REPLACE INTO activations (ts, liters) VALUES (?, ?)",
+    'temperatures': "INSERT OR REPLACE INTO temperatures (sensor, ts, temp) VALUES (?, ?, ?)",
+    'alerts': "INSERT INTO alerts (ts, severity, message, season, reservoir_level, activations_today) "
+              "VALUES (?, ?, ?, ?, ?, ?)",
+    'pump_cycles': "INSERT INTO pump_cycles (ts, runtime_seconds, volume_liters, flow_rate_lph, season, "
+                   "reservoir_level_before, reservoir_level_after) VALUES (?, ?, ?, ?, ?, ?, ?)",
+    'refills': "INSERT INTO refills (ts, activations, liters, lph_calculated) VALUES (?, ?, ?, ?)",
+    'observed_days': "INSERT OR IGNORE INTO observed_days (day) VALUES (?)",
+    'month_totals': "INSERT OR REPLACE INTO month_totals (month, activations, liters) VALUES (?, ?, ?)",
+}
+
+
+def _timestamp(value):
+    """Epoch seconds from an ISO string, datetime or number"""
+    if isinstance(value, str):
+        return datetime.fromisoformat(value).timestamp()
+    if isinstance(value, datetime):
+        return value.timestamp()
+    return float(value)
+
+
+def _record_row(record, fields, time_key):
+    return (_timestamp(record[time_key]),) + tuple(record.get(field) for field in fields)
+
+
+def _row_record(row, fields, time_key):
+    record = {time_key: datetime.fromtimestamp(row[0]).isoformat()}
+    record.update(zip(fields, row[1:]))
+    return record
+
+
+class SQLiteStore:
+    """Timestamp-indexed tables with batched inserts.
+
+    ``add_*`` methods only queue rows (no I/O) and are safe to call from any
+    thread; ``flush()`` inserts everything queued in one transaction.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._db_lock = threading.Lock()
+        self._queue_lock = threading.Lock()
+        self._queued = {table: [] for table in INSERTS}
+        with self._db_lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # WAL + NORMAL never corrupts on power loss; at worst the last commit is lost
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(SCHEMA)
+            self._conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
+
+    def close(self):
+        with self._db_lock:
+            self._conn.close()
+
+    def _query(self, sql, params=()):
+        with self._db_lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    # ------------------------------------------------------------------
+    # Batched writes
+    # ------------------------------------------------------------------
+
+    def _queue(self, table, row):
+        with self._queue_lock:
+            self._queued[table].append(row)
+
+    def add_activation(self, timestamp, liters):
+        """Queue an activation; a second row for the same timestamp replaces the first"""
+        self._queue('activations', (float(timestamp), liters))
+
+    def add_temperature(self, sensor, timestamp, temp):
+        self._queue('temperatures', (sensor, float(timestamp), temp))
+
+    def add_alert(self, record):
+        """Queue an alert record as kept in alerts_history"""
+        self._queue('alerts', _record_row(record, ALERT_FIELDS, 'timestamp'))
+
+    def add_pump_cycle(self, record):
+        """Queue a pump performance record"""
+        self._queue('pump_cycles', _record_row(record, PUMP_CYCLE_FIELDS, 'timestamp'))
+
+    def add_refill(self, record):
+        """Queue a refill record from calibration_data['refill_history']"""
+        self._queue('refills', _record_row(record, REFILL_FIELDS, 'date'))
+
+    def observe_days(self, days):
+        """Queue dates (date objects) the monitor was running on"""
+        with self._queue_lock:
+            self._queued['observed_days'].extend((day.isoformat(),) for day in days)
+
+    def add_month_totals(self, year, month, activations, liters):
+        """Queue activation totals of a month that have no activation rows (imported seasonal stats)"""
+        self._queue('month_totals', (f"{year:04d}-{month:02d}", activations, liters))
+
+    def pending(self):
+        """Rows queued but not yet inserted, per table"""
+        with self._queue_lock:
+            return {table: len(rows) for table, rows in self._queued.items()}
+
+    def flush(self):
+        """Insert every queued row in a single transaction"""
+        with self._queue_lock:
+            queued = {table: rows for table, rows in self._queued.items() if rows}
+            self._queued = {table: [] for table in INSERTS}
+        if not queued:
+            return
+        try:
+            with self._db_lock, self._conn:
+                for table, rows in queued.items():
+                    self._conn.executemany(INSERTS[table], rows)
+        except Exception:
+            # Transaction rolled back - put the rows back for the next attempt
+            with self._queue_lock:
+                for table, rows in queued.items():
+                    self._queued[table][:0] = rows
+            raise
+
+    def set_value(self, key, value):
+        """Store a small JSON-serialisable setting (calibration data, offsets)"""
+        payload = json.dumps(value)
+        with self._db_lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO settings (key, value) VALUES (?, ?)", (key, payload))
+
+    def get_value(self, key, default=None):
+        rows = self._query("SELECT value FROM settings WHERE key = ?", (key,))
+        return json.loads(rows[0][0]) if rows else default
+
+    # ------------------------------------------------------------------
+    # Range queries
+    # ------------------------------------------------------------------
+
+    def activation_times(self, since=None, until=None):
+        """Activation timestamps in [since, until), oldest first"""
+        return [ts for (ts,) in self._query(
+            "SELECT ts FROM activations WHERE ts >= ? AND ts < ? ORDER BY ts",
+            (since if since is not None else float('-inf'), until if until is not None else float('inf')))]
+
+    def activation_volumes(self, since=None):
+        """(timestamp, liters) of every activation from `since` on, oldest first"""
+        return self._query("SELECT ts, liters FROM activations WHERE ts >= ? ORDER BY ts",
+                           (since if since is not None else float('-inf'),))
+
+    def latest_temperatures(self, sensor, limit):
+        """The newest `limit` (timestamp, temperature) readings, oldest first"""
+        rows = self._query("SELECT ts, temp FROM temperatures WHERE sensor = ? ORDER BY ts DESC LIMIT ?",
+                           (sensor, limit))
+        rows.reverse()
+        return rows
+
+    def iter_temperatures(self, sensor, since, until=None, batch=5000):
+        """Yield (timestamp, temperature) in time order, fetched in batches so memory stays flat"""
+        until = until if until is not None else float('inf')
+        after = None
+        while True:
+            if after is None:
+                rows = self._query("SELECT ts, temp FROM temperatures WHERE sensor = ? AND ts >= ? AND ts < ? "
+                                   "ORDER BY ts LIMIT ?", (sensor, since, until, batch))
+            else:
+                rows = self._query("SELECT ts, temp FROM temperatures WHERE sensor = ? AND ts > ? AND ts < ? "
+                                   "ORDER BY ts LIMIT ?", (sensor, after, until, batch))
+            yield from rows
+            if len(rows) < batch:
+                return
+            after = rows[-1][0]
+
+    def seasonal_months(self, since, until=None):
+        """Per-month {'activations', 'liters', 'days' bitmask} from `since`, as SeasonalRollup.months.
+
+        One aggregate query groups the activations by local day over the
+        timestamp primary key; imported month totals are added on top. Months
+        are counted whole, from the start of the month `since` falls in to the
+        end of the month `until` falls in.
+        """
+        until = until if until is not None else datetime.now().timestamp()
+        first_day = datetime.fromtimestamp(since).date()
+        last_day = datetime.fromtimestamp(until).date()
+        month_start = datetime(first_day.year, first_day.month, 1).timestamp()
+        month_end = datetime(last_day.year + last_day.month // 12, last_day.month % 12 + 1, 1).timestamp()
+        months = {}
+
+        def add(year, month, activations, liters):
+            record = months.setdefault((year, month), {'activations': 0, 'liters': 0.0, 'days': 0})
+            record['activations'] += activations
+            record['liters'] += liters
+            return record
+
+        def mark(day, activations=0, liters=0.0):
+            record = add(day.year, day.month, activations, liters)
+            if first_day <= day <= last_day:
+                record['days'] |= 1 << day.day
+
+        for day, activations, liters in self._query(
+                "SELECT date(ts, 'unixepoch', 'localtime') AS day, COUNT(*), SUM(liters) FROM activations "
+                "WHERE ts >= ? AND ts < ? GROUP BY day", (month_start, month_end)):
+            mark(date.fromisoformat(day), activations, liters or 0.0)
+        for month, activations, liters in self._query(
+                "SELECT month, activations, liters FROM month_totals WHERE month >= ? AND month <= ?",
+                (first_day.strftime('%Y-%m'), last_day.strftime('%Y-%m'))):
+            add(int(month[:4]), int(month[5:]), activations, liters)
+        for (day,) in self._query("SELECT day FROM observed_days WHERE day >= ? AND day <= ?",
+                                  (first_day.isoformat(), last_day.isoformat())):
+            mark(date.fromisoformat(day))
+        return months
+
+    def recent_alerts(self, limit):
+        """The newest `limit` alerts as alerts_history records, oldest first"""
+        rows = self._query(f"SELECT ts, {', '.join(ALERT_FIELDS)} FROM alerts ORDER BY ts DESC LIMIT ?", (limit,))
+        return [_row_record(row, ALERT_FIELDS, 'timestamp') for row in reversed(rows)]
+
+    def _records_between(self, table, fields, key, since, until, limit):
+        rows = self._query(f"SELECT ts, {', '.join(fields)} FROM {table} WHERE ts >= ? AND ts < ? ORDER BY ts LIMIT ?",
+                           (since, until if until is not None else float('inf'), -1 if limit is None else limit))
+        return [_row_record(row, fields, key) for row in rows]
+
+    def alerts_between(self, since, until=None, limit=None):
+        return self._records_between('alerts', ALERT_FIELDS, 'timestamp', since, until, limit)
+
+    def pump_cycles_between(self, since, until=None, limit=None):
+        return self._records_between('pump_cycles', PUMP_CYCLE_FIELDS, 'timestamp', since, until, limit)
+
+    def refills_between(self, since, until=None, limit=None):
+        return self._records_between('refills', REFILL_FIELDS, 'date', since, until, limit)
+
+    def recent_pump_cycles(self, limit):
+        """The newest `limit` pump cycles as pump performance records, oldest first"""
+        rows = self._query(f"SELECT ts, {', '.join(PUMP_CYCLE_FIELDS)} FROM pump_cycles ORDER BY ts DESC LIMIT ?",
+                           (limit,))
+        return [_row_record(row, PUMP_CYCLE_FIELDS, 'timestamp') for row in reversed(rows)]
+
+    def pump_cycle_columns(self, since=0):
+        """(timestamp, runtime, volume) of every pump cycle from `since` on with a flow rate, oldest first"""
+        return self._query("SELECT ts, runtime_seconds, volume_liters FROM pump_cycles "
+                           "WHERE ts >= ? AND flow_rate_lph IS NOT NULL ORDER BY ts", (since,))
+
+    def row_counts(self):
+        """Rows per table"""
+        return {table: self._query(f"SELECT COUNT(*) FROM {table}")[0][0] for table in INSERTS}
+
+    def is_empty(self):
+        return not any(self.row_counts().values()) and self.get_value('calibration') is None
+
+
+# ============================================================================
+# MIGRATION FROM THE FILE BACKEND
+# ============================================================================
+
+
+def _load_pickle(path, default):
+    if not path or not os.path.exists(path):
+        return default
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+
+def migrate_from_files(store, activation_log, liters_per_activation, history_file=None,
+                       calibration_file=None, seasonal_file=None, alerts_file=None, pump_file=None,
+                       temp_rings=None, temp_history_file=None, temp_calibration_file=None, rollup_file=None,
+                       pump_cycles_file=None):
+    """Copy the file backend's data into `store`; returns rows imported per table.
+
+    Reads the activation log (or a 1.0 pickled activation list), the pickle
+    files and the temperature ring files (``temp_rings`` maps sensor name to
+    ring path). The files are left in place so the file backend can still be
+    switched back to.
+    """
+    if activation_log.exists():
+        timestamps = activation_log.load()
+    else:
+        timestamps = [a.timestamp() for a in _load_pickle(history_file, [])]
+    for timestamp in timestamps:
+        store.add_activation(timestamp, liters_per_activation)
+
+    for sensor, path in (temp_rings or {}).items():
+        if os.path.exists(path):
+            for timestamp, temp in TempRingBuffer.from_file(path):
+                store.add_temperature(sensor, timestamp, temp)
+    if 'ato' not in (temp_rings or {}) or not os.path.exists(temp_rings['ato']):
+        for record in _load_pickle(temp_history_file, []):
+            store.add_temperature('ato', _timestamp(record['timestamp']), record['temperature'])
+
+    for record in _load_pickle(alerts_file, []):
+        store.add_alert(record)
+    # The cycle columns reach back further than the last 1000 pump records: add the older cycles bare
+    pump_records = _load_pickle(pump_file, [])
+    first = _timestamp(pump_records[0]['timestamp']) if pump_records else float('inf')
+    cycles = PumpCycles()
+    cycles.from_dict(_load_pickle(pump_cycles_file, {}))
+    for timestamp, runtime, volume in zip(cycles.timestamps, cycles.runtimes, cycles.volumes):
+        if timestamp < first:
+            store.add_pump_cycle({'timestamp': timestamp, 'runtime_seconds': runtime, 'volume_liters': volume,
+                                  'flow_rate_lph': round(volume / runtime * 3600, 1) if runtime > 0 else None})
+    for record in pump_records:
+        store.add_pump_cycle(record)
+
+    calibration = _load_pickle(calibration_file, None)
+    if calibration is not None:
+        for record in calibration.get('refill_history', []):
+            store.add_refill(record)
+
+    seasonal = SeasonalRollup()
+    seasonal.from_dict(_load_pickle(seasonal_file, {}))
+    store.observe_days(seasonal.observed_days())
+
+    imported = store.pending()
+    store.flush()
+    # The pickled month totals reach back further than the activation log: keep what its rows miss
+    if seasonal.months:
+        rows = store.seasonal_months(datetime(*min(seasonal.months), 1).timestamp(),
+                                     datetime(*max(seasonal.months), 1).timestamp())
+        for (year, month), record in seasonal.months.items():
+            covered = rows.get((year, month), {'activations': 0, 'liters': 0.0})
+            if record['activations'] > covered['activations']:
+                store.add_month_totals(year, month, record['activations'] - covered['activations'],
+                                       max(0.0, record['liters'] - covered['liters']))
+        imported['month_totals'] = store.pending()['month_totals']
+        store.flush()
+    if calibration is not None:
+        store.set_value('calibration', calibration)
+    temp_calibration = _load_pickle(temp_calibration_file, None)
+    if temp_calibration is not None:
+        store.set_value('temp_calibration', temp_calibration)
+    rollups = _load_pickle(rollup_file, None)
+    if rollups is not None:
+        store.set_value('rollups', rollups)
+    store.set_value('migrated_from_files', datetime.now().isoformat())
+    return imported
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+"""
+ATO Aquarium Monitor - Storage Helpers
+License: MIT
+
+Compact on-disk formats used by ato_monitor.py:
+- Append-only activation log (fixed-width binary records)
+- Fixed-size temperature ring buffer with incremental persistence
+- Atomic file replacement and a write-behind persistence manager
+"""
+
+import glob
+import os
+import pickle
+import struct
+import threading
+import time
+from array import array
+
+# ============================================================================
+# ATOMIC WRITES
+# ============================================================================
+
+# Bytes written by the helpers in this module, for the metrics endpoint
+bytes_written = 0
+_bytes_lock = threading.Lock()
+
+
+def _count_written(size):
+    global bytes_written
+    with _bytes_lock:
+        bytes_written += size
+
+
+def atomic_write(path, data):
+    """Replace path with data: write a temp file, fsync, rename over the original.
+
+    A power cut leaves either the old file or the new one, never a torn mix.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    _fsync_directory(os.path.dirname(path))
+    _count_written(len(data))
+
+
+def atomic_pickle(path, obj):
+    """Pickle obj to path atomically"""
+    atomic_write(path, pickle.dumps(obj))
+
+
+def _fsync_directory(directory):
+    """Make a rename durable (best effort; not every platform allows it)"""
+    try:
+        fd = os.open(directory or '.', os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+# ============================================================================
+# ACTIVATION LOG
+# ============================================================================
+
+# One record per activation: epoch seconds as a little-endian double
+ACTIVATION_RECORD = struct.Struct('<d')
+SEGMENT_SUFFIX = '.alog'
+
+
+class ActivationLog:
+    """Append-only activation log split into time-based segments.
+
+    Each activation costs one 8-byte append to the newest segment. Segments
+    cover ``segment_seconds`` of wall-clock time each, so expiring old data
+    is a matter of deleting whole files instead of rewriting anything.
+    ``append()`` only queues the record in memory; ``flush()`` writes and
+    fsyncs everything queued, so callers decide when the disk is touched.
+    """
+
+    def __init__(self, prefix, segment_seconds=7 * 86400, retention_seconds=30 * 86400):
+        self.prefix = prefix
+        self.segment_seconds = int(segment_seconds)
+        self.retention_seconds = retention_seconds
+        self._segment_start = None
+        self._handle = None
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def _segment_path(self, segment_start):
+        return f"{self.prefix}.{segment_start}{SEGMENT_SUFFIX}"
+
+    def _segment_for(self, timestamp):
+        return int(timestamp // self.segment_seconds) * self.segment_seconds
+
+    def segments(self):
+        """Return (segment_start, path) pairs, oldest first"""
+        found = []
+        for path in glob.glob(f"{glob.escape(self.prefix)}.*{SEGMENT_SUFFIX}"):
+            start = path[len(self.prefix) + 1:-len(SEGMENT_SUFFIX)]
+            if start.isdigit():
+                found.append((int(start), path))
+        found.sort()
+        return found
+
+    def exists(self):
+        """True if at least one segment is on disk"""
+        return bool(self.segments())
+
+    def load(self, since=None):
+        """Read all retained timestamps in order with one sequential pass per segment"""
+        timestamps = []
+        size = ACTIVATION_RECORD.size
+        for segment_start, path in self.segments():
+            if since is not None and segment_start + self.segment_seconds <= since:
+                continue
+            with open(path, 'rb') as f:
+                data = f.read()
+            usable = len(data) - (len(data) % size)
+            if usable != len(data):
+                # Torn write from a power cut - drop the partial record
+                print(f"⚠️  Truncating partial record in {path}")
+                with open(path, 'r+b') as f:
+                    f.truncate(usable)
+            for (timestamp,) in ACTIVATION_RECORD.iter_unpack(data[:usable]):
+                if since is None or timestamp >= since:
+                    timestamps.append(timestamp)
+        return timestamps
+
+    def append(self, timestamp):
+        """Queue one activation for the next flush() (no file I/O)"""
+        with self._lock:
+            self._pending.append(timestamp)
+
+    def pending(self):
+        """Number of activations queued but not yet written"""
+        return len(self._pending)
+
+    def flush(self):
+        """Write and fsync queued activations, rotating segments as needed"""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        written = 0
+        try:
+            for timestamp in pending:
+                segment_start = self._segment_for(timestamp)
+                if segment_start != self._segment_start or self._handle is None:
+                    self._rotate(segment_start)
+                self._handle.write(ACTIVATION_RECORD.pack(timestamp))
+                written += 1
+            if pending:
+                self._handle.flush()
+                os.fsync(self._handle.fileno())
+                _count_written(written * ACTIVATION_RECORD.size)
+        except Exception:
+            # Keep unwritten records for the next attempt; a torn one is dropped on load
+            with self._lock:
+                self._pending[:0] = pending[written:]
+            self.close()
+            raise
+
+    def _rotate(self, segment_start):
+        """Switch to the segment starting at segment_start and drop expired ones"""
+        self.close()
+        self._segment_start = segment_start
+        self._handle = open(self._segment_path(segment_start), 'ab')
+        self.compact(segment_start)
+
+    def compact(self, now):
+        """Delete segments that lie entirely outside the retention window"""
+        cutoff = now - self.retention_seconds
+        for segment_start, path in self.segments():
+            if segment_start == self._segment_start:
+                continue
+            if segment_start + self.segment_seconds <= cutoff:
+                try:
+                    os.remove(path)
+                except OSError as e:
+                    print(f"⚠️  Error removing old activation segment {path}: {e}")
+
+    def rewrite(self, timestamps):
+        """Replace the whole log with the given timestamps (used for migration)"""
+        self.close()
+        for _, path in self.segments():
+            os.remove(path)
+        by_segment = {}
+        for timestamp in sorted(timestamps):
+            by_segment.setdefault(self._segment_for(timestamp), []).append(timestamp)
+        for segment_start, values in by_segment.items():
+            atomic_write(self._segment_path(segment_start),
+                         b''.join(ACTIVATION_RECORD.pack(v) for v in values))
+
+    def close(self):
+        """Close the open segment handle (queued activations stay queued)"""
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+            self._segment_start = None
+
+
+# ============================================================================
+# TEMPERATURE RING BUFFER
+# ============================================================================
+
+# File layout: header, then `capacity` slots of (epoch seconds, temperature)
+RING_MAGIC = b'ATR1'
+RING_HEADER = struct.Struct('<4sIII')  # magic, capacity, head, count
+RING_SLOT = struct.Struct('<dd')
+
+
+class TempRingBuffer:
+    """Circular buffer of temperature readings stored as parallel arrays.
+
+    Readings are kept oldest-first in logical order; index -1 is the newest.
+    ``save()`` only writes the slots appended since the previous save plus
+    the small header, so persisting a reading costs a few dozen bytes.
+    """
+
+    def __init__(self, capacity=10000):
+        self.capacity = int(capacity)
+        self._timestamps = array('d', bytes(8 * self.capacity))
+        self._temps = array('d', bytes(8 * self.capacity))
+        self._head = 0      # slot the next reading is written to
+        self._count = 0
+        self._unsaved = 0
+        self._full_write = True
+        self._lock = threading.Lock()   # save() may run on the persistence thread
+
+    def __len__(self):
+        return self._count
+
+    def _slot(self, index):
+        if index < 0:
+            index += self._count
+        if not 0 <= index < self._count:
+            raise IndexError("temperature history index out of range")
+        return (self._head - self._count + index) % self.capacity
+
+    def __getitem__(self, index):
+        slot = self._slot(index)
+        return self._timestamps[slot], self._temps[slot]
+
+    def __iter__(self):
+        for index in range(self._count):
+            slot = (self._head - self._count + index) % self.capacity
+            yield self._timestamps[slot], self._temps[slot]
+
+    def append(self, timestamp, temperature):
+        """Add a reading, overwriting the oldest one when full"""
+        with self._lock:
+            self._timestamps[self._head] = timestamp
+            self._temps[self._head] = temperature
+            self._head = (self._head + 1) % self.capacity
+            if self._count < self.capacity:
+                self._count += 1
+            self._unsaved = min(self.capacity, self._unsaved + 1)
+
+    def clear(self):
+        """Drop every reading"""
+        with self._lock:
+            self._head = 0
+            self._count = 0
+            self._unsaved = 0
+            self._full_write = True
+
+    def index_since(self, timestamp):
+        """Logical index of the first reading at or after timestamp"""
+        lo, hi = 0, self._count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._timestamps[self._slot(mid)] < timestamp:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def since(self, timestamp):
+        """Yield (timestamp, temperature) for readings at or after timestamp"""
+        for index in range(self.index_since(timestamp), self._count):
+            slot = (self._head - self._count + index) % self.capacity
+            yield self._timestamps[slot], self._temps[slot]
+
+    def values_since(self, timestamp):
+        """List of temperatures recorded at or after timestamp"""
+        return [temp for _, temp in self.since(timestamp)]
+
+    @classmethod
+    def from_file(cls, path):
+        """A buffer sized to, and filled from, an existing ring file"""
+        with open(path, 'rb') as f:
+            magic, capacity, _, _ = RING_HEADER.unpack(f.read(RING_HEADER.size))
+        if magic != RING_MAGIC:
+            raise ValueError(f"{path} is not a temperature ring file")
+        ring = cls(capacity)
+        ring.load(path)
+        return ring
+
+    def load(self, path):
+        """Load readings from a ring file written by save()"""
+        with open(path, 'rb') as f:
+            magic, capacity, head, count = RING_HEADER.unpack(f.read(RING_HEADER.size))
+            if magic != RING_MAGIC:
+                raise ValueError(f"{path} is not a temperature ring file")
+            slots = f.read(capacity * RING_SLOT.size)
+        if len(slots) < capacity * RING_SLOT.size:
+            raise ValueError(f"{path} is truncated")
+        self.clear()
+        if capacity == self.capacity:
+            # Same layout as on disk - restore slots in place so later saves stay incremental
+            for slot in range(capacity):
+                self._timestamps[slot], self._temps[slot] = RING_SLOT.unpack_from(slots, slot * RING_SLOT.size)
+            self._head = head % capacity
+            self._count = count
+            self._full_write = False
+        else:
+            for index in range(count):
+                slot = (head - count + index) % capacity
+                self.append(*RING_SLOT.unpack_from(slots, slot * RING_SLOT.size))
+
+    def save(self, path):
+        """Write readings appended since the last save (full write on first use).
+
+        The full write is atomic. Incremental writes fsync the new slots
+        before the header that makes them visible, so a power cut mid-save
+        leaves the previous readings intact.
+        """
+        with self._lock:
+            if self._full_write or not os.path.exists(path):
+                header = RING_HEADER.pack(RING_MAGIC, self.capacity, self._head, self._count)
+                data = b''.join(RING_SLOT.pack(t, v) for t, v in zip(self._timestamps, self._temps))
+                runs = None
+            elif not self._unsaved:
+                return
+            else:
+                header = RING_HEADER.pack(RING_MAGIC, self.capacity, self._head, self._count)
+                runs = []
+                first = (self._head - self._unsaved) % self.capacity
+                remaining = self._unsaved
+                # New slots may wrap past the end of the file - write in up to two runs
+                while remaining:
+                    run = min(remaining, self.capacity - first)
+                    runs.append((first, b''.join(RING_SLOT.pack(self._timestamps[slot], self._temps[slot])
+                                                 for slot in range(first, first + run))))
+                    remaining -= run
+                    first = (first + run) % self.capacity
+            self._unsaved = 0
+            self._full_write = False
+
+        try:
+            if runs is None:
+                atomic_write(path, header + data)
+                return
+            with open(path, 'r+b') as f:
+                for first, chunk in runs:
+                    f.seek(RING_HEADER.size + first * RING_SLOT.size)
+                    f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+                f.seek(0)
+                f.write(header)
+                f.flush()
+                os.fsync(f.fileno())
+            _count_written(len(header) + sum(len(chunk) for _, chunk in runs))
+        except Exception:
+            with self._lock:
+                self._full_write = True     # file state unknown - rewrite it next time
+            raise
+
+
+# ============================================================================
+# WRITE-BEHIND PERSISTENCE
+# ============================================================================
+
+
+class PersistenceManager(threading.Thread):
+    """Background thread that writes dirty stores after a short delay.
+
+    Each store is registered with a save function and a delay. Callers only
+    ``mark_dirty()`` a store; the thread saves it once the delay since it
+    first became dirty has passed, so a burst of changes costs one write and
+    the caller never waits on the disk. ``flush()`` writes every dirty store
+    immediately (shutdown, emergency stop). A failed save is retried after
+    the store's delay.
+    """
+
+    def __init__(self, default_delay=5.0, clock=time.monotonic, name='persistence'):
+        super().__init__(name=name, daemon=True)
+        self.default_delay = default_delay
+        self.clock = clock
+        self._stores = {}               # name -> [save, delay, dirty_since or None]
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self.writes = 0
+        self.failures = 0
+        self.on_write = None            # on_write(seconds, name) after each successful save
+
+    def register(self, name, save, delay=None):
+        """Add a store; save() writes it and raises on failure"""
+        with self._lock:
+            self._stores[name] = [save, self.default_delay if delay is None else delay, None]
+
+    def mark_dirty(self, name):
+        """Note that a store changed; it is written within its delay"""
+        with self._lock:
+            store = self._stores[name]
+            if store[2] is not None:
+                return
+            store[2] = self.clock()
+        self._wake.set()
+
+    def is_dirty(self, name=None):
+        """True if the store (or any store) has unwritten changes"""
+        with self._lock:
+            if name is not None:
+                return self._stores[name][2] is not None
+            return any(store[2] is not None for store in self._stores.values())
+
+    def _write(self, name):
+        with self._write_lock:
+            with self._lock:
+                store = self._stores[name]
+                if store[2] is None:
+                    return True
+                save = store[0]
+                store[2] = None
+            try:
+                started = time.perf_counter()
+                save()
+                self.writes += 1
+                if self.on_write is not None:
+                    self.on_write(time.perf_counter() - started, name)
+                return True
+            except Exception as e:
+                self.failures += 1
+                print(f"⚠️  Error saving {name}: {e}")
+                with self._lock:
+                    if store[2] is None:
+                        store[2] = self.clock()
+                return False
+
+    def flush(self, names=None):
+        """Write dirty stores now; returns True if every write succeeded"""
+        ok = True
+        for name in list(names if names is not None else self._stores):
+            ok = self._write(name) and ok
+        return ok
+
+    def _flush_due(self):
+        """Write stores whose delay has passed; returns seconds until the next one is due"""
+        now = self.clock()
+        due = []
+        next_due = None
+        with self._lock:
+            for name, (_, delay, dirty_since) in self._stores.items():
+                if dirty_since is None:
+                    continue
+                if dirty_since + delay <= now:
+                    due.append(name)
+                elif next_due is None or dirty_since + delay < next_due:
+                    next_due = dirty_since + delay
+        for name in due:
+            self._write(name)
+        return None if next_due is None else max(0.0, next_due - self.clock())
+
+    def run(self):
+        while not self._stopped.is_set():
+            self._wake.clear()
+            timeout = self._flush_due()
+            self._wake.wait(timeout)
+
+    def stop(self):
+        """Stop the thread and write everything still dirty"""
+        self._stopped.set()
+        self._wake.set()
+        if self.is_alive():
+            self.join(timeout=10)
+        return self.flush()
@@ -0,0 +1,720 @@
+#!/usr/bin/env python3
+"""
+ATO Aquarium Monitor - Multi-Tank Mode
+License: MIT
+
+One process driving several float/pump/sensor sets, listed as TANKS in
+config.py (see config.example.py) and started by ato_monitor.py:
+- Each tank's state is a TankState with __slots__. Its float switch, pump
+  and fill timeout are a FillControl (ato_control.py), the same code as the
+  single-tank mode; everything else (MQTT connection, change-only publisher,
+  scheduler, alert rules, temperature sampler and persistence thread) is
+  shared. Each tank has its own state file, so a write covers only the
+  tank that changed
+- One control loop services every tank. A float edge wakes it for that tank
+  only; tanks with a pending debounce or a running pump are also stepped
+- Commands arrive on four wildcard subscriptions (aquarium/+/refill, ...)
+  and are run by the control loop, so tank state has a single writer
+- One bulk DS18B20 conversion reads every tank's sensor
+
+Each tank publishes under aquarium/<tank>/... A tank costs a few hundred
+bytes plus its activation timestamps; adding tanks adds no threads,
+connections or subscriptions.
+
+Multi-tank mode covers fill control and safety, usage and reservoir
+tracking, flow calibration, temperature trends and alerts. Rollups,
+seasonal stats, pump health and the history query API remain single-tank.
+"""
+
+import functools
+import os
+import pickle
+import queue
+import threading
+import time
+from array import array
+from datetime import date
+
+from ato_alerts import AlertEngine
+from ato_analytics import ActivationWindows, FlowCalibration, TempTrend
+from ato_control import FillControl, FloatFilter
+from ato_hal import create_tank_backends
+from ato_metrics import MonitorMetrics, instrument, timed
+from ato_mqtt import ChangePublisher, PayloadCache
+from ato_scheduler import Scheduler
+from ato_sensors import TempSampler, map_sensors
+import ato_storage
+from ato_storage import PersistenceManager, atomic_pickle
+
+REQUIRED_KEYS = ('float_pin', 'pump_pin')
+OPTIONAL_KEYS = {
+    # key: single-tank setting used when the tank does not set it (None = no default)
+    'temp_sensor_id': None,
+    'temp_offset': None,
+    'reservoir_capacity': 'RESERVOIR_CAPACITY',
+    'liters_per_activation': 'LITERS_PER_ACTIVATION',
+    'max_fill_duration': 'MAX_FILL_DURATION',
+    'low_reservoir_warning': 'LOW_RESERVOIR_WARNING',
+}
+RESERVED_NAMES = ('ato', 'temp')    # single-tank topics live under aquarium/ato and aquarium/temp
+COMMANDS = ('reset', 'refill', 'enable', 'pump_manual')
+
+# TankMonitor methods timed into ato_function_duration_seconds (see ato_monitor.METRICS_HOT_PATHS)
+METRICS_HOT_PATHS = ('handle_float_change', 'check_alerts', 'publish_stats', 'build_stats',
+                     'sample_temperatures', 'record_refill', 'handle_command', 'rollover_day', 'save')
+
+
+def parse_tanks(tanks, monitor):
+    """Validate TANKS and fill in defaults; returns {name: settings}"""
+    parsed = {}
+    for name, entry in tanks.items():
+        if not name or name in RESERVED_NAMES or any(c in name for c in '/+#'):
+            raise ValueError(f"Invalid tank name {name!r} (no '/', '+' or '#'; not {' or '.join(RESERVED_NAMES)})")
+        unknown = set(entry) - set(REQUIRED_KEYS) - set(OPTIONAL_KEYS)
+        if unknown:
+            raise ValueError(f"Tank {name!r}: unknown settings {', '.join(sorted(unknown))}")
+        missing = [key for key in REQUIRED_KEYS if key not in entry]
+        if missing:
+            raise ValueError(f"Tank {name!r}: missing {', '.join(missing)}")
+        settings = {key: entry[key] for key in REQUIRED_KEYS}
+        for key, default in OPTIONAL_KEYS.items():
+            settings[key] = entry.get(key, getattr(monitor, default) if default else None)
+        parsed[name] = settings
+    pins = [pin for settings in parsed.values() for pin in (settings['float_pin'], settings['pump_pin'])]
+    if len(pins) != len(set(pins)):
+        raise ValueError("TANKS: every float and pump pin must be different")
+    return parsed
+
+
+# ============================================================================
+# PER-TANK STATE
+# ============================================================================
+
+
+class TankState:
+    """One float switch, pump, reservoir and (optional) temperature sensor"""
+
+    __slots__ = ('name', 'prefix', 'gpio', 'fill', 'sensor_id', 'temp_offset',
+                 'reservoir_capacity', 'low_reservoir_warning', 'liters_per_activation',
+                 'activation_count', 'activations_total', 'daily_usage',
+                 'reservoir_level', 'last_activation', 'activations_since_refill', 'activations',
+                 'calibration', 'temperature', 'temp_seq', 'trend', 'alerts', 'published_alerts_version')
+
+    def __init__(self, name, settings, gpio, monitor, rules, now):
+        self.name = name
+        self.prefix = f"aquarium/{name}"
+        self.gpio = gpio
+        self.fill = None                    # FillControl, created by TankMonitor
+        self.sensor_id = settings['temp_sensor_id']
+        self.temp_offset = settings['temp_offset'] or 0.0
+        self.reservoir_capacity = settings['reservoir_capacity']
+        self.low_reservoir_warning = settings['low_reservoir_warning']
+        self.liters_per_activation = settings['liters_per_activation']
+        self.activation_count = 0
+        self.activations_total = 0          # since the process started
+        self.daily_usage = 0.0
+        self.reservoir_level = self.reservoir_capacity
+        self.last_activation = now          # epoch seconds
+        self.activations_since_refill = 0
+        self.activations = ActivationWindows(monitor.RATE_WINDOWS, monitor.ACTIVATION_RETENTION_DAYS * 86400)
+        self.calibration = FlowCalibration(monitor.CALIBRATION_REFILL_ERROR, monitor.CALIBRATION_DRIFT)
+        self.temperature = None
+        self.temp_seq = None
+        self.trend = TempTrend(monitor.TEMP_TREND_WINDOWS)
+        self.alerts = AlertEngine(rules)
+        self.published_alerts_version = None
+
+    def to_dict(self):
+        return {'daily_usage': self.daily_usage, 'activation_count': self.activation_count,
+                'reservoir_level': self.reservoir_level, 'last_activation': self.last_activation,
+                'activations_since_refill': self.activations_since_refill,
+                'liters_per_activation': self.liters_per_activation,
+                'activations': array('d', self.activations).tobytes(),
+                'calibration': self.calibration.to_dict()}
+
+    def from_dict(self, data):
+        self.daily_usage = data.get('daily_usage', 0.0)
+        self.activation_count = data.get('activation_count', 0)
+        self.reservoir_level = data.get('reservoir_level', self.reservoir_capacity)
+        self.last_activation = data.get('last_activation', self.last_activation)
+        self.activations_since_refill = data.get('activations_since_refill', 0)
+        self.liters_per_activation = data.get('liters_per_activation', self.liters_per_activation)
+        timestamps = array('d')
+        timestamps.frombytes(data.get('activations', b''))
+        self.activations.clear()
+        self.activations.extend(timestamps)
+        self.calibration.from_dict(data.get('calibration', {}))
+
+
+# ============================================================================
+# SHARED CONTROL LOOP
+# ============================================================================
+
+
+class TankMonitor:
+    """Every configured tank behind one control loop and one MQTT connection.
+
+    ``monitor`` is the ato_monitor module: its settings, clocks and alert
+    rules are shared with the single-tank mode.
+    """
+
+    def __init__(self, monitor, backends=None):
+        self.monitor = monitor
+        settings = parse_tanks(monitor.TANKS, monitor)
+        if backends is None:
+            backends = create_tank_backends(
+                monitor.HARDWARE_BACKEND,
+                {name: (tank['float_pin'], tank['pump_pin']) for name, tank in settings.items()},
+                monitor.MQTT_USER, monitor.MQTT_PASS,
+                [tank['temp_sensor_id'] for tank in settings.values() if tank['temp_sensor_id']])
+        gpios, self.w1, self.client = backends
+
+        stats_interval = monitor.MQTT_MIN_INTERVALS.get("aquarium/ato/stats")
+        min_intervals = dict(monitor.MQTT_MIN_INTERVALS)
+        if stats_interval:
+            min_intervals.update({f"aquarium/{name}/stats": stats_interval for name in settings})
+        self.publisher = ChangePublisher(self.client, monitor.MQTT_FULL_REFRESH_INTERVAL, min_intervals,
+                                         clock=lambda: monitor.monotonic_clock())
+
+        now = monitor.wall_clock().timestamp()
+        rules = monitor.create_alert_rules()        # rules are stateless: limits come with each tank's signals
+        self.tanks = {}
+        for name, tank_settings in settings.items():
+            gpios[name].set_pump(False)             # Start with every pump OFF
+            tank = self.tanks[name] = TankState(name, tank_settings, gpios[name], monitor, rules, now)
+            tank.fill = FillControl(gpios[name], self.client, self.publisher, tank.prefix,
+                                    tank_settings['max_fill_duration'], clock=lambda: monitor.wall_clock(),
+                                    on_cycle=functools.partial(self.record_cycle, tank), label=f"[{name}] ")
+        self.payload_cache = PayloadCache(monitor.JSON_ENCODER)
+        self.scheduler = Scheduler(clock=lambda: monitor.monotonic_clock())
+        self.persistence = PersistenceManager(monitor.PERSIST_WRITE_DELAY, clock=lambda: monitor.monotonic_clock())
+        for tank in self.tanks.values():
+            self.persistence.register(self._store(tank), functools.partial(self.write_state, tank))
+        self.day = monitor.wall_clock().date()
+        self.sampler = None
+        self.metrics = None                         # MonitorMetrics when METRICS_PORT is set
+        self.edge_detection = False
+        self.commands = queue.SimpleQueue()         # MQTT messages for the control loop
+        self.wake = threading.Event()
+        self._edges = set()                         # tanks whose float moved since the last step
+        self._edges_lock = threading.Lock()
+        self._busy = set()                          # tanks with a pending debounce or running pump
+
+    # Startup / shutdown -----------------------------------------------------
+
+    def start(self):
+        """Watch every float, load the saved state, connect and schedule the periodic jobs"""
+        monitor = self.monitor
+        self.edge_detection = monitor.FLOAT_EDGE_DETECT
+        for tank in self.tanks.values():
+            if not self.edge_detection:
+                break
+            try:
+                tank.gpio.add_float_callback(lambda channel, tank=tank: self.on_edge(tank))
+            except Exception as e:
+                print(f"⚠️  Float edge detection unavailable, polling every {monitor.FLOAT_POLL_INTERVAL}s: {e}")
+                self.edge_detection = False
+        for tank in self.tanks.values():
+            if self.edge_detection:
+                tank.fill.float_filter = FloatFilter(tank.gpio.read_float(),
+                                                     start_hold=monitor.FLOAT_START_DEBOUNCE_MS / 1000.0,
+                                                     stop_hold=monitor.FLOAT_STOP_DEBOUNCE_MS / 1000.0)
+            else:
+                tank.fill.float_filter = FloatFilter(tank.gpio.read_float())
+            tank.gpio.start()
+
+        self.load_state()
+        self.connect_mqtt()
+        self.start_sampler()
+        self.persistence.start()
+        self.schedule_jobs()
+
+    def stop(self):
+        """Pumps off, threads stopped and the state files written"""
+        self.monitor.ignore_sigterm()
+        for tank in self.tanks.values():
+            if tank.fill.pump_running:
+                tank.fill.stop_pump()
+        if self.sampler is not None:
+            self.sampler.stop()
+        self.persistence.stop()
+        if self.metrics is not None:
+            self.metrics.stop()
+        self.client.loop_stop()
+        for tank in self.tanks.values():
+            tank.gpio.cleanup()
+
+    def run(self):
+        """Control loop: step the tanks that need it, then sleep until the next edge, command or deadline"""
+        try:
+            while True:
+                self.control_step()
+                timeout = max(0.0, self.next_wakeup() - self.monitor.monotonic_clock())
+                if not self.edge_detection:
+                    timeout = min(self.monitor.FLOAT_POLL_INTERVAL, timeout)
+                self.wake.wait(timeout)
+                self.wake.clear()
+        except (KeyboardInterrupt, SystemExit):     # SystemExit: SIGTERM, see ato_monitor.main()
+            print("\n\n🛑 Shutting down...")
+        finally:
+            self.stop()
+            print("✅ Goodbye!")
+
+    # Persistence -----------------------------------------------------------
+
+    def state_file(self, tank):
+        """TANKS_STATE_FILE with the tank's name added: ato_tanks.pkl -> ato_tanks_<tank>.pkl"""
+        base, ext = os.path.splitext(self.monitor.TANKS_STATE_FILE)
+        return f"{base}_{tank.name}{ext}"
+
+    @staticmethod
+    def _store(tank):
+        return f"tank_{tank.name}"
+
+    def load_state(self):
+        """Restore every tank's counters, activations and calibration"""
+        loaded = 0
+        for tank in self.tanks.values():
+            path = self.state_file(tank)
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, 'rb') as f:
+                    data = pickle.load(f)
+                tank.from_dict(data.get('tank', {}))
+                saved_day = data.get('day')
+                if self.monitor.DAILY_USAGE_ROLLOVER and saved_day and date.fromisoformat(saved_day) != self.day:
+                    tank.daily_usage = 0.0
+                    tank.activation_count = 0
+                loaded += 1
+            except Exception as e:
+                print(f"⚠️  [{tank.name}] Error loading tank state: {e}")
+        if loaded:
+            print(f"✅ Loaded state for {loaded} tanks")
+
+    def write_state(self, tank):
+        atomic_pickle(self.state_file(tank), {'day': self.day.isoformat(), 'tank': tank.to_dict()})
+
+    def save(self, tank):
+        """Schedule `tank`'s state file to be written; the other tanks' files are left alone"""
+        self.persistence.mark_dirty(self._store(tank))
+
+    # Control -----------------------------------------------------------------
+
+    def on_edge(self, tank):
+        """GPIO callback thread: note the tank and wake the control loop"""
+        with self._edges_lock:
+            self._edges.add(tank)
+        self.wake.set()
+
+    def control_step(self):
+        """One pass: queued commands, the tanks that need stepping, due jobs, held-back publishes"""
+        monitor = self.monitor
+        self.run_commands()
+        today = monitor.wall_clock().date()
+        if monitor.DAILY_USAGE_ROLLOVER and today != self.day:
+            self.rollover_day(today)
+
+        if self.edge_detection:
+            with self._edges_lock:
+                tanks, self._edges = self._edges, set()
+            tanks |= self._busy
+        else:
+            tanks = self.tanks.values()
+        now = monitor.monotonic_clock()
+        self._busy = {tank for tank in tanks if self.tank_step(tank, now)}
+
+        self.scheduler.run_due()
+        self.publisher.flush_pending()
+
+    def tank_step(self, tank, now):
+        """Float switch and fill timeout of one tank; True if it must be stepped again"""
+        new_state = tank.fill.update(tank.gpio.read_float(), now)
+        if new_state is not None:
+            self.handle_float_change(tank, new_state)
+        if tank.fill.check_timeout():
+            self.persistence.flush()
+            self.check_alerts(tank)
+        return tank.fill.needs_attention()
+
+    def next_wakeup(self):
+        """Monotonic time the loop next has work for a job, held-back publish, debounce or fill timeout"""
+        monitor = self.monitor
+        now = monitor.monotonic_clock()
+        deadline = self.scheduler.next_deadline()
+        if deadline is None:
+            deadline = now + 60.0
+        pending_publish = self.publisher.next_pending_deadline()
+        if pending_publish is not None:
+            deadline = min(deadline, pending_publish)
+        for tank in self._busy:
+            pending_fill = tank.fill.next_deadline(now)
+            if pending_fill is not None:
+                deadline = min(deadline, pending_fill)
+        return deadline
+
+    def handle_float_change(self, tank, state):
+        """Start or stop a tank's pump for a debounced float level (0 = water low)"""
+        # Counted up front; record_cycle() corrects it to the cycle's runtime
+        action = tank.fill.float_changed(state, tank.liters_per_activation)
+        if action is None:
+            return
+        self.record_pump_reaction(tank, action)
+        if action == 'start':
+            tank.activation_count += 1
+            tank.activations_total += 1
+            tank.daily_usage += tank.liters_per_activation
+            tank.reservoir_level -= tank.liters_per_activation
+            tank.last_activation = tank.fill.fill_started.timestamp()
+            tank.activations.add(tank.last_activation)
+            tank.activations_since_refill += 1
+
+            self.publish_stats(tank)
+            self.check_alerts(tank)
+            self.save(tank)
+            print(f"💧 [{tank.name}] ATO activation #{tank.activation_count} "
+                  f"(#{tank.activations_since_refill} since refill)")
+        else:
+            self.publish_stats(tank)
+
+    def record_pump_reaction(self, tank, action):
+        float_filter = tank.fill.float_filter
+        if self.metrics is not None and float_filter.changed_at is not None:
+            self.metrics.pump_reaction_seconds.observe(
+                self.monitor.monotonic_clock() - float_filter.changed_at, tank.name, action)
+
+    def record_cycle(self, tank, runtime_seconds, deducted):
+        """FillControl.on_cycle: correct usage and reservoir to the cycle's estimated volume"""
+        tank.calibration.add_cycle(runtime_seconds)
+        volume = tank.calibration.cycle_volume(runtime_seconds, tank.liters_per_activation)
+        tank.reservoir_level -= volume - deducted
+        tank.daily_usage += volume - deducted
+        self.apply_calibration(tank)
+        self.save(tank)
+
+    def rollover_day(self, today):
+        """Reset every tank's daily counters once the local date has changed"""
+        self.day = today
+        for tank in self.tanks.values():
+            tank.daily_usage = 0.0
+            tank.activation_count = 0
+            self.publish_stats(tank)
+            self.save(tank)
+        print(f"📊 Daily counters reset for {len(self.tanks)} tanks")
+
+    # Calibration -----------------------------------------------------------
+
+    def apply_calibration(self, tank):
+        liters = tank.calibration.liters_per_activation()
+        if liters is not None:
+            tank.liters_per_activation = liters
+
+    def record_refill(self, tank, liters_added):
+        if tank.calibration.add_refill(liters_added, self.monitor.wall_clock().timestamp()):
+            self.apply_calibration(tank)
+            print(f"🎯 [{tank.name}] Auto-calibration updated: {tank.liters_per_activation:.3f}L/activation "
+                  f"(confidence: {tank.calibration.confidence()}%)")
+        tank.activations_since_refill = 0
+        tank.reservoir_level = tank.reservoir_capacity
+        self.save(tank)
+
+    # Temperature -----------------------------------------------------------
+
+    def start_sampler(self):
+        """One background sampler (one bulk conversion) for every tank's sensor"""
+        monitor = self.monitor
+        configured = {tank.name: tank.sensor_id for tank in self.tanks.values() if tank.sensor_id}
+        if not configured:
+            return
+        try:
+            mapping = map_sensors(self.w1.discover(), configured, auto_detect=False)
+        except Exception as e:
+            print(f"⚠️  Error finding temperature sensors: {e}")
+            return
+        for name in configured:
+            if name not in mapping:
+                print(f"⚠️  [{name}] Temperature sensor {configured[name]} not found")
+        if not mapping:
+            return
+        readers = {name: self.w1.reader(path) for name, path in mapping.items()}
+        offsets = {name: lambda tank=self.tanks[name]: tank.temp_offset for name in mapping}
+        bulk_trigger = self.w1.bulk_trigger() if len(readers) > 1 else None
+        if self.metrics is not None:
+            readers, bulk_trigger = self.metrics.timed_readers(readers, bulk_trigger)
+        self.sampler = TempSampler(readers, interval=monitor.TEMP_SAMPLE_INTERVAL, offsets=offsets,
+                                   bulk_trigger=bulk_trigger, name='tank-temp-sampler')
+        self.sampler.start()
+
+    def sample_temperatures(self):
+        """Scheduled job: take each tank's new sampler reading"""
+        snapshots = self.sampler.snapshots
+        for name, reading in snapshots.items():
+            tank = self.tanks[name]
+            if reading.raw is None or reading.seq == tank.temp_seq:
+                continue
+            if time.monotonic() - reading.monotonic > self.monitor.TEMP_MAX_AGE:
+                tank.temperature = None
+                continue
+            tank.temp_seq = reading.seq
+            tank.temperature = reading.calibrated
+            tank.trend.add(reading.timestamp, reading.calibrated)
+            self.publisher.publish(f"{tank.prefix}/temperature", reading.calibrated)
+
+    # Alerts ------------------------------------------------------------------
+
+    def rates(self, tank, now):
+        """lph_<window> from the tank's activation windows (see ato_monitor.calculate_lph)"""
+        counts = tank.activations.counts(now)
+        if not tank.activations:
+            return {f"lph_{name}": 0 for name in counts}
+        hours_of_history = (now - tank.activations.oldest()) / 3600
+        rates = {}
+        for name, seconds in self.monitor.RATE_WINDOWS.items():
+            hours = seconds / 3600 if name == '1h' else min(seconds / 3600, hours_of_history)
+            rates[f"lph_{name}"] = round(counts[name] * tank.liters_per_activation / hours, 3) if hours > 0 else 0
+        return rates
+
+    def alert_signals(self, tank, now, rates):
+        """Inputs of the shared alert rules for one tank"""
+        trend = tank.trend.anomaly()
+        return {
+            **tank.fill.alert_signals(),
+            'temperature': tank.temperature,
+            'temp_trend': round(trend['ratio'], 2) if trend else None,
+            'temp_trend_detail': trend,
+            'lph_1h': rates['lph_1h'],
+            'lph_24h': rates['lph_24h'],
+            'lph_30d': rates['lph_30d'],
+            'activations_1h': tank.activations.count('1h', now),
+            'hours_since': (now - tank.last_activation) / 3600,
+            'activation_count': tank.activation_count,
+            'daily_usage': tank.daily_usage,
+            'reservoir_level': tank.reservoir_level,
+            'low_reservoir_warning': tank.low_reservoir_warning,
+            'pump_health': None,
+            'pump_reasons': [],
+        }
+
+    def check_alerts(self, tank):
+        """Update a tank's alert states; only transitions are printed and published"""
+        wall = self.monitor.wall_clock()
+        now = wall.timestamp()
+        for transition in tank.alerts.evaluate(self.alert_signals(tank, now, self.rates(tank, now)), wall):
+            if transition['severity'] is None:
+                print(f"✅ [{tank.name}] Alert cleared: {transition['message']}")
+            else:
+                print(f"{'🚨' if transition['severity'] == 'critical' else '⚠️ '} [{tank.name}] Alert: {transition['message']}")
+
+        if tank.alerts.version == tank.published_alerts_version:
+            return
+        tank.published_alerts_version = tank.alerts.version
+        active = tank.alerts.active_alerts()
+        self.publisher.publish(f"{tank.prefix}/alerts", self.payload_cache.encode(
+            [{"severity": a['severity'], "message": a['message']} for a in active]))
+        for severity in ('critical', 'warning'):
+            latest = tank.alerts.latest(severity)
+            self.publisher.publish(f"{tank.prefix}/alert_{severity}", latest['message'] if latest else "")
+
+    def check_all_alerts(self):
+        for tank in self.tanks.values():
+            self.check_alerts(tank)
+
+    # MQTT --------------------------------------------------------------------
+
+    def build_stats(self, tank, now):
+        rates = self.rates(tank, now)
+        hours_until_empty = tank.reservoir_level / rates['lph_30d'] if rates['lph_30d'] > 0 else 999
+        return {
+            "daily_usage": round(tank.daily_usage, 2),
+            "activation_count": tank.activation_count,
+            "total_activations_30d": tank.activations.count('30d', now),
+            "hours_since_last": round((now - tank.last_activation) / 3600, 1),
+            "reservoir_level": round(tank.reservoir_level, 1),
+            "reservoir_percent": round(tank.reservoir_level / tank.reservoir_capacity * 100, 0),
+            "days_until_empty": round(hours_until_empty / 24, 1),
+            **tank.fill.stats(),
+            "calibrated_lph": round(tank.liters_per_activation, 3),
+            "calibration_confidence": tank.calibration.confidence(),
+            "pump_flow_lph": round(tank.calibration.rate * 3600, 1) if tank.calibration.rate is not None else None,
+            "activations_since_refill": tank.activations_since_refill,
+            "temperature": tank.temperature,
+            "temp_trend": tank.trend.summary(),
+            "active_alerts": len(tank.alerts.active),
+            **rates
+        }
+
+    def publish_stats(self, tank):
+        """Publish one tank's stats (unchanged values are skipped)"""
+        stats = self.build_stats(tank, self.monitor.wall_clock().timestamp())
+        prefix = tank.prefix
+        self.publisher.publish(f"{prefix}/stats", self.payload_cache.encode(stats))
+        self.publisher.publish(f"{prefix}/daily_usage", stats["daily_usage"])
+        self.publisher.publish(f"{prefix}/activations", stats["activation_count"])
+        self.publisher.publish(f"{prefix}/reservoir_level", stats["reservoir_level"])
+        self.publisher.publish(f"{prefix}/reservoir_percent", stats["reservoir_percent"])
+        self.publisher.publish(f"{prefix}/days_until_empty", stats["days_until_empty"])
+        self.publisher.publish(f"{prefix}/monitoring_enabled", "ON" if tank.fill.monitoring_enabled else "OFF")
+        self.publisher.publish(f"{prefix}/calibrated_lph", stats["calibrated_lph"])
+        self.publisher.publish(f"{prefix}/calibration_confidence", stats["calibration_confidence"])
+        self.publisher.publish(f"{prefix}/lph_24h", stats["lph_24h"])
+
+    def publish_all_stats(self):
+        for tank in self.tanks.values():
+            self.publish_stats(tank)
+
+    def connect_mqtt(self):
+        """Start connecting to the broker; paho keeps retrying in the background until it answers"""
+        monitor = self.monitor
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.reconnect_delay_set(min_delay=1, max_delay=monitor.MQTT_RECONNECT_MAX_DELAY)
+        try:
+            self.client.connect_async(monitor.MQTT_BROKER, monitor.MQTT_PORT, 60)
+        except Exception as e:
+            print(f"⚠️  Invalid MQTT broker setting {monitor.MQTT_BROKER}:{monitor.MQTT_PORT}: {e}")
+            return
+        self.client.loop_start()
+
+    def on_connect(self, client, userdata, flags, rc):
+        """(Re)subscribe and bring Home Assistant up to date after every connect"""
+        if rc != 0:
+            print(f"⚠️  MQTT broker refused the connection (rc={rc}), retrying")
+            return
+        print(f"✅ Connected to MQTT broker at {self.monitor.MQTT_BROKER}:{self.monitor.MQTT_PORT}")
+        for command in COMMANDS:
+            client.subscribe(f"aquarium/+/{command}")
+        for tank in self.tanks.values():
+            client.publish(f"{tank.prefix}/pump_state", "ON" if tank.fill.pump_running else "OFF")
+        self.publisher.refresh(force=True)
+
+    def on_message(self, client, userdata, msg):
+        """MQTT thread: queue the command for the control loop"""
+        self.commands.put(msg)
+        self.wake.set()
+
+    def run_commands(self):
+        while True:
+            try:
+                msg = self.commands.get_nowait()
+            except queue.Empty:
+                return
+            self.handle_command(msg)
+
+    def handle_command(self, msg):
+        """Act on one aquarium/<tank>/<command> message"""
+        parts = msg.topic.split('/')
+        if len(parts) != 3 or parts[1] not in self.tanks or parts[2] not in COMMANDS:
+            return
+        tank, command = self.tanks[parts[1]], parts[2]
+        payload = msg.payload.decode(errors='replace').strip().lower()
+
+        if command == 'reset':
+            tank.daily_usage = 0.0
+            tank.activation_count = 0
+            self.save(tank)
+            print(f"📊 [{tank.name}] Daily counters reset")
+
+        elif command == 'refill':
+            try:
+                liters_added = float(payload) if payload else tank.reservoir_capacity
+            except ValueError:
+                liters_added = tank.reservoir_capacity
+            self.record_refill(tank, liters_added)
+            print(f"💧 [{tank.name}] Reservoir marked as refilled: {liters_added}L (used for calibration)")
+
+        elif tank.fill.command(command, payload):      # enable, pump_manual
+            self._busy.add(tank)
+
+        self.publish_stats(tank)
+        self.check_alerts(tank)
+
+    # Metrics -----------------------------------------------------------------
+
+    def setup_metrics(self):
+        """Serve Prometheus metrics on METRICS_PORT, one series per tank, and time the hot paths"""
+        monitor = self.monitor
+        if not monitor.METRICS_PORT:
+            return
+        metrics = self.metrics = MonitorMetrics()
+        tanks = self.tanks.values()
+
+        def per_tank(field):
+            return lambda: {(tank.name,): getattr(tank, field) for tank in tanks}
+
+        def per_fill(field):
+            return lambda: {(tank.name,): getattr(tank.fill, field) for tank in tanks}
+
+        def snapshots():
+            return self.sampler.snapshots if self.sampler is not None else {}
+
+        metrics.counter('ato_activations', 'Pump activations since the process started',
+                        per_tank('activations_total'), ('tank',))
+        metrics.counter('ato_mqtt_publishes', 'MQTT messages sent', lambda: self.publisher.sent)
+        metrics.counter('ato_mqtt_publishes_suppressed', 'MQTT publishes skipped as unchanged',
+                        lambda: self.publisher.suppressed)
+        metrics.counter('ato_mqtt_publish_bytes', 'MQTT payload bytes sent', lambda: self.publisher.bytes_sent)
+        metrics.counter('ato_store_writes', 'Write-behind store saves', lambda: self.persistence.writes)
+        metrics.counter('ato_store_write_failures', 'Failed write-behind store saves',
+                        lambda: self.persistence.failures)
+        metrics.counter('ato_store_write_bytes', 'Bytes written to the data files (SQLite writes not included)',
+                        lambda: ato_storage.bytes_written)
+        metrics.counter('ato_sensor_read_errors', 'Failed DS18B20 reads',
+                        lambda: {(name,): reading.errors for name, reading in snapshots().items()}, ('sensor',))
+
+        metrics.gauge('ato_reservoir_liters', 'Estimated reservoir level', per_tank('reservoir_level'), ('tank',))
+        metrics.gauge('ato_reservoir_capacity_liters', 'Reservoir capacity', per_tank('reservoir_capacity'), ('tank',))
+        metrics.gauge('ato_daily_usage_liters', "Today's top-off volume", per_tank('daily_usage'), ('tank',))
+        metrics.gauge('ato_pump_running', '1 while the pump runs', per_fill('pump_running'), ('tank',))
+        metrics.gauge('ato_monitoring_enabled', '0 after a manual disable or emergency stop',
+                      per_fill('monitoring_enabled'), ('tank',))
+        metrics.gauge('ato_liters_per_activation', 'Calibrated volume per activation',
+                      per_tank('liters_per_activation'), ('tank',))
+        metrics.gauge('ato_calibration_confidence_percent', 'Flow calibration confidence',
+                      lambda: {(tank.name,): tank.calibration.confidence() for tank in tanks}, ('tank',))
+        metrics.gauge('ato_temperature_celsius', 'Latest calibrated temperature', per_tank('temperature'), ('sensor',))
+        metrics.gauge('ato_sensor_reading_age_seconds', 'Seconds since the last good DS18B20 reading',
+                      lambda: {(name,): self.sampler.age(name) for name in snapshots()}, ('sensor',))
+        metrics.gauge('ato_alerts_active', 'Active alerts',
+                      lambda: {(tank.name, severity): sum(1 for alert in tank.alerts.active_alerts()
+                                                          if alert['severity'] == severity)
+                               for tank in tanks for severity in ('warning', 'critical')}, ('tank', 'severity'))
+
+        instrument(self, metrics.function_seconds, METRICS_HOT_PATHS)
+        self.control_step = timed(metrics.loop_seconds, self.control_step)
+        self.persistence.on_write = metrics.store_write_seconds.observe
+        metrics.serve(monitor.METRICS_PORT, monitor.METRICS_BIND)
+
+    # Jobs ------------------------------------------------------------------
+
+    def schedule_jobs(self):
+        monitor = self.monitor
+        if self.sampler is not None:
+            self.scheduler.every('temperature', monitor.TEMP_SAMPLE_INTERVAL, self.sample_temperatures)
+        self.scheduler.every('alerts', monitor.ALERT_CHECK_INTERVAL, self.check_all_alerts,
+                             delay=monitor.ALERT_CHECK_INTERVAL)
+        self.scheduler.every('stats', monitor.STATS_PUBLISH_INTERVAL, self.publish_all_stats)
+        self.scheduler.every('mqtt_refresh', monitor.MQTT_FULL_REFRESH_INTERVAL,
+                             lambda: self.publisher.refresh(force=True), delay=monitor.MQTT_FULL_REFRESH_INTERVAL)
+        if monitor.DAILY_USAGE_ROLLOVER:
+            self.schedule_day_rollover()
+
+    def schedule_day_rollover(self):
+        """Wake at the next local midnight (control_step does the reset)"""
+        self.scheduler.every('day_rollover', 86400, self.schedule_day_rollover,
+                             delay=self.monitor.seconds_until_midnight())
+
+
+def run_tanks(monitor):
+    """Multi-tank entry point, called by ato_monitor.main() when TANKS is set"""
+    print("\n🚀 Starting ATO Aquarium Monitor (multi-tank)...")
+    print("=" * 60)
+    tanks = TankMonitor(monitor)
+    tanks.setup_metrics()
+    tanks.start()
+    for tank in tanks.tanks.values():
+        sensor = f", sensor {tank.sensor_id}" if tank.sensor_id else ""
+        print(f"   {tank.name}: float GPIO {monitor.TANKS[tank.name]['float_pin']}, "
+              f"pump GPIO {monitor.TANKS[tank.name]['pump_pin']}{sensor} -> {tank.prefix}/...")
+    print(f"✅ {len(tanks.tanks)} tanks active ({'edge-triggered' if tanks.edge_detection else 'polled'})")
+    print("=" * 60)
+    tanks.run()
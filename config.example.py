@@ -11,6 +11,31 @@ MQTT_PORT = 1883
 MQTT_USER = "your_mqtt_username"  # MQTT username
 MQTT_PASS = "your_mqtt_password"  # MQTT password
 
+# Stats topics are only published when their value changes. Everything is
+# re-sent every MQTT_FULL_REFRESH_INTERVAL seconds so Home Assistant catches
+# up after a restart. MQTT_MIN_INTERVALS rate-limits busy topics (seconds;
+# a key ending in '#' matches every topic with that prefix).
+MQTT_FULL_REFRESH_INTERVAL = 3600
+MQTT_MIN_INTERVALS = {"aquarium/ato/stats": 60}
+
+# JSON encoder for published payloads: "auto" uses orjson when installed
+# (pip3 install orjson, noticeably faster on a Pi Zero) and the standard
+# library otherwise; "json" or "orjson" force one.
+JSON_ENCODER = "auto"
+
+# The broker is connected in the background, so float/pump control starts
+# even when it is unreachable. Retries back off up to this many seconds.
+MQTT_RECONNECT_MAX_DELAY = 120
+
+# ============================================================================
+# HARDWARE BACKEND
+# ============================================================================
+# "pi" drives the real GPIO pins, 1-Wire bus and MQTT broker. "sim" runs
+# against a simulated float switch, fake DS18B20 and in-memory broker, for
+# trying the monitor out on a PC. The ATO_BACKEND environment variable
+# overrides this setting (e.g. ATO_BACKEND=sim python3 ato_monitor.py).
+HARDWARE_BACKEND = "pi"
+
 # ============================================================================
 # GPIO PIN CONFIGURATION (BCM numbering)
 # ============================================================================
@@ -18,11 +43,34 @@ FLOAT_PIN = 17  # Float switch input (GPIO 17, Pin 11)
 PUMP_PIN = 27   # Relay control output (GPIO 27, Pin 13)
 # Temperature sensor uses GPIO 4 (Pin 7) - configured in /boot/config.txt
 
+# Multi-tank mode: list every float/pump/sensor set to drive them all from
+# this one process (FLOAT_PIN/PUMP_PIN are then ignored). Each tank publishes
+# under aquarium/<name>/ and takes commands there; names must not be "ato" or
+# "temp". Optional per-tank keys: temp_sensor_id, temp_offset,
+# reservoir_capacity, liters_per_activation, max_fill_duration,
+# low_reservoir_warning (defaults are the single-tank settings below).
+# Counters and calibration are kept per tank in TANKS_STATE_FILE with
+# _<name> added (ato_tanks_reef.pkl).
+TANKS = {}
+# TANKS = {
+#     'reef': {'float_pin': 17, 'pump_pin': 27, 'temp_sensor_id': '28-0000000a1b2c'},
+#     'frag': {'float_pin': 22, 'pump_pin': 23, 'reservoir_capacity': 10.0},
+# }
+
+# Float switch detection. Edge-triggered mode reacts within milliseconds and
+# lets the monitor sleep between edges; set False to poll instead.
+FLOAT_EDGE_DETECT = True
+FLOAT_START_DEBOUNCE_MS = 100   # Float must stay low this long before the pump starts
+FLOAT_STOP_DEBOUNCE_MS = 20     # Float must stay high this long before the pump stops
+FLOAT_POLL_INTERVAL = 0.5       # Seconds between reads when polling
+
 # ============================================================================
 # TANK & RESERVOIR CONFIGURATION
 # ============================================================================
 RESERVOIR_CAPACITY = 23.0       # Reservoir capacity in liters
 LITERS_PER_ACTIVATION = 1.0     # Initial estimate (will auto-calibrate)
+CALIBRATION_REFILL_ERROR = 0.05 # How exact entered refill amounts are (fraction, 1σ)
+CALIBRATION_DRIFT = 0.02        # How much the pump flow may change per month (fraction, 1σ)
 
 # ============================================================================
 # FILE PATHS (Data storage)
@@ -34,6 +82,62 @@ PUMP_PERFORMANCE_FILE = "/home/pi/ato_pump_performance.pkl"
 TEMP_HISTORY_FILE = "/home/pi/ato_temp_history.pkl"
 TEMP_CALIBRATION_FILE = "/home/pi/ato_temp_calibration.pkl"
 
+# Activations are stored in an append-only log (one small write per activation).
+# Segment files are named <prefix>.<epoch>.alog; an existing HISTORY_FILE is
+# migrated automatically on first start.
+ACTIVATION_LOG_PREFIX = "/home/pi/ato_history"
+ACTIVATION_LOG_SEGMENT_DAYS = 7     # Each segment file covers this many days
+ACTIVATION_RETENTION_DAYS = 30      # Raw activations kept for rate calculations
+
+# Temperature readings live in a fixed-size ring file; only new readings are
+# written. An existing TEMP_HISTORY_FILE is migrated automatically.
+TEMP_HISTORY_RING_FILE = "/home/pi/ato_temp_history.ring"
+TEMP_HISTORY_SIZE = 10000           # Readings kept (~3.5 days at one per 30s)
+
+# Per-month usage totals behind the seasonal stats (rebuilt from history if missing)
+SEASONAL_STATS_FILE = "/home/pi/ato_seasonal.pkl"
+
+# Every pump cycle (time, runtime, volume) kept for the pump health analytics
+PUMP_CYCLES_FILE = "/home/pi/ato_pump_cycles.pkl"
+PUMP_ANALYTICS_DAYS = 1830      # Keep cycles this long (5 years)
+
+# Hourly and daily summaries (count/sum/min/max) of activations and
+# temperatures, kept long after the raw data above expires. They serve the
+# 7d/30d temperature stats and monthly usage.
+ROLLUP_FILE = "/home/pi/ato_rollups.pkl"
+ROLLUP_HOURLY_DAYS = 90         # Keep hourly summaries this long
+ROLLUP_DAILY_DAYS = 1830        # Keep daily summaries this long (5 years)
+
+# "files" keeps the files above. "sqlite" stores every activation, reading,
+# alert, pump cycle and refill in one database (WAL mode) so years of data
+# can be kept without loading it into RAM; the files above are imported on
+# first start and left in place.
+STORAGE_BACKEND = "files"
+SQLITE_FILE = "/home/pi/ato_data.db"
+
+# Record float edges, temperature samples and MQTT commands as JSON lines so
+# past periods can be replayed with different thresholds (see ato_replay.py).
+# About 150KB per day; None disables recording.
+EVENT_LOG_FILE = None   # e.g. "/home/pi/ato_events.jsonl"
+
+# Prometheus/OpenMetrics endpoint (http://<bind>:<port>/metrics): counters,
+# gauges and latency histograms for the hot paths, control loop, DS18B20
+# reads, store writes and pump reaction time. None disables it. Bind to
+# "0.0.0.0" to let a Prometheus server on another machine scrape it.
+METRICS_PORT = None     # e.g. 9101
+METRICS_BIND = "127.0.0.1"
+
+# ============================================================================
+# SCHEDULING (seconds)
+# ============================================================================
+TEMP_SAMPLE_INTERVAL = 30       # Temperature reading (done on a background thread)
+TEMP_MAX_AGE = 120              # Ignore cached readings older than this
+ALERT_CHECK_INTERVAL = 300      # Periodic alert check
+STATS_PUBLISH_INTERVAL = 300    # Periodic stats publish
+PERSIST_FLUSH_INTERVAL = 300    # Write buffered temperature history to disk
+PERSIST_WRITE_DELAY = 5         # Max delay before activations, calibration, alerts etc. are written
+DAILY_USAGE_ROLLOVER = True     # Reset daily usage at local midnight (no Home Assistant automation needed)
+
 # ============================================================================
 # ALERT THRESHOLDS
 # ============================================================================
@@ -43,6 +147,14 @@ MAX_HOURS_BETWEEN = 36          # Alert if no activations for this long
 MAX_DAILY_USAGE = 6.0           # Maximum liters per day (adjust for season)
 LOW_RESERVOIR_WARNING = 5.0     # Alert when reservoir drops below this
 MAX_FILL_DURATION = 30          # Maximum pump runtime in seconds (safety)
+PUMP_HEALTH_WARNING = 60        # Warn when the pump health score (0-100) drops to this
+PUMP_FLOW_DROP_WARNING = 15     # Flow drop vs. the pump's baseline (%) that costs 40 health points
+
+# An alert is recorded and published once when raised and once when cleared.
+# It clears only after the value is back inside the limit by a margin, so a
+# reading sitting on a threshold does not flap.
+ALERT_TEMP_HYSTERESIS = 0.3     # °C past a temperature limit before it clears
+ALERT_CLEAR_MARGIN = 0.1        # Fraction past other limits (usage, rates, reservoir) before they clear
 
 # ============================================================================
 # TEMPERATURE THRESHOLDS (°Celsius)
@@ -53,6 +165,17 @@ TEMP_MAX_WARNING = 28.0   # High temperature warning
 TEMP_MIN_CRITICAL = 20.0  # Critical low temperature (emergency)
 TEMP_MAX_CRITICAL = 30.0  # Critical high temperature (emergency)
 
+# Rate-of-change alerts. Each window is an exponentially weighted trend with
+# the given time constant; it warns when the temperature moves faster than
+# its limit (°C/h) and is critical at TEMP_TREND_CRITICAL_FACTOR times that.
+# Keep the slow limit above your tank's normal day/night swing.
+TEMP_TREND_WINDOWS = {
+    '10m': (600, 3.0),        # (time constant in seconds, limit in °C/h)
+    '1h': (3600, 0.6),
+    '2h': (2 * 3600, 0.3),
+}
+TEMP_TREND_CRITICAL_FACTOR = 2.0
+
 # ============================================================================
 # SEASONAL ADJUSTMENTS (Optional)
 # ============================================================================